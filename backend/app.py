@@ -48,6 +48,7 @@ from database.users_db import verify_user, get_user_by_id
 from models.user import User
 from models.user_session_model import UserSessionModel
 from models.audit_model import AuditModel, AuditAction, AuditResult
+from models.login_ubicacion_model import LoginUbicacionModel
 from models.cliente_model import ClienteModel
 from models.dominio_model import DominioModel
 from utils.password_policy import get_policy_info, PASSWORD_POLICY
@@ -748,6 +749,11 @@ def login():
                     detalles=detalles_login,
                     resultado=AuditResult.SUCCESS
                 )
+                # Mapa de logins del dashboard: ubicacion ya agrupada (sin leer el JSON despues)
+                LoginUbicacionModel.registrar(connection, empresa_id, _audit_user_id,
+                                              _audit_username, ubicacion)
+                # Logins anteriores a la migración 69 (una vez por BD, fuera de las lecturas)
+                LoginUbicacionModel.completar_historico(connection)
             except Exception:
                 pass
         threading.Thread(target=_log_login_audit, daemon=True).start()
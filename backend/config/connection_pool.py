@@ -0,0 +1,368 @@
+# ============================================================
+# ARCHIVO: config/connection_pool.py
+# Pool de conexiones pyodbc (thread-safe, por BD destino)
+# ============================================================
+
+import logging
+import os
+import threading
+import time
+
+import pyodbc
+
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+
+# Configuración (variables de entorno opcionales)
+POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+POOL_MAX_SIZE = env_int('DB_POOL_MAX_SIZE', 5)            # conexiones por BD y proceso
+POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 10)             # segundos esperando un hueco libre
+POOL_MAX_IDLE = env_int('DB_POOL_MAX_IDLE', 300)          # segundos ociosa antes de cerrarla
+POOL_MAX_LIFETIME = env_int('DB_POOL_MAX_LIFETIME', 1800)  # vida máxima de una conexión física
+POOL_PING_INTERVAL = env_int('DB_POOL_PING_INTERVAL', 30)  # ociosa más de esto → SELECT 1 antes de entregarla
+
+
+class PoolTimeoutError(Exception):
+    """No se ha liberado ninguna conexión del pool dentro del tiempo de espera."""
+
+
+class PooledConnection:
+    """
+    Envoltorio de pyodbc.Connection prestado por un ConnectionPool.
+
+    Se comporta como la conexión original (cursor, commit, rollback,
+    autocommit...), pero close() la devuelve al pool en lugar de cerrar
+    el socket. Así los `conn.close()` existentes siguen funcionando.
+
+    También es un context manager: al salir hace commit (o rollback si hubo
+    excepción) y devuelve la conexión al pool.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_created_at', created_at)
+
+    def __getattr__(self, name):
+        raw = object.__getattribute__(self, '_raw')
+        if raw is None:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        return getattr(raw, name)
+
+    def __setattr__(self, name, value):
+        # autocommit, timeout, etc. se aplican sobre la conexión real
+        setattr(self._raw, name, value)
+
+    @property
+    def closed(self):
+        return self._raw is None
+
+    def close(self):
+        """Devuelve la conexión al pool (idempotente)."""
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, '_raw', None)
+        self._pool._release(raw, self._created_at)
+
+    def discard(self):
+        """Cierra la conexión física sin devolverla al pool (p.ej. tras un error de red)."""
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, '_raw', None)
+        self._pool._release(raw, self._created_at, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        raw = self._raw
+        if raw is not None:
+            try:
+                if exc_type is None:
+                    if not raw.autocommit:
+                        raw.commit()
+                else:
+                    raw.rollback()
+            except pyodbc.Error:
+                self.discard()
+                return False
+        self.close()
+        return False
+
+    def __del__(self):
+        # Conexiones olvidadas sin close(): liberar el hueco para no agotar el pool
+        try:
+            if object.__getattribute__(self, '_raw') is not None:
+                self.discard()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones a una misma BD (servidor, base de datos, login).
+
+    - Máximo `max_size` conexiones (prestadas + ociosas) por proceso.
+    - Las conexiones ociosas más de `max_idle` segundos se cierran.
+    - Ninguna conexión física vive más de `max_lifetime` segundos.
+    - Antes de entregar una conexión ociosa más de `ping_interval` segundos
+      se comprueba con SELECT 1; si falla se descarta y se abre otra.
+    - Si el pool está lleno se espera hasta `timeout` segundos.
+    """
+
+    def __init__(self, conn_str, name='db', max_size=None, timeout=None,
+                 max_idle=None, max_lifetime=None, ping_interval=None,
+                 connect_timeout=10):
+        self.conn_str = conn_str
+        self.name = name
+        self.max_size = max_size or POOL_MAX_SIZE
+        self.timeout = POOL_TIMEOUT if timeout is None else timeout
+        self.max_idle = POOL_MAX_IDLE if max_idle is None else max_idle
+        self.max_lifetime = POOL_MAX_LIFETIME if max_lifetime is None else max_lifetime
+        self.ping_interval = POOL_PING_INTERVAL if ping_interval is None else ping_interval
+        self.connect_timeout = connect_timeout
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []        # [(raw, created_at, last_used)] — LIFO
+        self._in_use = 0
+        self._pid = os.getpid()
+
+        # Estadísticas
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'closed': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'ping_failures': 0,
+            'connect_time_ms_total': 0.0,
+            'connect_time_ms_max': 0.0,
+        }
+
+    # ---------------------------------------------------------
+    # API pública
+    # ---------------------------------------------------------
+
+    def acquire(self):
+        """
+        Presta una conexión del pool.
+
+        Returns:
+            PooledConnection
+
+        Raises:
+            PoolTimeoutError: si no se libera ninguna conexión a tiempo
+            pyodbc.Error: si falla la apertura de una conexión nueva
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            entry = None
+            got_slot = False
+            with self._cond:
+                self._check_fork()
+                to_close = self._pop_expired()
+                if self._idle:
+                    entry = self._idle.pop()
+                    self._in_use += 1
+                    got_slot = True
+                elif self._in_use + len(self._idle) < self.max_size:
+                    self._in_use += 1
+                    got_slot = True
+                else:
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    remaining = deadline - time.monotonic()
+                    if (remaining <= 0 or not self._cond.wait(remaining)) and not self._has_free_slot():
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Pool '{self.name}' agotado ({self.max_size} conexiones en uso)"
+                        )
+
+            self._close_raw(to_close)
+            if not got_slot:
+                continue
+
+            if entry is not None:
+                raw, created_at, last_used = entry
+                if time.monotonic() - last_used < self.ping_interval or self._ping(raw):
+                    with self._cond:
+                        self._stats['reused'] += 1
+                    return PooledConnection(self, raw, created_at)
+                # Conexión muerta: descartarla y abrir otra en el mismo hueco
+                self._close_raw([(raw, created_at, last_used)])
+
+            try:
+                raw, created_at = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            return PooledConnection(self, raw, created_at)
+
+    def stats(self):
+        """Devuelve un dict con el estado y contadores del pool."""
+        with self._cond:
+            created = self._stats['created']
+            return {
+                'name': self.name,
+                'max_size': self.max_size,
+                'size': self._in_use + len(self._idle),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': created,
+                'reused': self._stats['reused'],
+                'closed': self._stats['closed'],
+                'waits': self._stats['waits'],
+                'timeouts': self._stats['timeouts'],
+                'ping_failures': self._stats['ping_failures'],
+                'connect_time_ms_avg': round(self._stats['connect_time_ms_total'] / created, 1) if created else 0.0,
+                'connect_time_ms_max': round(self._stats['connect_time_ms_max'], 1),
+            }
+
+    def close_all(self):
+        """Cierra todas las conexiones ociosas (las prestadas se cierran al devolverse)."""
+        with self._cond:
+            to_close, self._idle = self._idle, []
+        self._close_raw(to_close)
+
+    # ---------------------------------------------------------
+    # Internos
+    # ---------------------------------------------------------
+
+    def _has_free_slot(self):
+        return bool(self._idle) or self._in_use + len(self._idle) < self.max_size
+
+    def _check_fork(self):
+        """Tras un fork (gunicorn) las conexiones heredadas no son utilizables."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._idle = []
+            self._in_use = 0
+
+    def _is_expired(self, created_at, last_used, now):
+        if self.max_lifetime and now - created_at >= self.max_lifetime:
+            return True
+        if self.max_idle and now - last_used >= self.max_idle:
+            return True
+        return False
+
+    def _pop_expired(self):
+        """Saca del pool las conexiones ociosas caducadas (llamar con el lock)."""
+        now = time.monotonic()
+        expired = [e for e in self._idle if self._is_expired(e[1], e[2], now)]
+        if expired:
+            self._idle = [e for e in self._idle if not self._is_expired(e[1], e[2], now)]
+        return expired
+
+    def _connect(self):
+        start = time.monotonic()
+        raw = pyodbc.connect(self.conn_str, timeout=self.connect_timeout)
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._cond:
+            self._stats['created'] += 1
+            self._stats['connect_time_ms_total'] += elapsed_ms
+            self._stats['connect_time_ms_max'] = max(self._stats['connect_time_ms_max'], elapsed_ms)
+        return raw, start
+
+    def _ping(self, raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['ping_failures'] += 1
+            return False
+
+    def _release(self, raw, created_at, discard=False):
+        """Devuelve una conexión física al pool (o la cierra si no es reutilizable)."""
+        if not discard:
+            try:
+                # Deshacer transacciones a medias y restaurar el modo por defecto
+                raw.rollback()
+                if raw.autocommit:
+                    raw.autocommit = False
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        with self._cond:
+            if os.getpid() != self._pid:
+                # Conexión prestada antes de un fork: no pertenece a este proceso
+                return
+            self._in_use = max(0, self._in_use - 1)
+            if not discard and not self._is_expired(created_at, now, now):
+                self._idle.append((raw, created_at, now))
+                raw = None
+            self._cond.notify()
+
+        if raw is not None:
+            self._close_raw([(raw, created_at, now)])
+
+    def _close_raw(self, entries):
+        for raw, _created_at, _last_used in entries:
+            try:
+                raw.close()
+            except Exception:
+                pass
+        if entries:
+            with self._cond:
+                self._stats['closed'] += len(entries)
+
+
+# ---------------------------------------------------------
+# Registro de pools por BD destino
+# ---------------------------------------------------------
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, conn_str, name=None, **kwargs):
+    """
+    Obtiene (o crea) el pool asociado a `key`.
+
+    Args:
+        key: tupla (dbserver, dbname, dblogin) que identifica la BD destino
+        conn_str: cadena de conexión ODBC
+        name: nombre descriptivo para estadísticas/logs
+
+    Si la cadena de conexión de una clave cambia (p.ej. nueva contraseña),
+    el pool anterior se vacía y se sustituye.
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.conn_str == conn_str:
+            return pool
+        old = pool
+        pool = ConnectionPool(conn_str, name=name or '/'.join(str(k) for k in key), **kwargs)
+        _pools[key] = pool
+    if old is not None:
+        logger.info(f"Pool '{old.name}' sustituido (cambio de cadena de conexión)")
+        old.close_all()
+    return pool
+
+
+def get_all_stats():
+    """Estadísticas de todos los pools del proceso."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [p.stats() for p in pools]
+
+
+def close_all_pools():
+    """Cierra las conexiones ociosas de todos los pools."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
@@ -31,6 +31,9 @@ try:
 except ImportError:
     pass
 
+# Importar tras cargar .env para que lea las variables DB_POOL_*
+from config import connection_pool
+
 
 class Database:
     """
@@ -48,7 +51,7 @@ class Database:
     @staticmethod
     def get_connection(empresa_cli_id=None):
         """
-        Crea y retorna una conexión a la BD de la empresa.
+        Retorna una conexión (del pool) a la BD de la empresa.
 
         Args:
             empresa_cli_id: ID de empresa (opcional, se obtiene de sesión si no se pasa)
@@ -66,21 +69,7 @@ class Database:
             db_config = session.get('db_config')
             if db_config and db_config.get('dbserver'):
                 # Ya tenemos los datos de conexión en sesión, usarlos directamente
-                server = db_config['dbserver']
-                if db_config.get('dbport') and db_config['dbport'] != 1433:
-                    server = f"{server},{db_config['dbport']}"
-
-                conn_str = (
-                    f"DRIVER={Database.DEFAULT_DRIVER};"
-                    f"SERVER={server};"
-                    f"DATABASE={db_config['dbname']};"
-                    f"UID={db_config['dblogin']};"
-                    f"PWD={db_config['dbpass']};"
-                    f"TrustServerCertificate=yes;"
-                    f"Encrypt=yes;"
-                    f"Connection Timeout=10;"
-                )
-                return pyodbc.connect(conn_str, timeout=10)
+                return Database._connect(db_config)
 
         # Si no hay datos en sesión, obtener empresa_cli_id
         if empresa_cli_id is None:
@@ -99,23 +88,50 @@ class Database:
         if not empresa:
             raise ValueError(f"Empresa con ID {empresa_cli_id} no encontrada")
 
-        # Construir string de conexión
-        server = empresa['dbserver']
-        if empresa['dbport'] and empresa['dbport'] != 1433:
-            server = f"{server},{empresa['dbport']}"
+        return Database._connect(empresa)
+
+    @staticmethod
+    def _connect(db_config):
+        """
+        Abre (o toma del pool) una conexión con los datos de conexión dados.
+
+        Las conexiones se agrupan en un pool por (dbserver, dbname, dblogin).
+        La conexión devuelta se usa igual que una pyodbc.Connection: close()
+        la devuelve al pool y también admite `with ... as conn`.
+
+        Args:
+            db_config: dict con dbserver, dbport, dbname, dblogin, dbpass
+        """
+        server = db_config['dbserver']
+        if db_config.get('dbport') and db_config['dbport'] != 1433:
+            server = f"{server},{db_config['dbport']}"
 
         conn_str = (
             f"DRIVER={Database.DEFAULT_DRIVER};"
             f"SERVER={server};"
-            f"DATABASE={empresa['dbname']};"
-            f"UID={empresa['dblogin']};"
-            f"PWD={empresa['dbpass']};"
+            f"DATABASE={db_config['dbname']};"
+            f"UID={db_config['dblogin']};"
+            f"PWD={db_config['dbpass']};"
             f"TrustServerCertificate=yes;"
             f"Encrypt=yes;"
             f"Connection Timeout=10;"
         )
 
-        return pyodbc.connect(conn_str, timeout=10)
+        if not connection_pool.POOL_ENABLED:
+            return pyodbc.connect(conn_str, timeout=10)
+
+        key = (server, db_config['dbname'], db_config['dblogin'])
+        return connection_pool.get_pool(key, conn_str).acquire()
+
+    @staticmethod
+    def get_pool_stats():
+        """
+        Estadísticas de los pools de conexión de este proceso.
+
+        Returns:
+            list de dicts (uno por BD destino) con size, in_use, idle, waits...
+        """
+        return connection_pool.get_all_stats()
 
     @staticmethod
     def get_empresa_erp(empresa_cli_id=None):
@@ -16,6 +16,60 @@ try:
 except ImportError:
     pass
 
+# Importar tras cargar .env para que lea las variables DB_POOL_*
+from config import connection_pool
+from utils.env import env_int
+
+
+def _load_config():
+    """
+    Lee la configuración de la BD central una sola vez (al importar el módulo).
+
+    Returns:
+        (conn_str, error): cadena de conexión, o mensaje de error si falta
+        alguna variable obligatoria.
+    """
+    # Leer variables de entorno (OBLIGATORIAS, sin valores por defecto)
+    server = os.environ.get('DB_CENTRAL_SERVER')
+    database = os.environ.get('DB_CENTRAL_NAME')
+    username = os.environ.get('DB_CENTRAL_USER')
+    password = os.environ.get('DB_CENTRAL_PASSWORD')
+    driver = os.environ.get('DB_DRIVER', '{ODBC Driver 18 for SQL Server}')
+
+    # Validar que las variables obligatorias estén definidas
+    if not server:
+        return None, "DB_CENTRAL_SERVER no está configurado. Defina la variable de entorno."
+    if not database:
+        return None, "DB_CENTRAL_NAME no está configurado. Defina la variable de entorno."
+    if not username:
+        return None, "DB_CENTRAL_USER no está configurado. Defina la variable de entorno."
+    if not password:
+        return None, "DB_CENTRAL_PASSWORD no está configurado. Defina la variable de entorno."
+
+    conn_str = (
+        f"DRIVER={driver};"
+        f"SERVER={server};"
+        f"DATABASE={database};"
+        f"UID={username};"
+        f"PWD={password};"
+        f"TrustServerCertificate=yes;"
+        f"Encrypt=yes;"
+        f"Connection Timeout=10;"
+    )
+    return conn_str, None
+
+
+_CONN_STR, _CONFIG_ERROR = _load_config()
+
+# Pool propio y pequeño: la BD central solo se usa para login, empresa_cliente y auditoría
+_pool = None
+if _CONN_STR:
+    _pool = connection_pool.ConnectionPool(
+        _CONN_STR,
+        name='central',
+        max_size=env_int('DB_CENTRAL_POOL_MAX_SIZE', 3),
+    )
+
 
 class DatabaseCentral:
     """
@@ -27,36 +81,32 @@ class DatabaseCentral:
     - DB_CENTRAL_USER: Usuario de BD
     - DB_CENTRAL_PASSWORD: Contraseña de BD
     - DB_DRIVER: Driver ODBC (opcional, default: ODBC Driver 18)
+    - DB_CENTRAL_POOL_MAX_SIZE: Conexiones máximas del pool (opcional, default: 3)
+
+    La configuración se lee una sola vez al importar el módulo.
     """
 
     @staticmethod
     def get_connection():
-        """Crea y retorna una conexión a la BD central"""
-        # Leer variables de entorno (OBLIGATORIAS, sin valores por defecto)
-        server = os.environ.get('DB_CENTRAL_SERVER')
-        database = os.environ.get('DB_CENTRAL_NAME')
-        username = os.environ.get('DB_CENTRAL_USER')
-        password = os.environ.get('DB_CENTRAL_PASSWORD')
-        driver = os.environ.get('DB_DRIVER', '{ODBC Driver 18 for SQL Server}')
-
-        # Validar que las variables obligatorias estén definidas
-        if not server:
-            raise ValueError("DB_CENTRAL_SERVER no está configurado. Defina la variable de entorno.")
-        if not database:
-            raise ValueError("DB_CENTRAL_NAME no está configurado. Defina la variable de entorno.")
-        if not username:
-            raise ValueError("DB_CENTRAL_USER no está configurado. Defina la variable de entorno.")
-        if not password:
-            raise ValueError("DB_CENTRAL_PASSWORD no está configurado. Defina la variable de entorno.")
-
-        conn_str = (
-            f"DRIVER={driver};"
-            f"SERVER={server};"
-            f"DATABASE={database};"
-            f"UID={username};"
-            f"PWD={password};"
-            f"TrustServerCertificate=yes;"
-            f"Encrypt=yes;"
-            f"Connection Timeout=10;"
-        )
-        return pyodbc.connect(conn_str, timeout=10)
+        """
+        Retorna una conexión (del pool) a la BD central.
+
+        close() la devuelve al pool; también admite `with ... as conn`.
+        """
+        if _CONFIG_ERROR:
+            raise ValueError(_CONFIG_ERROR)
+
+        if not connection_pool.POOL_ENABLED:
+            return pyodbc.connect(_CONN_STR, timeout=10)
+
+        return _pool.acquire()
+
+    @staticmethod
+    def get_pool_stats():
+        """
+        Estadísticas del pool de la BD central (size, in_use, waits, connect time...).
+
+        Returns:
+            dict, o None si la BD central no está configurada
+        """
+        return _pool.stats() if _pool else None
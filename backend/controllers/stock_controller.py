@@ -15,7 +15,12 @@
 # ============================================
 # ARCHIVO: controllers/stock_controller.py
 # ============================================
-from flask import jsonify, request, session
+import csv
+import io
+import itertools
+import json
+
+from flask import jsonify, request, session, Response, stream_with_context
 from flask_login import current_user
 from models.stock_model import StockModel
 from models.precio_model import PrecioModel
@@ -30,11 +35,95 @@ def _precios_habilitados():
     return getattr(current_user, 'mostrar_precios', False)
 
 
+def _filtros_request():
+    """Filtros de búsqueda de la query string (simples y columna__operador)"""
+    # Obtener parámetros de filtros simples (compatibilidad)
+    filtros = {
+        'codigo': request.args.get('codigo'),
+        'descripcion': request.args.get('descripcion'),
+        'calidad': request.args.get('calidad'),
+        'color': request.args.get('color'),
+        'tono': request.args.get('tono'),
+        'calibre': request.args.get('calibre'),
+        'formato': request.args.get('formato'),
+        'serie': request.args.get('serie'),
+        'existencias_min': request.args.get('existencias_min'),
+        'tipo_producto': request.args.get('tipo_producto')
+    }
+
+    # Eliminar filtros vacíos
+    filtros = {k: v for k, v in filtros.items() if v is not None}
+
+    # Capturar filtros con operadores (formato: columna__operador=valor)
+    # Excluir parámetros de paginación/ordenación
+    params_excluidos = {'page', 'limit', 'order_by', 'order_dir', 'empresa', 'cursor', 'count', 'exact'}
+    for key in request.args:
+        if '__' in key and key not in params_excluidos:
+            # Es un filtro con operador (ej: codigo__contains=ABC)
+            filtros[key] = request.args.get(key)
+    return filtros
+
+
+# Formatos de exportación en streaming (?format=)
+_EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _ndjson_lines(stocks):
+    return ''.join(json.dumps(stock, ensure_ascii=False, default=str) + '\n' for stock in stocks)
+
+
 class StockController:
+    @staticmethod
+    def _export(formato, filtros):
+        """
+        Exporta el resultado de la búsqueda en streaming (NDJSON o CSV), lote
+        a lote: la memoria del worker no crece con el tamaño del catálogo.
+        """
+        if formato not in _EXPORT_MIMETYPES:
+            return jsonify({'error': f'Formato no válido. Formatos permitidos: {", ".join(_EXPORT_MIMETYPES)}'}), 400
+
+        empresa_id = session.get('empresa_id', '1')
+        precios = _precios_habilitados()
+        lotes = StockModel.iter_search(filtros, order_by=request.args.get('order_by', 'codigo'),
+                                       order_dir=request.args.get('order_dir', 'ASC'))
+        # El primer lote se lee aquí: un error de conexión todavía puede devolver un 500
+        primero = next(lotes, [])
+
+        def generate():
+            columnas = StockModel.EXPORT_COLUMNS + (['precio'] if precios else [])
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columnas, extrasaction='ignore')
+            if formato == 'csv':
+                writer.writeheader()
+            try:
+                for stocks in itertools.chain([primero], lotes):
+                    if precios:
+                        PrecioModel.inyectar_precios(empresa_id, stocks)
+                    if formato == 'ndjson':
+                        yield _ndjson_lines(stocks)
+                        continue
+                    writer.writerows(stocks)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            finally:
+                lotes.close()
+
+        headers = {}
+        if formato == 'csv':
+            headers['Content-Disposition'] = 'attachment; filename=stocks.csv'
+        return Response(stream_with_context(generate()), mimetype=_EXPORT_MIMETYPES[formato], headers=headers)
+
     @staticmethod
     def get_all():
         """Obtener todos los stocks (filtrados por empresa de sesión)"""
         try:
+            formato = request.args.get('format')
+            if formato:
+                return StockController._export(formato, {})
             stocks = StockModel.get_all()
             # Inyectar precios si está habilitado (global + usuario)
             empresa_id = session.get('empresa_id', '1')
@@ -71,42 +160,39 @@ class StockController:
     def search():
         """Buscar stocks con filtros, paginación y ordenación"""
         try:
-            # Obtener parámetros de filtros simples (compatibilidad)
-            filtros = {
-                'codigo': request.args.get('codigo'),
-                'descripcion': request.args.get('descripcion'),
-                'calidad': request.args.get('calidad'),
-                'color': request.args.get('color'),
-                'tono': request.args.get('tono'),
-                'calibre': request.args.get('calibre'),
-                'formato': request.args.get('formato'),
-                'serie': request.args.get('serie'),
-                'existencias_min': request.args.get('existencias_min'),
-                'tipo_producto': request.args.get('tipo_producto')
-            }
-
-            # Eliminar filtros vacíos
-            filtros = {k: v for k, v in filtros.items() if v is not None}
-
-            # Capturar filtros con operadores (formato: columna__operador=valor)
-            # Excluir parámetros de paginación/ordenación
-            params_excluidos = {'page', 'limit', 'order_by', 'order_dir', 'empresa'}
-            for key in request.args:
-                if '__' in key and key not in params_excluidos:
-                    # Es un filtro con operador (ej: codigo__contains=ABC)
-                    filtros[key] = request.args.get(key)
+            filtros = _filtros_request()
+
+            # Exportación completa en streaming (ignora la paginación)
+            formato = request.args.get('format')
+            if formato:
+                return StockController._export(formato, filtros)
 
             # Parámetros de paginación (opcionales)
             page = request.args.get('page', type=int)
             limit = request.args.get('limit', type=int)
 
+            # Paginación por cursor (opcional): cursor vacío = primera página
+            cursor = request.args.get('cursor')
+            count = request.args.get('count')
+            with_total = None if count is None else count.lower() in ('1', 'true', 'yes')
+            # exact=false: total estimado (más barato que COUNT(*) en filtros amplios)
+            exact = request.args.get('exact', 'true').lower() not in ('0', 'false', 'no')
+
             # Parámetros de ordenación
             order_by = request.args.get('order_by', 'codigo')
             order_dir = request.args.get('order_dir', 'ASC')
 
+            if cursor is not None:
+                try:
+                    StockModel.parse_cursor(cursor, order_by, order_dir)
+                except ValueError as e:
+                    # Cursor no válido o de otra búsqueda
+                    return jsonify({"error": str(e)}), 400
+
             # Llamar al modelo con paginación si se proporciona
             result = StockModel.search(filtros, page=page, limit=limit,
-                                       order_by=order_by, order_dir=order_dir)
+                                       order_by=order_by, order_dir=order_dir,
+                                       cursor=cursor, with_total=with_total, exact=exact)
             # Inyectar precios si está habilitado (global + usuario)
             empresa_id = session.get('empresa_id', '1')
             if _precios_habilitados():
@@ -132,6 +218,23 @@ class StockController:
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    @staticmethod
+    def get_facetas():
+        """Valores únicos con recuento de varias columnas, sobre los filtros activos"""
+        try:
+            columnas = request.args.get('columnas')
+            columnas = [c.strip() for c in columnas.split(',') if c.strip()] if columnas else None
+            invalidas = [c for c in columnas or [] if c not in StockModel.VALID_FILTER_COLUMNS]
+            if invalidas:
+                return jsonify({
+                    'error': f'Columna no válida. Columnas permitidas: {", ".join(StockModel.VALID_FILTER_COLUMNS)}'
+                }), 400
+
+            limite = request.args.get('limite', 100, type=int)
+            return jsonify(StockModel.get_facetas(_filtros_request(), columnas, limite)), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
     @staticmethod
     def get_valores_unicos(columna):
         """Obtener valores únicos de una columna para filtros estilo Excel"""
@@ -1647,4 +1647,152 @@ MIGRATIONS = [
         ]
     },
 
+    # ============================================================
+    # v67 - Resumen diario de vistas de articulos
+    # ============================================================
+    {
+        'version': 67,
+        'description': 'Crear tabla articulo_vistas_dia (vistas de articulos por dia)',
+        'app_version': 'v1.49.3',
+        'sql': [
+            """IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'articulo_vistas_dia')
+            BEGIN
+                CREATE TABLE articulo_vistas_dia (
+                    empresa_id VARCHAR(5) NOT NULL,
+                    codigo VARCHAR(100) NOT NULL,
+                    dia DATE NOT NULL,
+                    vistas INT NOT NULL DEFAULT 0,
+                    usuarios INT NULL,
+                    usuarios_hll VARBINARY(1024) NULL,
+                    ultima_vista DATETIME NULL,
+                    CONSTRAINT PK_articulo_vistas_dia PRIMARY KEY (empresa_id, dia, codigo)
+                );
+            END""",
+            # Historico: vistas ya registradas en audit_log (sin sketch de usuarios)
+            """IF OBJECT_ID('audit_log') IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM articulo_vistas_dia)
+            BEGIN
+                INSERT INTO articulo_vistas_dia (empresa_id, codigo, dia, vistas, usuarios, ultima_vista)
+                SELECT empresa_id, RTRIM(recurso_id), CAST(fecha AS DATE),
+                       COUNT(*), COUNT(DISTINCT user_id), MAX(fecha)
+                FROM audit_log
+                WHERE accion = 'ARTICLE_VIEW' AND empresa_id IS NOT NULL AND recurso_id IS NOT NULL
+                GROUP BY empresa_id, RTRIM(recurso_id), CAST(fecha AS DATE);
+            END""",
+        ]
+    },
+
+    # ============================================================
+    # v68 - Resumenes incrementales para el dashboard de estadisticas
+    # ============================================================
+    {
+        'version': 68,
+        'description': 'Crear tablas de resumen de estadisticas (audit_log y propuestas)',
+        'app_version': 'v1.49.3',
+        'sql': [
+            """IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'estadisticas_watermark')
+            BEGIN
+                CREATE TABLE estadisticas_watermark (
+                    nombre VARCHAR(50) NOT NULL PRIMARY KEY,
+                    ultimo_id INT NOT NULL,
+                    fecha_actualizacion DATETIME DEFAULT GETDATE()
+                );
+            END""",
+            """IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'audit_resumen_hora')
+            BEGIN
+                CREATE TABLE audit_resumen_hora (
+                    empresa_id VARCHAR(5) NOT NULL,
+                    dia DATE NOT NULL,
+                    hora TINYINT NOT NULL,
+                    user_id INT NOT NULL,
+                    accion VARCHAR(50) NOT NULL,
+                    resultado VARCHAR(20) NOT NULL,
+                    total INT NOT NULL,
+                    ultima DATETIME NOT NULL,
+                    CONSTRAINT PK_audit_resumen_hora
+                        PRIMARY KEY (empresa_id, dia, hora, user_id, accion, resultado)
+                );
+                CREATE INDEX IX_audit_resumen_hora_user ON audit_resumen_hora(user_id);
+            END""",
+            """IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'propuestas_resumen_dia')
+            BEGIN
+                CREATE TABLE propuestas_resumen_dia (
+                    empresa_id VARCHAR(5) NOT NULL,
+                    dia DATE NOT NULL,
+                    user_id INT NOT NULL,
+                    cantidad INT NOT NULL,
+                    total_items INT NOT NULL,
+                    ultima DATETIME NOT NULL,
+                    CONSTRAINT PK_propuestas_resumen_dia PRIMARY KEY (empresa_id, dia, user_id)
+                );
+                CREATE INDEX IX_propuestas_resumen_dia_user ON propuestas_resumen_dia(user_id);
+            END""",
+            # Histórico: se resume aquí de una vez (la app solo suma lo posterior a la marca).
+            # Se deja el último minuto, como en EstadisticasResumenModel (INSERT sin confirmar)
+            """IF OBJECT_ID('audit_log') IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM estadisticas_watermark WHERE nombre = 'audit_resumen_hora')
+            BEGIN
+                DECLARE @hasta INT;
+                SELECT @hasta = ISNULL(MAX(id), 0) FROM audit_log WHERE fecha < DATEADD(SECOND, -60, GETDATE());
+                INSERT INTO audit_resumen_hora (empresa_id, dia, hora, user_id, accion, resultado, total, ultima)
+                SELECT empresa_id, CAST(fecha AS DATE), DATEPART(HOUR, fecha), ISNULL(user_id, 0),
+                       accion, ISNULL(resultado, ''), COUNT(*), MAX(fecha)
+                FROM audit_log
+                WHERE id <= @hasta AND empresa_id IS NOT NULL
+                GROUP BY empresa_id, CAST(fecha AS DATE), DATEPART(HOUR, fecha), ISNULL(user_id, 0),
+                         accion, ISNULL(resultado, '');
+                INSERT INTO estadisticas_watermark (nombre, ultimo_id, fecha_actualizacion)
+                VALUES ('audit_resumen_hora', @hasta, GETDATE());
+            END""",
+            """IF OBJECT_ID('propuestas') IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM estadisticas_watermark WHERE nombre = 'propuestas_resumen_dia')
+            BEGIN
+                DECLARE @hasta INT;
+                SELECT @hasta = ISNULL(MAX(id), 0) FROM propuestas WHERE fecha < DATEADD(SECOND, -60, GETDATE());
+                INSERT INTO propuestas_resumen_dia (empresa_id, dia, user_id, cantidad, total_items, ultima)
+                SELECT ISNULL(empresa_id, ''), CAST(fecha AS DATE), user_id,
+                       COUNT(*), SUM(ISNULL(total_items, 0)), MAX(fecha)
+                FROM propuestas
+                WHERE id <= @hasta AND fecha IS NOT NULL
+                GROUP BY ISNULL(empresa_id, ''), CAST(fecha AS DATE), user_id;
+                INSERT INTO estadisticas_watermark (nombre, ultimo_id, fecha_actualizacion)
+                VALUES ('propuestas_resumen_dia', @hasta, GETDATE());
+            END""",
+        ]
+    },
+
+    # ============================================================
+    # v69 - Logins por ubicacion y dia (mapa del dashboard)
+    # ============================================================
+    {
+        'version': 69,
+        'description': 'Crear tabla login_ubicacion_dia (logins por ubicacion y dia)',
+        'app_version': 'v1.49.3',
+        'sql': [
+            """IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'login_ubicacion_dia')
+            BEGIN
+                CREATE TABLE login_ubicacion_dia (
+                    empresa_id VARCHAR(5) NOT NULL,
+                    dia DATE NOT NULL,
+                    lat DECIMAL(7,2) NOT NULL,
+                    lon DECIMAL(7,2) NOT NULL,
+                    username VARCHAR(100) NOT NULL,
+                    user_id INT NULL,
+                    pais NVARCHAR(100) NULL,
+                    ciudad NVARCHAR(100) NULL,
+                    total INT NOT NULL,
+                    CONSTRAINT PK_login_ubicacion_dia PRIMARY KEY (empresa_id, dia, lat, lon, username)
+                );
+                CREATE INDEX IX_login_ubicacion_dia_user ON login_ubicacion_dia(user_id);
+            END""",
+            # Los logins ya registrados (hasta el id actual) se pasan desde audit_log al leer el mapa
+            """IF OBJECT_ID('audit_log') IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM estadisticas_watermark WHERE nombre = 'login_ubicacion_historico')
+            BEGIN
+                INSERT INTO estadisticas_watermark (nombre, ultimo_id, fecha_actualizacion)
+                SELECT 'login_ubicacion_historico', ISNULL(MAX(id), 0), GETDATE() FROM audit_log;
+            END""",
+        ]
+    },
+
 ]
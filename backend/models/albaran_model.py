@@ -21,6 +21,7 @@ import math
 import time
 import logging
 from config.database import Database
+from utils.pagination import listing_total
 
 logger = logging.getLogger(__name__)
 
@@ -74,12 +75,12 @@ class AlbaranModel:
         return result
 
     @staticmethod
-    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50):
+    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50, exact=True):
         """
         Obtiene albaranes de un cliente con paginacion servidor.
 
         Returns:
-            dict: { albaranes, total, page, page_size, total_pages }
+            dict: { albaranes, total, total_exact, page, page_size, total_pages }
         """
         t0 = time.time()
         conn = Database.get_connection()
@@ -115,9 +116,8 @@ class AlbaranModel:
 
             where = " AND ".join(where_parts)
 
-            # 1. Count total
-            cursor.execute(f"SELECT COUNT(*) FROM view_externos_venalb v WHERE {where}", params)
-            total = cursor.fetchone()[0]
+            # 1. Count total (cacheado por filtros; estimado si exact=False)
+            total, total_exact = listing_total(cursor, 'view_externos_venalb v', where, params, exact)
             t2 = time.time()
             logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
 
@@ -160,6 +160,7 @@ class AlbaranModel:
             return {
                 'albaranes': albaranes,
                 'total': total,
+                'total_exact': total_exact,
                 'page': page,
                 'page_size': page_size,
                 'total_pages': total_pages
@@ -230,12 +231,12 @@ class AlbaranModel:
             conn.close()
 
     @staticmethod
-    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None):
+    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None, exact=True):
         """
         Obtiene todos los albaranes con paginacion servidor (para administradores).
 
         Returns:
-            dict: { albaranes, total, page, page_size, total_pages }
+            dict: { albaranes, total, total_exact, page, page_size, total_pages }
         """
         t0 = time.time()
         conn = Database.get_connection()
@@ -284,9 +285,8 @@ class AlbaranModel:
 
             where = " AND ".join(where_parts)
 
-            # 1. Count total
-            cursor.execute(f"SELECT COUNT(*) FROM view_externos_venalb v WHERE {where}", params)
-            total = cursor.fetchone()[0]
+            # 1. Count total (cacheado por filtros; estimado si exact=False)
+            total, total_exact = listing_total(cursor, 'view_externos_venalb v', where, params, exact)
             t2 = time.time()
             logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
 
@@ -329,6 +329,7 @@ class AlbaranModel:
             return {
                 'albaranes': albaranes,
                 'total': total,
+                'total_exact': total_exact,
                 'page': page,
                 'page_size': page_size,
                 'total_pages': total_pages
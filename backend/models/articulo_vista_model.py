@@ -0,0 +1,186 @@
+# ============================================================
+#      ██╗ ██████╗ ██████╗ ███████╗██████╗ ███████╗
+#      ██║██╔═══██╗██╔══██╗██╔════╝██╔══██╗██╔════╝
+#      ██║██║   ██║██████╔╝█████╗  ██████╔╝███████╗
+# ██   ██║██║   ██║██╔══██╗██╔══╝  ██╔══██╗╚════██║
+# ╚█████╔╝╚██████╔╝██████╔╝███████╗██║  ██║███████║
+#  ╚════╝  ╚═════╝ ╚═════╝ ╚══════╝╚═╝  ╚═╝╚══════╝
+#
+#                ──  Jobers - Iaucejo  ──
+#
+# Autor : iaucejo
+# Fecha : 2026-10-18
+# ============================================================
+
+# ============================================
+# ARCHIVO: models/articulo_vista_model.py
+# Descripcion: Vistas de artículos resumidas por día
+#
+# Tabla articulo_vistas_dia (BD del cliente, migración 67): una
+# fila por (empresa, día, código) con vistas, última vista y el
+# HyperLogLog de usuarios distintos. Las vistas se acumulan en
+# memoria (utils/view_counter.py) y se suman a la tabla por lotes.
+# Las filas anteriores a la tabla (copiadas de audit_log) no
+# tienen sketch: solo el número de usuarios de ese día.
+# ============================================
+from datetime import datetime
+
+from config.database import Database
+from utils.background_flusher import register_shutdown
+from utils.view_counter import HyperLogLog, ViewCounter
+
+_IN_BATCH = 500  # parámetros por consulta IN
+
+
+def _sketch(data):
+    return HyperLogLog(data) if data else None
+
+
+class ArticuloVistaModel:
+
+    @staticmethod
+    def registrar(codigo, empresa_id, user_id=None, connection_id=None):
+        """
+        Registrar una vista de la ficha de un artículo (en memoria).
+
+        Args:
+            codigo: Código del artículo
+            empresa_id: ID de la empresa
+            user_id: Usuario que lo ve (None = anónimo, no cuenta como usuario distinto)
+            connection_id: Conexión del tenant (default: la de la sesión)
+        """
+        from flask import session, has_request_context
+        if connection_id is None and has_request_context():
+            connection_id = session.get('connection')
+
+        codigo = str(codigo).strip()[:100]
+        empresa_id = str(empresa_id)[:5]
+        if connection_id is None:
+            # Sin connection el hilo no sabría a qué BD ir: solo esta vista se escribe
+            # ahora, con la BD de la sesión (db_config); el resto sigue en memoria
+            ahora = datetime.now()
+            sketch = HyperLogLog()
+            if user_id is not None:
+                sketch.add(user_id)
+            ArticuloVistaModel._write_batch(None, [(empresa_id, codigo, ahora.date(), 1,
+                                                    sketch.to_bytes(), ahora)])
+            return
+        view_counter.add(connection_id, empresa_id, codigo, user_id)
+
+    @staticmethod
+    def _write_batch(connection_id, entries):
+        """
+        Sumar entradas de ViewCounter a articulo_vistas_dia (una transacción).
+
+        Los sketches existentes se leen con UPDLOCK: dos workers que vuelcan
+        la misma clave a la vez se esperan en lugar de pisarse. Los códigos se
+        comparan sin mayúsculas, como la clave primaria (collation CI).
+        """
+        grupos = {}
+        for empresa, codigo, dia, vistas, hll, ultima in entries:
+            filas = grupos.setdefault((empresa, dia), {})
+            fila = filas.get(codigo.upper())
+            if fila is None:
+                filas[codigo.upper()] = [codigo, vistas, hll, ultima]
+            else:
+                # 'abc' y 'ABC' son la misma fila de la tabla
+                fila[1] += vistas
+                fila[2] = HyperLogLog(fila[2]).merge(HyperLogLog(hll)).to_bytes()
+                fila[3] = max(fila[3], ultima)
+
+        conn = Database.get_connection(connection_id)
+        try:
+            cursor = conn.cursor()
+            updates, inserts = [], []
+            for (empresa, dia), filas in grupos.items():
+                filas = list(filas.values())
+                for i in range(0, len(filas), _IN_BATCH):
+                    lote = filas[i:i + _IN_BATCH]
+                    placeholders = ','.join('?' * len(lote))
+                    cursor.execute(f"""
+                        SELECT codigo, usuarios_hll FROM articulo_vistas_dia WITH (UPDLOCK, HOLDLOCK)
+                        WHERE empresa_id = ? AND dia = ? AND codigo IN ({placeholders})
+                    """, [empresa, dia] + [f[0] for f in lote])
+                    existentes = {row[0].strip().upper(): row[1] for row in cursor.fetchall()}
+
+                    for codigo, vistas, hll, ultima in lote:
+                        sketch = HyperLogLog(hll)
+                        if codigo.upper() in existentes:
+                            anterior = _sketch(existentes[codigo.upper()])
+                            if anterior is not None:
+                                sketch.merge(anterior)
+                            usuarios = sketch.count()
+                            updates.append((vistas, sketch.to_bytes(), usuarios, usuarios,
+                                            ultima, ultima, empresa, dia, codigo))
+                        else:
+                            inserts.append((empresa, codigo, dia, vistas, sketch.count(),
+                                            sketch.to_bytes(), ultima))
+
+            cursor.fast_executemany = True
+            if updates:
+                cursor.executemany("""
+                    UPDATE articulo_vistas_dia
+                    SET vistas = vistas + ?,
+                        usuarios_hll = ?,
+                        usuarios = CASE WHEN usuarios > ? THEN usuarios ELSE ? END,
+                        ultima_vista = CASE WHEN ultima_vista >= ? THEN ultima_vista ELSE ? END
+                    WHERE empresa_id = ? AND dia = ? AND codigo = ?
+                """, updates)
+            if inserts:
+                cursor.executemany("""
+                    INSERT INTO articulo_vistas_dia
+                    (empresa_id, codigo, dia, vistas, usuarios, usuarios_hll, ultima_vista)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, inserts)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_mas_vistos(cursor, empresa_id, limit=10, dias=30):
+        """
+        Artículos con más vistas en los últimos `dias` días.
+
+        Returns:
+            list de (codigo, vistas, usuarios_unicos, ultima_vista)
+        """
+        cursor.execute("""
+            SELECT TOP (?) codigo, SUM(vistas) AS vistas, MAX(ultima_vista) AS ultima_vista
+            FROM articulo_vistas_dia
+            WHERE empresa_id = ? AND dia >= CAST(DATEADD(DAY, ?, GETDATE()) AS DATE)
+            GROUP BY codigo
+            ORDER BY vistas DESC
+        """, (limit, empresa_id, -dias))
+        top = [(row[0].strip(), row[1], row[2]) for row in cursor.fetchall()]
+        if not top:
+            return []
+
+        # Usuarios distintos del periodo: unión de los sketches diarios; los días
+        # sin sketch (copiados de audit_log) aportan al menos su número de usuarios
+        sketches, minimos = {}, {}
+        codigos = [t[0] for t in top]
+        for i in range(0, len(codigos), _IN_BATCH):
+            lote = codigos[i:i + _IN_BATCH]
+            cursor.execute(f"""
+                SELECT codigo, usuarios_hll, usuarios FROM articulo_vistas_dia
+                WHERE empresa_id = ? AND dia >= CAST(DATEADD(DAY, ?, GETDATE()) AS DATE)
+                  AND codigo IN ({','.join('?' * len(lote))})
+            """, [empresa_id, -dias] + lote)
+            for codigo, hll, usuarios in cursor.fetchall():
+                codigo = codigo.strip()
+                sketch = _sketch(hll)
+                if sketch is not None:
+                    if codigo in sketches:
+                        sketches[codigo].merge(sketch)
+                    else:
+                        sketches[codigo] = sketch
+                minimos[codigo] = max(minimos.get(codigo, 0), usuarios or 0)
+
+        return [(codigo, vistas,
+                 max(sketches[codigo].count() if codigo in sketches else 0, minimos.get(codigo, 0)),
+                 ultima)
+                for codigo, vistas, ultima in top]
+
+
+view_counter = register_shutdown(ViewCounter(ArticuloVistaModel._write_batch))
@@ -3,7 +3,10 @@ Modelo de Auditoria para registrar acciones de usuarios
 Almacena logs en BD del cliente (misma conexión que user_sessions)
 """
 import json
+from datetime import datetime
 from config.database import Database
+from utils.audit_writer import AUDIT_ASYNC, AuditWriter
+from utils.background_flusher import register_shutdown
 
 
 class AuditAction:
@@ -86,14 +89,25 @@ class AuditResult:
 class AuditModel:
     """Modelo para gestionar logs de auditoria en BD Central"""
 
+    _INSERT = """
+        INSERT INTO audit_log
+        (fecha, user_id, username, empresa_id, accion,
+         recurso, recurso_id, ip_address, user_agent, detalles, resultado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
     @staticmethod
     def log(accion, user_id=None, username=None, empresa_id=None,
             connection_id=None, recurso=None, recurso_id=None,
             ip_address=None, user_agent=None, detalles=None,
-            resultado='SUCCESS'):
+            resultado='SUCCESS', return_id=False):
         """
         Registrar evento de auditoria en BD Central
 
+        Por defecto la fila se encola y se escribe en segundo plano, por lotes
+        (utils/audit_writer.py): la peticion no espera a la BD. Con
+        return_id=True se inserta en el momento para devolver el ID.
+
         Args:
             accion: Tipo de accion (usar constantes AuditAction)
             user_id: ID del usuario que realiza la accion
@@ -106,16 +120,45 @@ class AuditModel:
             user_agent: User-Agent del navegador/cliente
             detalles: Diccionario con detalles adicionales (se convierte a JSON)
             resultado: Resultado de la accion (usar constantes AuditResult)
+            return_id: Esperar al INSERT y devolver el ID del registro
 
         Returns:
-            int: ID del registro creado, o None si falla
+            int: ID del registro creado si return_id, si no None (o None si falla)
         """
-        try:
-            # Obtener connection de la sesión si no se pasa
-            from flask import session, has_request_context
-            if connection_id is None and has_request_context():
-                connection_id = session.get('connection')
+        # Obtener connection de la sesión si no se pasa
+        from flask import session, has_request_context
+        if connection_id is None and has_request_context():
+            connection_id = session.get('connection')
+
+        # Convertir detalles a JSON si es un diccionario
+        detalles_json = json.dumps(detalles) if detalles else None
+
+        # Truncar campos para evitar error de longitud. La fecha es la del evento:
+        # la fila puede escribirse más tarde (cola, reintentos)
+        row = (
+            datetime.now(),
+            user_id,
+            str(username)[:100] if username else None,
+            str(empresa_id)[:5] if empresa_id else None,
+            str(accion)[:50] if accion else None,
+            str(recurso)[:100] if recurso else None,
+            str(recurso_id)[:100] if recurso_id else None,
+            str(ip_address)[:45] if ip_address else None,
+            str(user_agent)[:1000] if user_agent else None,
+            detalles_json,
+            str(resultado)[:20] if resultado else 'SUCCESS',
+        )
+
+        # Sin connection el hilo de escritura no sabria a que BD ir: se escribe ahora
+        if AUDIT_ASYNC and not return_id and connection_id is not None:
+            audit_writer.submit(connection_id, row)
+            return None
+        return AuditModel._insert(connection_id, row)
 
+    @staticmethod
+    def _insert(connection_id, row):
+        """INSERT inmediato de una fila; devuelve su ID."""
+        try:
             conn = Database.get_connection(connection_id)
         except Exception as e:
             print(f"Error en audit log (conexión): {e}")
@@ -123,33 +166,14 @@ class AuditModel:
 
         cursor = conn.cursor()
         try:
-            # Convertir detalles a JSON si es un diccionario
-            detalles_json = json.dumps(detalles) if detalles else None
-
-            # Truncar campos para evitar error de longitud
-            username = str(username)[:100] if username else None
-            empresa_id = str(empresa_id)[:5] if empresa_id else None
-            accion = str(accion)[:50] if accion else None
-            recurso = str(recurso)[:100] if recurso else None
-            recurso_id = str(recurso_id)[:100] if recurso_id else None
-            ip_address = str(ip_address)[:45] if ip_address else None
-            user_agent = str(user_agent)[:1000] if user_agent else None
-            resultado = str(resultado)[:20] if resultado else 'SUCCESS'
-
-            cursor.execute("""
-                INSERT INTO audit_log
-                (user_id, username, empresa_id, accion,
-                 recurso, recurso_id, ip_address, user_agent, detalles, resultado)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, username, empresa_id, accion,
-                  recurso, recurso_id, ip_address, user_agent, detalles_json, resultado))
+            cursor.execute(AuditModel._INSERT, row)
 
             conn.commit()
 
             # Obtener ID insertado
             cursor.execute("SELECT @@IDENTITY")
-            row = cursor.fetchone()
-            log_id = int(row[0]) if row and row[0] is not None else None
+            result = cursor.fetchone()
+            log_id = int(result[0]) if result and result[0] is not None else None
 
             return log_id
         except Exception as e:
@@ -159,6 +183,19 @@ class AuditModel:
             cursor.close()
             conn.close()
 
+    @staticmethod
+    def _insert_batch(connection_id, rows):
+        """INSERT de un lote de filas de un tenant (hilo de AuditWriter)."""
+        conn = Database.get_connection(connection_id)
+        try:
+            cursor = conn.cursor()
+            cursor.fast_executemany = True
+            cursor.executemany(AuditModel._INSERT, rows)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
     @staticmethod
     def get_logs(empresa_id=None, connection_id=None, user_id=None,
                  username=None, accion=None, fecha_desde=None, fecha_hasta=None,
@@ -425,3 +462,7 @@ class AuditModel:
         finally:
             cursor.close()
             conn.close()
+
+
+# Cola de audit_log del proceso (ver utils/audit_writer.py)
+audit_writer = register_shutdown(AuditWriter(AuditModel._insert_batch))
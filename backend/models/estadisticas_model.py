@@ -17,8 +17,15 @@
 # Descripcion: Modelo para estadisticas del dashboard de administracion
 # ============================================
 from config.database import Database
+from models.articulo_vista_model import ArticuloVistaModel
+from models.estadisticas_resumen_model import EstadisticasResumenModel
+from models.login_ubicacion_model import LoginUbicacionModel
 from datetime import datetime, timedelta
-import json
+
+# Horas del resumen desde DATEADD(DAY, ?, GETDATE()) (el mismo parámetro tres veces)
+_DESDE_HORA = """(r.dia > CAST(DATEADD(DAY, ?, GETDATE()) AS DATE)
+                    OR (r.dia = CAST(DATEADD(DAY, ?, GETDATE()) AS DATE)
+                        AND r.hora >= DATEPART(HOUR, DATEADD(DAY, ?, GETDATE()))))"""
 
 
 class EstadisticasModel:
@@ -157,17 +164,18 @@ class EstadisticasModel:
             list: Lista de fechas con cantidad de propuestas
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
             cursor.execute("""
                 SELECT
-                    CAST(fecha AS DATE) as dia,
-                    COUNT(*) as cantidad,
-                    ISNULL(SUM(total_items), 0) as total_items
-                FROM propuestas
-                WHERE empresa_id = ? AND fecha >= DATEADD(DAY, -?, GETDATE())
-                GROUP BY CAST(fecha AS DATE)
+                    dia,
+                    SUM(cantidad) as cantidad,
+                    SUM(total_items) as total_items
+                FROM propuestas_resumen_dia
+                WHERE empresa_id = ? AND dia >= CAST(DATEADD(DAY, -?, GETDATE()) AS DATE)
+                GROUP BY dia
                 ORDER BY dia ASC
             """, (empresa_id, dias))
 
@@ -226,6 +234,7 @@ class EstadisticasModel:
             list: Lista de usuarios con cantidad de propuestas
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
@@ -234,11 +243,11 @@ class EstadisticasModel:
                     u.id,
                     u.username,
                     u.full_name,
-                    COUNT(p.id) as total_propuestas,
-                    MAX(p.fecha) as ultima_propuesta
+                    SUM(r.cantidad) as total_propuestas,
+                    MAX(r.ultima) as ultima_propuesta
                 FROM users u
-                INNER JOIN propuestas p ON u.id = p.user_id
-                WHERE p.empresa_id = ?
+                INNER JOIN propuestas_resumen_dia r ON u.id = r.user_id
+                WHERE r.empresa_id = ?
                 GROUP BY u.id, u.username, u.full_name
                 ORDER BY total_propuestas DESC
             """, (limit, empresa_id))
@@ -270,19 +279,20 @@ class EstadisticasModel:
             list: Lista de meses con cantidad de propuestas
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
             cursor.execute("""
                 SELECT
-                    YEAR(fecha) as anio,
-                    MONTH(fecha) as mes,
-                    COUNT(*) as cantidad,
+                    YEAR(dia) as anio,
+                    MONTH(dia) as mes,
+                    SUM(cantidad) as cantidad,
                     SUM(total_items) as total_items
-                FROM propuestas
+                FROM propuestas_resumen_dia
                 WHERE empresa_id = ?
-                    AND fecha >= DATEADD(MONTH, -?, GETDATE())
-                GROUP BY YEAR(fecha), MONTH(fecha)
+                    AND dia >= CAST(DATEADD(MONTH, -?, GETDATE()) AS DATE)
+                GROUP BY YEAR(dia), MONTH(dia)
                 ORDER BY anio ASC, mes ASC
             """, (empresa_id, meses))
 
@@ -302,7 +312,7 @@ class EstadisticasModel:
     @staticmethod
     def get_articulos_mas_vistos(empresa_id='1', limit=10, dias=30):
         """
-        Obtiene los articulos mas vistos (desde audit_log ARTICLE_VIEW).
+        Obtiene los articulos mas vistos (desde el resumen diario articulo_vistas_dia).
 
         Args:
             empresa_id: ID de la empresa
@@ -316,29 +326,15 @@ class EstadisticasModel:
         cursor = conn.cursor()
 
         try:
-            # Query solo de audit_log (sin dependencia de vistas externas)
-            cursor.execute("""
-                SELECT TOP (?)
-                    a.recurso_id as codigo,
-                    COUNT(*) as vistas,
-                    COUNT(DISTINCT a.user_id) as usuarios_unicos,
-                    MAX(a.fecha) as ultima_vista
-                FROM audit_log a
-                WHERE a.accion = 'ARTICLE_VIEW'
-                    AND a.empresa_id = ?
-                    AND a.fecha >= DATEADD(DAY, ?, GETDATE())
-                GROUP BY a.recurso_id
-                ORDER BY vistas DESC
-            """, (limit, empresa_id, -dias))
-
+            # Resumen por dia (sin dependencia de vistas externas ni de audit_log)
             articulos = []
-            for row in cursor.fetchall():
-                codigo = row[0].strip() if row[0] else row[0]
+            for codigo, vistas, usuarios, ultima in ArticuloVistaModel.get_mas_vistos(
+                    cursor, empresa_id, limit, dias):
                 articulos.append({
                     'codigo': codigo,
-                    'vistas': row[1],
-                    'usuarios_unicos': row[2],
-                    'ultima_vista': row[3].isoformat() if row[3] else None,
+                    'vistas': vistas,
+                    'usuarios_unicos': usuarios,
+                    'ultima_vista': ultima.isoformat() if ultima else None,
                     'descripcion': codigo
                 })
 
@@ -427,23 +423,24 @@ class EstadisticasModel:
         Excluye administradores y superusuarios.
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT
-                    CAST(a.fecha AS DATE) as dia,
-                    SUM(CASE WHEN a.accion='LOGIN' AND a.resultado='SUCCESS' THEN 1 ELSE 0 END) as logins,
-                    SUM(CASE WHEN a.accion='LOGIN_FAILED' THEN 1 ELSE 0 END) as logins_fallidos,
-                    COUNT(DISTINCT CASE WHEN a.resultado='SUCCESS' THEN a.user_id END) as usuarios_unicos
-                FROM audit_log a
-                LEFT JOIN users u ON a.user_id = u.id
+                    r.dia,
+                    SUM(CASE WHEN r.accion='LOGIN' AND r.resultado='SUCCESS' THEN r.total ELSE 0 END) as logins,
+                    SUM(CASE WHEN r.accion='LOGIN_FAILED' THEN r.total ELSE 0 END) as logins_fallidos,
+                    COUNT(DISTINCT CASE WHEN r.resultado='SUCCESS' THEN NULLIF(r.user_id, 0) END) as usuarios_unicos
+                FROM audit_resumen_hora r
+                LEFT JOIN users u ON r.user_id = u.id
                 LEFT JOIN users_empresas ue ON u.id = ue.user_id AND ue.empresa_id = ?
-                WHERE a.empresa_id = ? AND a.fecha >= DATEADD(DAY, ?, GETDATE())
+                WHERE r.empresa_id = ? AND {_DESDE_HORA}
                     AND (u.id IS NULL OR ISNULL(ue.rol, u.rol) NOT IN ('administrador', 'superusuario'))
-                GROUP BY CAST(a.fecha AS DATE)
+                GROUP BY r.dia
                 ORDER BY dia ASC
-            """, (empresa_id, empresa_id, -dias))
+            """, (empresa_id, empresa_id) + (-dias,) * 3)
 
             resultado = []
             for row in cursor.fetchall():
@@ -467,19 +464,20 @@ class EstadisticasModel:
         Excluye administradores y superusuarios.
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
-                SELECT TOP 10 a.accion, COUNT(*) as total
-                FROM audit_log a
-                LEFT JOIN users u ON a.user_id = u.id
+            cursor.execute(f"""
+                SELECT TOP 10 r.accion, SUM(r.total) as total
+                FROM audit_resumen_hora r
+                LEFT JOIN users u ON r.user_id = u.id
                 LEFT JOIN users_empresas ue ON u.id = ue.user_id AND ue.empresa_id = ?
-                WHERE a.empresa_id = ? AND a.fecha >= DATEADD(DAY, ?, GETDATE())
+                WHERE r.empresa_id = ? AND {_DESDE_HORA}
                     AND (u.id IS NULL OR ISNULL(ue.rol, u.rol) NOT IN ('administrador', 'superusuario'))
-                GROUP BY a.accion
+                GROUP BY r.accion
                 ORDER BY total DESC
-            """, (empresa_id, empresa_id, -dias))
+            """, (empresa_id, empresa_id) + (-dias,) * 3)
 
             resultado = []
             for row in cursor.fetchall():
@@ -501,19 +499,20 @@ class EstadisticasModel:
         Excluye administradores y superusuarios.
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
-                SELECT DATEPART(HOUR, a.fecha) as hora, COUNT(*) as total
-                FROM audit_log a
-                LEFT JOIN users u ON a.user_id = u.id
+            cursor.execute(f"""
+                SELECT r.hora, SUM(r.total) as total
+                FROM audit_resumen_hora r
+                LEFT JOIN users u ON r.user_id = u.id
                 LEFT JOIN users_empresas ue ON u.id = ue.user_id AND ue.empresa_id = ?
-                WHERE a.empresa_id = ? AND a.fecha >= DATEADD(DAY, ?, GETDATE())
+                WHERE r.empresa_id = ? AND {_DESDE_HORA}
                     AND (u.id IS NULL OR ISNULL(ue.rol, u.rol) NOT IN ('administrador', 'superusuario'))
-                GROUP BY DATEPART(HOUR, a.fecha)
+                GROUP BY r.hora
                 ORDER BY hora ASC
-            """, (empresa_id, empresa_id, -dias))
+            """, (empresa_id, empresa_id) + (-dias,) * 3)
 
             resultado = []
             for row in cursor.fetchall():
@@ -534,25 +533,26 @@ class EstadisticasModel:
         Obtiene top usuarios por total de acciones.
         """
         conn = Database.get_connection()
+        EstadisticasResumenModel.actualizar(conn)
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT TOP (?)
-                    a.username,
+                    u.username,
                     u.full_name,
-                    COUNT(*) as total_acciones,
-                    COUNT(DISTINCT CAST(a.fecha AS DATE)) as dias_activo,
-                    MAX(a.fecha) as ultima_accion
-                FROM audit_log a
-                INNER JOIN users u ON a.user_id = u.id
+                    SUM(r.total) as total_acciones,
+                    COUNT(DISTINCT r.dia) as dias_activo,
+                    MAX(r.ultima) as ultima_accion
+                FROM audit_resumen_hora r
+                INNER JOIN users u ON r.user_id = u.id
                 INNER JOIN users_empresas ue ON u.id = ue.user_id AND ue.empresa_id = ?
-                WHERE a.empresa_id = ?
-                    AND a.fecha >= DATEADD(DAY, ?, GETDATE())
+                WHERE r.empresa_id = ?
+                    AND {_DESDE_HORA}
                     AND ISNULL(ue.rol, u.rol) = 'usuario'
-                GROUP BY a.username, u.full_name
+                GROUP BY u.username, u.full_name
                 ORDER BY total_acciones DESC
-            """, (limit, empresa_id, empresa_id, -dias))
+            """, (limit, empresa_id, empresa_id) + (-dias,) * 3)
 
             usuarios = []
             for row in cursor.fetchall():
@@ -574,78 +574,14 @@ class EstadisticasModel:
     def get_logins_por_ubicacion(empresa_id='1', dias=30):
         """
         Obtiene logins agrupados por ubicacion geografica.
-        Parsea JSON de detalles en Python (SQL Server 2008 no soporta JSON nativo).
-        Filtra IPs locales/privadas (pais_codigo='LO').
+        Lee el resumen login_ubicacion_dia (lat/lon redondeadas, se suma en el login);
+        las IPs locales/privadas no se registran.
         """
         conn = Database.get_connection()
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
-                SELECT a.detalles, a.username
-                FROM audit_log a
-                WHERE a.empresa_id = ?
-                    AND a.accion = 'LOGIN'
-                    AND a.resultado = 'SUCCESS'
-                    AND a.fecha >= DATEADD(DAY, ?, GETDATE())
-                    AND a.detalles IS NOT NULL
-            """, (empresa_id, -dias))
-
-            # Agrupar por ubicacion redondeada
-            ubicaciones = {}
-            for row in cursor.fetchall():
-                try:
-                    detalles = json.loads(row[0])
-                except (json.JSONDecodeError, TypeError):
-                    continue
-
-                # La ubicacion esta anidada bajo 'ubicacion' en el JSON de detalles
-                ub_data = detalles.get('ubicacion', {})
-                if not ub_data:
-                    continue
-
-                # Filtrar IPs locales/privadas
-                if ub_data.get('pais_codigo') == 'LO':
-                    continue
-
-                lat = ub_data.get('lat')
-                lon = ub_data.get('lon')
-                if lat is None or lon is None:
-                    continue
-
-                # Redondear a 2 decimales para agrupar ubicaciones cercanas
-                lat_r = round(float(lat), 2)
-                lon_r = round(float(lon), 2)
-                key = f"{lat_r},{lon_r}"
-
-                username = row[1]
-
-                if key not in ubicaciones:
-                    ubicaciones[key] = {
-                        'lat': lat_r,
-                        'lon': lon_r,
-                        'pais': ub_data.get('pais', ''),
-                        'ciudad': ub_data.get('ciudad', ''),
-                        'total_logins': 0,
-                        'usuarios': set()
-                    }
-
-                ubicaciones[key]['total_logins'] += 1
-                ubicaciones[key]['usuarios'].add(username)
-
-            # Convertir sets a listas para JSON
-            resultado = []
-            for ub in ubicaciones.values():
-                resultado.append({
-                    'lat': ub['lat'],
-                    'lon': ub['lon'],
-                    'pais': ub['pais'],
-                    'ciudad': ub['ciudad'],
-                    'total_logins': ub['total_logins'],
-                    'usuarios': sorted(list(ub['usuarios']))
-                })
-
-            return resultado
+            return LoginUbicacionModel.get_por_ubicacion(cursor, empresa_id, dias)
         except Exception as e:
             print(f"Error en get_logins_por_ubicacion: {e}")
             return []
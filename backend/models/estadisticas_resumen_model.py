@@ -0,0 +1,193 @@
+# ============================================================
+#      ██╗ ██████╗ ██████╗ ███████╗██████╗ ███████╗
+#      ██║██╔═══██╗██╔══██╗██╔════╝██╔══██╗██╔════╝
+#      ██║██║   ██║██████╔╝█████╗  ██████╔╝███████╗
+# ██   ██║██║   ██║██╔══██╗██╔══╝  ██╔══██╗╚════██║
+# ╚█████╔╝╚██████╔╝██████╔╝███████╗██║  ██║███████║
+#  ╚════╝  ╚═════╝ ╚═════╝ ╚══════╝╚═╝  ╚═╝╚══════╝
+#
+#                ──  Jobers - Iaucejo  ──
+#
+# Autor : iaucejo
+# Fecha : 2026-10-18
+# ============================================================
+
+# ============================================
+# ARCHIVO: models/estadisticas_resumen_model.py
+# Descripcion: Resúmenes incrementales para el dashboard de estadísticas
+#
+# Tablas (BD del cliente, migración 68):
+#   audit_resumen_hora      audit_log por empresa, día, hora, usuario,
+#                           acción y resultado
+#   propuestas_resumen_dia  propuestas por empresa, día y usuario
+#   estadisticas_watermark  último id de origen ya sumado a cada resumen
+#
+# El histórico se resume en la migración 68, que deja la marca en el
+# último id sumado. actualizar() suma a los resúmenes solo las filas
+# de origen con id mayor que la marca (MERGE por tramos de _TRAMO ids)
+# y avanza la marca en la misma transacción. Se ejecuta antes de leer,
+# como mucho una vez cada ESTADISTICAS_RESUMEN_INTERVAL segundos por
+# tenant y proceso; los hilos del mismo tenant que llegan mientras
+# tanto esperan a que termine (no leen resúmenes a medias), y la
+# marca se lee con UPDLOCK, así dos workers no suman las mismas
+# filas. Las filas de los últimos ESTADISTICAS_RESUMEN_RETRASO
+# segundos se dejan para la siguiente vez: un INSERT aún sin
+# confirmar con id menor que la marca se perdería.
+#
+# Los orígenes solo crecen; al borrar un usuario se borran también
+# sus filas de los resúmenes (ver borrar_usuario).
+# ============================================
+import logging
+import threading
+import time
+
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+
+RESUMEN_INTERVAL = env_int('ESTADISTICAS_RESUMEN_INTERVAL', 60)  # segundos entre actualizaciones
+RESUMEN_RETRASO = env_int('ESTADISTICAS_RESUMEN_RETRASO', 60)    # segundos que se deja sin sumar
+_TRAMO = 50000                                                    # ids de origen por MERGE
+
+# nombre -> (tabla de origen, MERGE con parámetros (desde, hasta))
+_RESUMENES = {
+    'audit_resumen_hora': ('audit_log', """
+        MERGE audit_resumen_hora AS t
+        USING (
+            SELECT empresa_id, CAST(fecha AS DATE), DATEPART(HOUR, fecha), ISNULL(user_id, 0),
+                   accion, ISNULL(resultado, ''), COUNT(*), MAX(fecha)
+            FROM audit_log
+            WHERE id > ? AND id <= ? AND empresa_id IS NOT NULL
+            GROUP BY empresa_id, CAST(fecha AS DATE), DATEPART(HOUR, fecha), ISNULL(user_id, 0),
+                     accion, ISNULL(resultado, '')
+        ) AS s (empresa_id, dia, hora, user_id, accion, resultado, total, ultima)
+        ON t.empresa_id = s.empresa_id AND t.dia = s.dia AND t.hora = s.hora
+           AND t.user_id = s.user_id AND t.accion = s.accion AND t.resultado = s.resultado
+        WHEN MATCHED THEN
+            UPDATE SET total = t.total + s.total,
+                       ultima = CASE WHEN t.ultima >= s.ultima THEN t.ultima ELSE s.ultima END
+        WHEN NOT MATCHED THEN
+            INSERT (empresa_id, dia, hora, user_id, accion, resultado, total, ultima)
+            VALUES (s.empresa_id, s.dia, s.hora, s.user_id, s.accion, s.resultado, s.total, s.ultima);
+    """),
+    'propuestas_resumen_dia': ('propuestas', """
+        MERGE propuestas_resumen_dia AS t
+        USING (
+            SELECT ISNULL(empresa_id, ''), CAST(fecha AS DATE), user_id,
+                   COUNT(*), SUM(ISNULL(total_items, 0)), MAX(fecha)
+            FROM propuestas
+            WHERE id > ? AND id <= ? AND fecha IS NOT NULL
+            GROUP BY ISNULL(empresa_id, ''), CAST(fecha AS DATE), user_id
+        ) AS s (empresa_id, dia, user_id, cantidad, total_items, ultima)
+        ON t.empresa_id = s.empresa_id AND t.dia = s.dia AND t.user_id = s.user_id
+        WHEN MATCHED THEN
+            UPDATE SET cantidad = t.cantidad + s.cantidad,
+                       total_items = t.total_items + s.total_items,
+                       ultima = CASE WHEN t.ultima >= s.ultima THEN t.ultima ELSE s.ultima END
+        WHEN NOT MATCHED THEN
+            INSERT (empresa_id, dia, user_id, cantidad, total_items, ultima)
+            VALUES (s.empresa_id, s.dia, s.user_id, s.cantidad, s.total_items, s.ultima);
+    """),
+}
+
+
+class EstadisticasResumenModel:
+    _lock = threading.Lock()
+    _actualizado = {}   # tenant -> time.monotonic() de la última actualización correcta
+    _en_curso = {}      # tenant -> Lock de la actualización (una a la vez por tenant)
+
+    @staticmethod
+    def _tenant():
+        from flask import session, has_request_context
+        return session.get('connection') if has_request_context() else None
+
+    @staticmethod
+    def actualizar(conn, tenant=None, force=False):
+        """
+        Sumar a los resúmenes las filas nuevas de audit_log y propuestas.
+
+        Args:
+            conn: conexión a la BD del tenant (se hace commit por tramo)
+            tenant: clave del tenant para el intervalo (default: conexión de sesión)
+            force: actualizar aunque no haya pasado ESTADISTICAS_RESUMEN_INTERVAL
+
+        Returns:
+            dict nombre -> ids de origen recorridos (None si no tocaba actualizar)
+        """
+        tenant = tenant if tenant is not None else EstadisticasResumenModel._tenant()
+        start = time.monotonic()
+        with EstadisticasResumenModel._lock:
+            last = EstadisticasResumenModel._actualizado.get(tenant)
+            if not force and last is not None and start - last < RESUMEN_INTERVAL:
+                return None
+            en_curso = EstadisticasResumenModel._en_curso.setdefault(tenant, threading.Lock())
+
+        # Si otro hilo está actualizando este tenant se le espera y, si lo ha logrado, no se repite
+        with en_curso:
+            with EstadisticasResumenModel._lock:
+                last = EstadisticasResumenModel._actualizado.get(tenant)
+            if last is not None and last >= start:
+                return None
+
+            sumadas = {}
+            cursor = conn.cursor()
+            try:
+                for nombre, (origen, merge) in _RESUMENES.items():
+                    sumadas[nombre] = EstadisticasResumenModel._actualizar_resumen(
+                        conn, cursor, nombre, origen, merge)
+            except Exception as e:
+                conn.rollback()
+                logger.error(f'Error actualizando resúmenes de estadísticas: {e}')
+                return sumadas
+            finally:
+                cursor.close()
+
+            with EstadisticasResumenModel._lock:
+                EstadisticasResumenModel._actualizado[tenant] = time.monotonic()
+            return sumadas
+
+    @staticmethod
+    def _actualizar_resumen(conn, cursor, nombre, origen, merge):
+        # Límite: última fila con más de RESUMEN_RETRASO segundos (índice por fecha)
+        cursor.execute(f"""
+            SELECT TOP 1 id FROM {origen}
+            WHERE fecha < DATEADD(SECOND, ?, GETDATE())
+            ORDER BY fecha DESC, id DESC
+        """, (-RESUMEN_RETRASO,))
+        row = cursor.fetchone()
+        limite = row[0] if row else 0
+
+        sumadas = 0
+        while True:
+            cursor.execute("""
+                SELECT ultimo_id FROM estadisticas_watermark WITH (UPDLOCK, HOLDLOCK)
+                WHERE nombre = ?
+            """, (nombre,))
+            row = cursor.fetchone()
+            desde = row[0] if row else 0
+            if limite <= desde:
+                conn.commit()
+                return sumadas
+
+            hasta = min(limite, desde + _TRAMO)
+            cursor.execute(merge, (desde, hasta))
+            if row:
+                cursor.execute("""
+                    UPDATE estadisticas_watermark SET ultimo_id = ?, fecha_actualizacion = GETDATE()
+                    WHERE nombre = ?
+                """, (hasta, nombre))
+            else:
+                cursor.execute("""
+                    INSERT INTO estadisticas_watermark (nombre, ultimo_id, fecha_actualizacion)
+                    VALUES (?, ?, GETDATE())
+                """, (nombre, hasta))
+            conn.commit()
+            sumadas += hasta - desde
+
+    @staticmethod
+    def borrar_usuario(cursor, user_id):
+        """Quitar de los resúmenes las filas de un usuario (dentro de la transacción del borrado)."""
+        cursor.execute("DELETE FROM audit_resumen_hora WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM propuestas_resumen_dia WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM login_ubicacion_dia WHERE user_id = ?", (user_id,))
@@ -21,6 +21,7 @@ import math
 import time
 import logging
 from config.database import Database
+from utils.pagination import listing_total
 
 logger = logging.getLogger(__name__)
 
@@ -72,12 +73,12 @@ class FacturaModel:
         return result
 
     @staticmethod
-    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50):
+    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50, exact=True):
         """
         Obtiene facturas de un cliente con paginacion servidor.
 
         Returns:
-            dict: { facturas, total, page, page_size, total_pages }
+            dict: { facturas, total, total_exact, page, page_size, total_pages }
         """
         t0 = time.time()
         conn = Database.get_connection()
@@ -113,9 +114,8 @@ class FacturaModel:
 
             where = " AND ".join(where_parts)
 
-            # 1. Count total
-            cursor.execute(f"SELECT COUNT(*) FROM view_externos_venfac v WHERE {where}", params)
-            total = cursor.fetchone()[0]
+            # 1. Count total (cacheado por filtros; estimado si exact=False)
+            total, total_exact = listing_total(cursor, 'view_externos_venfac v', where, params, exact)
             t2 = time.time()
             logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
 
@@ -158,6 +158,7 @@ class FacturaModel:
             return {
                 'facturas': facturas,
                 'total': total,
+                'total_exact': total_exact,
                 'page': page,
                 'page_size': page_size,
                 'total_pages': total_pages
@@ -228,12 +229,12 @@ class FacturaModel:
             conn.close()
 
     @staticmethod
-    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None):
+    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None, exact=True):
         """
         Obtiene todas las facturas con paginacion servidor (para administradores).
 
         Returns:
-            dict: { facturas, total, page, page_size, total_pages }
+            dict: { facturas, total, total_exact, page, page_size, total_pages }
         """
         t0 = time.time()
         conn = Database.get_connection()
@@ -282,9 +283,8 @@ class FacturaModel:
 
             where = " AND ".join(where_parts)
 
-            # 1. Count total
-            cursor.execute(f"SELECT COUNT(*) FROM view_externos_venfac v WHERE {where}", params)
-            total = cursor.fetchone()[0]
+            # 1. Count total (cacheado por filtros; estimado si exact=False)
+            total, total_exact = listing_total(cursor, 'view_externos_venfac v', where, params, exact)
             t2 = time.time()
             logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
 
@@ -327,6 +327,7 @@ class FacturaModel:
             return {
                 'facturas': facturas,
                 'total': total,
+                'total_exact': total_exact,
                 'page': page,
                 'page_size': page_size,
                 'total_pages': total_pages
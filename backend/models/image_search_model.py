@@ -6,14 +6,40 @@
 
 import numpy as np
 import logging
+import os
 import threading
+import time
 from config.database import Database
+from utils import embedding_index, fast_features
+from utils.embedding_index import EmbeddingIndex
+from utils.ann_index import IVFPQIndex, ANN_MIN_ROWS
+from utils.feature_pipeline import extract_parallel, iter_cursor_rows, INDEX_WORKERS
+from utils.feature_cache import QueryFeatureCache
+from utils.env import env_int
 from scipy.stats import skew as scipy_skew
 
 logger = logging.getLogger(__name__)
 
 # Version de embeddings - cambiar al modificar extract_features()
-EMBEDDING_VERSION = 3
+# v4: bloques por grupo normalizados SIN ponderar; los pesos se aplican al buscar
+EMBEDDING_VERSION = 4
+
+# Valor de image_embeddings.embedding_type para vectores sin ponderar (v4+).
+# Filas con otro valor son v3 (ponderadas con LEGACY_FEATURE_WEIGHTS al extraer)
+EMBEDDING_TYPE = 'cbir_unweighted'
+
+# Grupos de features en el orden del vector (nombre, dimensiones)
+FEATURE_GROUPS = [
+    ('spatial_color', 48),
+    ('structural', 256),
+    ('color_hist', 128),
+    ('color_moments', 9),
+    ('hog', 144),
+    ('lbp', 54),
+    ('glcm', 4),
+    ('edge', 80),
+]
+FEATURE_BLOCK_OFFSETS = np.concatenate([[0], np.cumsum([d for _, d in FEATURE_GROUPS])])
 
 # Pesos por grupo de features (suman 1.0)
 # Priorizamos descriptores ESPACIALES (donde estan los colores/patrones)
@@ -29,6 +55,78 @@ FEATURE_WEIGHTS = {
     'edge': 0.05,            # Bordes global
 }
 
+# Pesos con los que se grabaron los embeddings v3 (para des-ponderarlos al cargar)
+LEGACY_FEATURE_WEIGHTS = dict(FEATURE_WEIGHTS)
+
+# Perfiles de ponderacion seleccionables por peticion (A/B de calidad de ranking)
+WEIGHT_PROFILES = {
+    'default': FEATURE_WEIGHTS,
+    'colour-first': {
+        'spatial_color': 0.35, 'structural': 0.10, 'color_hist': 0.25, 'color_moments': 0.10,
+        'hog': 0.05, 'lbp': 0.05, 'glcm': 0.05, 'edge': 0.05,
+    },
+    'texture-first': {
+        'spatial_color': 0.10, 'structural': 0.15, 'color_hist': 0.05, 'color_moments': 0.05,
+        'hog': 0.25, 'lbp': 0.20, 'glcm': 0.10, 'edge': 0.10,
+    },
+    'pattern-first': {
+        'spatial_color': 0.30, 'structural': 0.35, 'color_hist': 0.05, 'color_moments': 0.05,
+        'hog': 0.15, 'lbp': 0.05, 'glcm': 0.025, 'edge': 0.025,
+    },
+}
+
+
+def resolve_weights(profile=None, overrides=None):
+    """
+    Pesos por grupo (array en el orden de FEATURE_GROUPS) para una busqueda.
+
+    Args:
+        profile: nombre de WEIGHT_PROFILES (None = 'default')
+        overrides: dict {grupo: peso} que sustituye pesos del perfil
+
+    Raises:
+        ValueError: perfil desconocido, grupo desconocido o peso negativo
+    """
+    if profile is not None and not isinstance(profile, str):
+        raise ValueError('weight_profile debe ser un texto')
+    if overrides is not None and not isinstance(overrides, dict):
+        raise ValueError('weights debe ser un objeto {grupo: peso}')
+    name = profile or 'default'
+    if name not in WEIGHT_PROFILES:
+        raise ValueError(f"Perfil de pesos desconocido: {name}. Validos: {', '.join(WEIGHT_PROFILES)}")
+    weights = dict(WEIGHT_PROFILES[name])
+    for group, value in (overrides or {}).items():
+        if group not in weights:
+            raise ValueError(f'Grupo de features desconocido: {group}')
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Peso no numerico para {group}')
+        if value < 0:
+            raise ValueError(f'Peso negativo para {group}')
+        weights[group] = value
+    result = np.array([weights[g] for g, _ in FEATURE_GROUPS], dtype=np.float32)
+    if not result.any():
+        raise ValueError('Todos los pesos son 0')
+    return result
+
+
+def _legacy_unweight(matrix):
+    """Convierte vectores v3 (bloques multiplicados por su peso) a bloques sin ponderar."""
+    w = np.array([LEGACY_FEATURE_WEIGHTS[g] for g, _ in FEATURE_GROUPS], dtype=np.float32)
+    return matrix / np.repeat(w, np.diff(FEATURE_BLOCK_OFFSETS))
+
+
+# Por debajo de este numero de imagenes se extrae en el mismo hilo (sin pool de procesos)
+PARALLEL_MIN_IMAGES = 100
+
+# Embeddings por lote al escribir en image_embeddings (un commit por lote)
+WRITE_BATCH_SIZE = env_int('IMAGE_INDEX_BATCH_SIZE', 500)
+WRITE_RETRIES = 2
+
+# Extractor vectorizado (utils.fast_features); false = implementacion de referencia
+FAST_FEATURES = os.environ.get('IMAGE_FEATURES_FAST', 'true').lower() not in ('0', 'false', 'no')
+
 # Umbrales de similitud
 MIN_SIMILARITY = 35.0        # Umbral absoluto: minimo 35%
 RELATIVE_THRESHOLD = 0.50    # Umbral relativo: >= 50% del mejor score
@@ -45,27 +143,46 @@ def _normalize_group(vec):
     return vec / norm
 
 
+def _decode_tile(image_bytes):
+    """Decodifica la imagen y devuelve (hsv, gray) a 256x256, o None si no es valida."""
+    import cv2
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        logger.error(f'cv2.imdecode returned None (input size: {len(image_bytes)} bytes)')
+        return None
+
+    # Redimensionar para consistencia
+    img = cv2.resize(img, (256, 256))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2HSV), cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
 def extract_features(image_bytes):
     """
     Extrae vector de features de una imagen para busqueda visual.
-    Usa 8 grupos de descriptores priorizando apariencia espacial.
-    Retorna vector numpy normalizado.
+    Usa 8 grupos de descriptores (FEATURE_GROUPS), cada uno normalizado a
+    norma unitaria y SIN ponderar: los pesos se aplican al buscar.
+    Retorna vector numpy float32.
+
+    Usa la implementacion vectorizada salvo IMAGE_FEATURES_FAST=false;
+    ambas producen el mismo vector (misma EMBEDDING_VERSION).
     """
+    if FAST_FEATURES:
+        return extract_features_fast(image_bytes)
+    return extract_features_reference(image_bytes)
+
+
+def extract_features_reference(image_bytes):
+    """Implementacion de referencia de extract_features() (skimage + bucles por celda)."""
     try:
         import cv2
         from skimage.feature import local_binary_pattern, graycomatrix, graycoprops
 
-        # Decodificar imagen
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            logger.error(f'cv2.imdecode returned None (input size: {len(image_bytes)} bytes)')
+        decoded = _decode_tile(image_bytes)
+        if decoded is None:
             return None
-
-        # Redimensionar para consistencia
-        img = cv2.resize(img, (256, 256))
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        hsv, gray = decoded
 
         # ---- 1. SPATIAL COLOR LAYOUT (48 dims) ----
         # Divide el azulejo en cuadricula 4x4, captura color medio por zona
@@ -79,14 +196,14 @@ def extract_features(image_bytes):
                 spatial_colors.append(np.mean(region[:, :, 1]) / 255.0)  # S normalizado
                 spatial_colors.append(np.mean(region[:, :, 2]) / 255.0)  # V normalizado
         spatial_color = np.array(spatial_colors)  # 4*4*3 = 48 dims
-        spatial_color = _normalize_group(spatial_color) * FEATURE_WEIGHTS['spatial_color']
+        spatial_color = _normalize_group(spatial_color)
 
         # ---- 2. STRUCTURAL THUMBNAIL (256 dims) ----
         # Miniatura 16x16 en escala de grises = "como se ve de lejos"
         # Captura la apariencia GLOBAL del azulejo
         thumb = cv2.resize(gray, (16, 16), interpolation=cv2.INTER_AREA)
         structural = thumb.astype(np.float64).ravel() / 255.0  # 256 dims
-        structural = _normalize_group(structural) * FEATURE_WEIGHTS['structural']
+        structural = _normalize_group(structural)
 
         # ---- 3. Histograma de color HSV reducido (128 bins) ----
         hist_h = cv2.calcHist([hsv], [0], None, [32], [0, 180]).flatten()
@@ -94,7 +211,7 @@ def extract_features(image_bytes):
         hist_v = cv2.calcHist([hsv], [2], None, [48], [0, 256]).flatten()
         color_hist = np.concatenate([hist_h, hist_s, hist_v])  # 128 dims
         color_hist = color_hist / (color_hist.sum() + 1e-7)
-        color_hist = _normalize_group(color_hist) * FEATURE_WEIGHTS['color_hist']
+        color_hist = _normalize_group(color_hist)
 
         # ---- 4. Color Moments (9 dims) ----
         color_moments = []
@@ -104,7 +221,7 @@ def extract_features(image_bytes):
             color_moments.append(np.var(channel) / (255.0 ** 2))
             color_moments.append(scipy_skew(channel) / 10.0)
         color_moments = np.array(color_moments, dtype=np.float64)  # 9 dims
-        color_moments = _normalize_group(color_moments) * FEATURE_WEIGHTS['color_moments']
+        color_moments = _normalize_group(color_moments)
 
         # ---- 5. HOG espacial (144 dims) ----
         edges_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
@@ -127,7 +244,7 @@ def extract_features(image_bytes):
                 cell_hist = cell_hist / (cell_hist.sum() + 1e-7)
                 hog_features.extend(cell_hist)
         hog_features = np.array(hog_features)  # 144 dims
-        hog_features = _normalize_group(hog_features) * FEATURE_WEIGHTS['hog']
+        hog_features = _normalize_group(hog_features)
 
         # ---- 6. Multi-scale LBP (54 dims) ----
         lbp_all = []
@@ -139,7 +256,7 @@ def extract_features(image_bytes):
             lbp_hist = lbp_hist.astype(np.float64) / (lbp_hist.sum() + 1e-7)
             lbp_all.append(lbp_hist)
         lbp_features = np.concatenate(lbp_all)  # 54 dims
-        lbp_features = _normalize_group(lbp_features) * FEATURE_WEIGHTS['lbp']
+        lbp_features = _normalize_group(lbp_features)
 
         # ---- 7. GLCM Texture (4 dims) ----
         gray_q = (gray // 4).astype(np.uint8)
@@ -151,13 +268,13 @@ def extract_features(image_bytes):
             graycoprops(glcm, 'correlation').mean(),
             graycoprops(glcm, 'dissimilarity').mean()
         ])  # 4 dims
-        glcm_features = _normalize_group(glcm_features) * FEATURE_WEIGHTS['glcm']
+        glcm_features = _normalize_group(glcm_features)
 
         # ---- 8. Histograma de bordes global (80 dims) ----
         edge_hist, _ = np.histogram(angle.ravel(), bins=80, range=(0, 360),
                                      weights=magnitude.ravel())
         edge_hist = edge_hist / (edge_hist.sum() + 1e-7)
-        edge_hist = _normalize_group(edge_hist) * FEATURE_WEIGHTS['edge']
+        edge_hist = _normalize_group(edge_hist)
 
         # Combinar (48+256+128+9+144+54+4+80 = 723 dims)
         feature_vector = np.concatenate([
@@ -171,6 +288,95 @@ def extract_features(image_bytes):
         return None
 
 
+# Vectores de imagenes de consulta ya procesadas (reintentos / refinados desde movil)
+query_feature_cache = QueryFeatureCache(redis_url=os.environ.get('REDIS_URL'))
+
+
+def extract_query_features(image_bytes):
+    """
+    extract_features() para imagenes de consulta, con cache por contenido
+    (SHA-256 de los bytes + EMBEDDING_VERSION).
+
+    Returns:
+        (vector float32 o None, True si vino de cache)
+    """
+    key = QueryFeatureCache.make_key(image_bytes, EMBEDDING_VERSION)
+    cached = query_feature_cache.get(key)
+    if cached is not None:
+        return cached, True
+    vector = extract_features(image_bytes)
+    query_feature_cache.put(key, vector)
+    return vector, False
+
+
+def extract_features_fast(image_bytes):
+    """
+    Variante vectorizada de extract_features_reference(): pooling por celdas
+    con reshape, LBP uniform y GLCM en NumPy (utils.fast_features). Mismo
+    vector salvo redondeo en coma flotante.
+    """
+    try:
+        import cv2
+
+        decoded = _decode_tile(image_bytes)
+        if decoded is None:
+            return None
+        hsv, gray = decoded
+
+        # ---- 1. SPATIAL COLOR LAYOUT (48 dims) ----
+        spatial_color = fast_features.cell_means(hsv, 4) / np.array([180.0, 255.0, 255.0])
+        spatial_color = _normalize_group(spatial_color.ravel())
+
+        # ---- 2. STRUCTURAL THUMBNAIL (256 dims) ----
+        thumb = cv2.resize(gray, (16, 16), interpolation=cv2.INTER_AREA)
+        structural = _normalize_group(thumb.astype(np.float64).ravel() / 255.0)
+
+        # ---- 3. Histograma de color HSV reducido (128 bins) ----
+        hist_h = cv2.calcHist([hsv], [0], None, [32], [0, 180]).flatten()
+        hist_s = cv2.calcHist([hsv], [1], None, [48], [0, 256]).flatten()
+        hist_v = cv2.calcHist([hsv], [2], None, [48], [0, 256]).flatten()
+        color_hist = np.concatenate([hist_h, hist_s, hist_v])
+        color_hist = _normalize_group(color_hist / (color_hist.sum() + 1e-7))
+
+        # ---- 4. Color Moments (9 dims) ----
+        moments = fast_features.color_moments(hsv) / np.array([255.0, 255.0 ** 2, 10.0])
+        color_moments = _normalize_group(moments.ravel())
+
+        # ---- 5. HOG espacial (144 dims) + 8. Histograma de bordes (80 dims) ----
+        edges_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+        edges_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+        magnitude = np.sqrt(edges_x ** 2 + edges_y ** 2)
+        angle = np.arctan2(edges_y, edges_x) * 180 / np.pi + 180
+
+        hog = fast_features.cell_histograms(
+            fast_features.bin_index(angle, 9, 0, 360), magnitude, 9, 4)
+        hog = hog / (hog.sum(axis=1, keepdims=True) + 1e-7)
+        hog_features = _normalize_group(hog.ravel())
+
+        edge_hist = fast_features.cell_histograms(
+            fast_features.bin_index(angle, 80, 0, 360), magnitude, 80, 1)[0]
+        edge_hist = _normalize_group(edge_hist / (edge_hist.sum() + 1e-7))
+
+        # ---- 6. Multi-scale LBP (54 dims) ----
+        lbp_features = _normalize_group(np.concatenate([
+            fast_features.uniform_lbp_histogram(gray, 8 * radius, radius)
+            for radius in (1, 2, 3)
+        ]))
+
+        # ---- 7. GLCM Texture (4 dims) ----
+        glcm_features = _normalize_group(fast_features.glcm_features(gray // 4, 64))
+
+        feature_vector = np.concatenate([
+            spatial_color, structural, color_hist, color_moments,
+            hog_features, lbp_features, glcm_features, edge_hist
+        ])
+        return feature_vector.astype(np.float32)
+
+    except Exception as e:
+        logger.error(f'Error extracting features: {e}')
+        return None
+
+
 def cosine_similarity(a, b):
     """Similitud coseno entre dos vectores."""
     dot = np.dot(a, b)
@@ -194,11 +400,116 @@ def bytes_to_vector(raw):
     return np.frombuffer(raw, dtype=np.float32)
 
 
+# ==================== BATCH WRITER ====================
+
+class EmbeddingWriter:
+    """
+    Escritor por lotes de image_embeddings.
+
+    Acumula embeddings y los inserta con fast_executemany en lotes de
+    `batch_size` filas, con un unico commit por lote. Si un lote falla se
+    hace rollback y se reintenta (con conexion nueva) hasta `retries` veces;
+    si sigue fallando, sus filas se cuentan como fallidas y se continua.
+
+    Uso:
+        with EmbeddingWriter(empresa_id, connection_id) as writer:
+            writer.add(imagen_id, codigo, vec)
+        writer.written, writer.failed
+    """
+
+    INSERT_SQL = """
+        INSERT INTO image_embeddings (imagen_id, codigo, empresa_id, embedding, embedding_type)
+        VALUES (?, ?, ?, ?, ?)
+    """
+
+    def __init__(self, empresa_id, connection_id=None, batch_size=None, retries=WRITE_RETRIES):
+        self.empresa_id = empresa_id or '1'
+        self.connection_id = connection_id
+        self.batch_size = batch_size or WRITE_BATCH_SIZE
+        self.retries = retries
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._pending = []
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        self.close()
+        return False
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def add(self, imagen_id, codigo, embedding_vector):
+        """Encola un embedding; escribe el lote cuando se llena."""
+        self._pending.append((imagen_id, codigo, self.empresa_id,
+                              vector_to_bytes(embedding_vector), EMBEDDING_TYPE))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Escribe los embeddings pendientes (un commit). Retorna filas escritas."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+
+        for attempt in range(self.retries + 1):
+            try:
+                if self._conn is None:
+                    self._conn = ImageSearchModel._get_conn(self.connection_id)
+                cursor = self._conn.cursor()
+                cursor.fast_executemany = True
+                cursor.executemany(self.INSERT_SQL, batch)
+                self._conn.commit()
+                cursor.close()
+                self.written += len(batch)
+                self.batches += 1
+                return len(batch)
+            except Exception as e:
+                logger.warning(f'Embedding batch of {len(batch)} failed (attempt {attempt + 1}): {e}')
+                self._reset_connection()
+                if attempt < self.retries:
+                    time.sleep(0.5 * (attempt + 1))
+
+        logger.error(f'Embedding batch of {len(batch)} discarded after {self.retries + 1} attempts')
+        self.failed += len(batch)
+        return 0
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _reset_connection(self):
+        """Deshacer el lote a medias y descartar la conexion (puede estar rota)."""
+        if self._conn is None:
+            return
+        try:
+            self._conn.rollback()
+        except Exception:
+            pass
+        if hasattr(self._conn, 'discard'):
+            self._conn.discard()
+        else:
+            self.close()
+        self._conn = None
+
+
 # ==================== MODEL ====================
 
 class ImageSearchModel:
 
-    # Cache en memoria de embeddings {empresa_id: [(codigo, imagen_id, vector), ...]}
+    # Cache de indices por proceso {clave: (generacion, EmbeddingIndex)}
+    # La matriz es un numpy.memmap del indice en disco, compartido entre workers
     _cache = {}
     _cache_lock = threading.Lock()
 
@@ -207,6 +518,65 @@ class ImageSearchModel:
         """Obtener conexion BD, con soporte para threads sin contexto Flask."""
         return Database.get_connection(connection_id)
 
+    @staticmethod
+    def _index_key(empresa_id=None, connection_id=None):
+        """Clave del indice: conexion (BD de la empresa cliente) + empresa ERP."""
+        if connection_id is None:
+            from flask import session, has_request_context
+            if has_request_context():
+                connection_id = session.get('connection')
+        return f"{connection_id or '0'}_{empresa_id or '_all'}"
+
+    @staticmethod
+    def get_index(empresa_id=None, connection_id=None):
+        """
+        Obtener el EmbeddingIndex de la empresa.
+
+        Orden: cache del proceso (si sigue siendo la generacion activa en disco),
+        indice en disco (memmap, sin tocar BD) y, si no hay, carga desde BD.
+        """
+        key = ImageSearchModel._index_key(empresa_id, connection_id)
+        manifest = embedding_index.read_manifest(key)
+
+        with ImageSearchModel._cache_lock:
+            cached = ImageSearchModel._cache.get(key)
+
+        if cached is not None:
+            generation, index = cached
+            if manifest is not None and generation == manifest.get('generation'):
+                return index
+            if manifest is None and generation is None:
+                # Indice solo en memoria (disco no disponible)
+                return index
+
+        if manifest is not None and manifest.get('version') == EMBEDDING_VERSION:
+            try:
+                index = embedding_index.load_index(manifest)
+                with ImageSearchModel._cache_lock:
+                    ImageSearchModel._cache[key] = (manifest['generation'], index)
+                logger.info(f'Opened on-disk index {manifest["generation"]} ({len(index)} embeddings)')
+                return index
+            except Exception as e:
+                logger.warning(f'Could not open on-disk index for {key}: {e}')
+
+        return ImageSearchModel.load_all_embeddings(empresa_id, connection_id=connection_id)
+
+    @staticmethod
+    def get_cached_index(empresa_id=None, connection_id=None):
+        """Indice cacheado en este proceso (o None), sin cargar nada."""
+        key = ImageSearchModel._index_key(empresa_id, connection_id)
+        with ImageSearchModel._cache_lock:
+            cached = ImageSearchModel._cache.get(key)
+        return cached[1] if cached else None
+
+    @staticmethod
+    def invalidate_cache(empresa_id=None, connection_id=None):
+        """Invalidar el indice de la empresa en este proceso y en disco (resto de workers)."""
+        key = ImageSearchModel._index_key(empresa_id, connection_id)
+        with ImageSearchModel._cache_lock:
+            ImageSearchModel._cache.pop(key, None)
+        embedding_index.remove_index(key)
+
     @staticmethod
     def get_embedding_count(empresa_id=None, connection_id=None):
         """Contar embeddings indexados."""
@@ -249,9 +619,9 @@ class ImageSearchModel:
             cursor = conn.cursor()
             raw = vector_to_bytes(embedding_vector)
             cursor.execute("""
-                INSERT INTO image_embeddings (imagen_id, codigo, empresa_id, embedding)
-                VALUES (?, ?, ?, ?)
-            """, [imagen_id, codigo, empresa_id, raw])
+                INSERT INTO image_embeddings (imagen_id, codigo, empresa_id, embedding, embedding_type)
+                VALUES (?, ?, ?, ?, ?)
+            """, [imagen_id, codigo, empresa_id, raw, EMBEDDING_TYPE])
             conn.commit()
             conn.close()
             return True
@@ -312,77 +682,145 @@ class ImageSearchModel:
             return False
 
     @staticmethod
-    def load_all_embeddings(empresa_id=None, connection_id=None):
-        """Cargar todos los embeddings desde BD a cache en memoria."""
+    def load_all_embeddings(empresa_id=None, connection_id=None, train_ann=False):
+        """
+        Cargar todos los embeddings desde BD y publicarlos como indice en disco.
+        Retorna un EmbeddingIndex (matriz float32 + normas + codigo/imagen_id).
+
+        Con ANN_MIN_ROWS embeddings o mas se adjunta el indice aproximado IVF-PQ:
+        train_ann=True lo entrena de nuevo (fin de reindex); si no, se reutilizan
+        los cuantizadores del indice anterior y solo se recodifican las filas.
+        """
         try:
             conn = ImageSearchModel._get_conn(connection_id)
             cursor = conn.cursor()
             if empresa_id:
-                cursor.execute("SELECT codigo, imagen_id, embedding FROM image_embeddings WHERE empresa_id = ?", [empresa_id])
+                cursor.execute("SELECT codigo, imagen_id, embedding, embedding_type FROM image_embeddings WHERE empresa_id = ?", [empresa_id])
             else:
-                cursor.execute("SELECT codigo, imagen_id, embedding FROM image_embeddings")
+                cursor.execute("SELECT codigo, imagen_id, embedding, embedding_type FROM image_embeddings")
 
-            embeddings = []
-            expected_dims = None
+            codigos = []
+            imagen_ids = []
+            raws = []
+            legacy = []
+            expected_bytes = None
             skipped = 0
             for row in cursor.fetchall():
-                vec = bytes_to_vector(row[2])
+                raw = bytes(row[2])
                 # Verificar dimension compatible (primera vez se establece referencia)
-                if expected_dims is None:
-                    expected_dims = len(vec)
-                if len(vec) != expected_dims:
+                if expected_bytes is None:
+                    expected_bytes = len(raw)
+                if len(raw) != expected_bytes:
                     skipped += 1
                     continue
-                embeddings.append((row[0], row[1], vec))
+                codigos.append(row[0])
+                imagen_ids.append(row[1])
+                raws.append(raw)
+                legacy.append(row[3] != EMBEDDING_TYPE)
             conn.close()
 
             if skipped > 0:
                 logger.warning(f'Skipped {skipped} embeddings with mismatched dimensions')
 
-            cache_key = empresa_id or '_all'
+            # Una sola matriz float32 contigua (n x dims) en lugar de n vectores sueltos
+            if raws:
+                matrix = np.frombuffer(b''.join(raws), dtype=np.float32).reshape(len(raws), -1)
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+
+            # Embeddings v3 (ponderados al extraer): quitar los pesos para trabajar con bloques puros
+            legacy = np.array(legacy, dtype=bool)
+            block_offsets = FEATURE_BLOCK_OFFSETS if matrix.shape[1] == FEATURE_BLOCK_OFFSETS[-1] else None
+            if legacy.any() and block_offsets is not None:
+                matrix = matrix.copy()
+                matrix[legacy] = _legacy_unweight(matrix[legacy])
+                logger.info(f'Converted {int(legacy.sum())} legacy weighted embeddings to unweighted blocks')
+
+            embeddings = EmbeddingIndex(codigos, imagen_ids, matrix, block_offsets=block_offsets)
+            logger.info(f'Loaded {len(embeddings)} embeddings from DB')
+
+            key = ImageSearchModel._index_key(empresa_id, connection_id)
+            if len(embeddings) >= ANN_MIN_ROWS:
+                ImageSearchModel._attach_ann(embeddings, key, train_ann)
+
+            # Publicar en disco (nueva generacion, swap atomico) y usar la version memmap
+            generation = None
+            try:
+                manifest = embedding_index.save_index(embeddings, key, EMBEDDING_VERSION)
+                embeddings = embedding_index.load_index(manifest)
+                generation = manifest['generation']
+            except Exception as e:
+                logger.warning(f'Could not write on-disk index for {key}, keeping it in memory: {e}')
+
             with ImageSearchModel._cache_lock:
-                ImageSearchModel._cache[cache_key] = embeddings
+                ImageSearchModel._cache[key] = (generation, embeddings)
 
-            logger.info(f'Loaded {len(embeddings)} embeddings into cache')
             return embeddings
         except Exception as e:
             logger.error(f'Error loading embeddings: {e}')
-            return []
+            return EmbeddingIndex.from_rows([])
+
+    @staticmethod
+    def _attach_ann(embeddings, key, train):
+        """Construir el indice aproximado IVF-PQ del EmbeddingIndex (entrenando o reutilizando cuantizadores)."""
+        previous = None
+        if not train:
+            with ImageSearchModel._cache_lock:
+                cached = ImageSearchModel._cache.get(key)
+            if cached is not None:
+                previous = cached[1].ann
+            else:
+                manifest = embedding_index.read_manifest(key)
+                if manifest and manifest.get('ann') and manifest.get('version') == EMBEDDING_VERSION:
+                    try:
+                        previous = embedding_index.load_index(manifest).ann
+                    except Exception:
+                        previous = None
+            if previous is not None and previous.dims != embeddings.dims:
+                previous = None
+
+        try:
+            if previous is not None:
+                embeddings.ann = previous.rebuild(embeddings.matrix, embeddings.norms)
+            elif train:
+                logger.info(f'Training IVF-PQ index for {key} ({len(embeddings)} embeddings)')
+                embeddings.ann = IVFPQIndex.train(embeddings.matrix, embeddings.norms)
+        except Exception as e:
+            logger.error(f'Could not build IVF-PQ index for {key}, using exact search: {e}', exc_info=True)
+            embeddings.ann = None
 
     @staticmethod
     def search(query_vector, empresa_id=None, top_k=20,
-               min_similarity=MIN_SIMILARITY, relative_threshold=RELATIVE_THRESHOLD):
+               min_similarity=MIN_SIMILARITY, relative_threshold=RELATIVE_THRESHOLD,
+               weights=None):
         """
         Buscar imagenes similares por vector de features.
         Aplica umbral absoluto y relativo para filtrar resultados debiles.
+        weights: pesos por grupo (ver resolve_weights); None = FEATURE_WEIGHTS.
         Retorna lista de (codigo, imagen_id, similarity_score).
         """
-        cache_key = empresa_id or '_all'
+        if weights is None:
+            weights = resolve_weights()
 
-        with ImageSearchModel._cache_lock:
-            embeddings = ImageSearchModel._cache.get(cache_key)
-
-        if embeddings is None:
-            embeddings = ImageSearchModel.load_all_embeddings(empresa_id)
+        embeddings = ImageSearchModel.get_index(empresa_id)
 
         if not embeddings:
             return []
 
         # Verificar compatibilidad de dimensiones
-        stored_dims = len(embeddings[0][2])
+        stored_dims = embeddings.dims
         query_dims = len(query_vector)
         if stored_dims != query_dims:
             # Cache obsoleta - forzar recarga desde BD por si ya se reindexo
             logger.warning(f'Dimension mismatch (cache={stored_dims}, query={query_dims}), reloading from DB...')
-            with ImageSearchModel._cache_lock:
-                ImageSearchModel._cache.pop(cache_key, None)
+            ImageSearchModel.invalidate_cache(empresa_id)
             embeddings = ImageSearchModel.load_all_embeddings(empresa_id)
 
             if not embeddings:
                 return []
 
             # Comprobar de nuevo tras recarga
-            stored_dims = len(embeddings[0][2])
+            stored_dims = embeddings.dims
             if stored_dims != query_dims:
                 raise ValueError(
                     f'REINDEX_NEEDED: Los embeddings almacenados ({stored_dims} dims) '
@@ -390,22 +828,9 @@ class ImageSearchModel:
                     f'Es necesario reindexar las imagenes desde Control BD.'
                 )
 
-        # Calcular similitud con todos los embeddings
-        scores = []
-        for codigo, imagen_id, vec in embeddings:
-            sim = cosine_similarity(query_vector, vec)
-            scores.append((codigo, imagen_id, sim))
-
-        # Ordenar por similitud descendente
-        scores.sort(key=lambda x: x[2], reverse=True)
-
-        # Deduplicar por codigo (mantener mejor score)
-        seen = set()
-        deduped = []
-        for codigo, imagen_id, sim in scores:
-            if codigo not in seen:
-                seen.add(codigo)
-                deduped.append((codigo, imagen_id, sim))
+        # Similitud contra toda la matriz + top-k deduplicado por codigo
+        # (los umbrales solo descartan por abajo, asi que basta con los top_k mejores)
+        deduped = embeddings.top_k(query_vector, top_k, weights=weights)
 
         if not deduped:
             return []
@@ -431,8 +856,6 @@ class ImageSearchModel:
                 'imagen_id': imagen_id,
                 'similarity': sim_pct
             })
-            if len(results) >= top_k:
-                break
 
         return results
 
@@ -450,10 +873,8 @@ class ImageSearchModel:
             ImageSearchModel.clear_embeddings(empresa_id, connection_id=connection_id)
             logger.info('Old embeddings cleared from DB')
 
-            # Limpiar cache inmediatamente
-            cache_key = empresa_id or '_all'
-            with ImageSearchModel._cache_lock:
-                ImageSearchModel._cache.pop(cache_key, None)
+            # Limpiar cache inmediatamente (este proceso y el indice en disco)
+            ImageSearchModel.invalidate_cache(empresa_id, connection_id=connection_id)
             logger.info('Cache invalidated')
 
             # 2. Contar total de imagenes primero (query ligera, filtrado por empresa)
@@ -471,13 +892,13 @@ class ImageSearchModel:
                 logger.info('No images to index')
                 return (0, 0)
 
-            logger.info(f'Total images: {total_images}, starting feature extraction one by one')
+            logger.info(f'Total images: {total_images}, starting feature extraction ({INDEX_WORKERS} workers)')
 
             if progress_callback:
                 progress_callback(0, total_images, 0)
 
-            # 3. Procesar imagen por imagen (no fetchall con 150MB)
-            # Usar conexion separada para lectura y escritura
+            # 3. Leer imagen por imagen (no fetchall con 150MB) y extraer features
+            # en un pool de procesos. Usar conexion separada para lectura y escritura
             read_conn = ImageSearchModel._get_conn(connection_id)
             read_cursor = read_conn.cursor()
             if empresa_id:
@@ -485,66 +906,41 @@ class ImageSearchModel:
             else:
                 read_cursor.execute("SELECT id, codigo, imagen FROM view_articulo_imagen")
 
-            write_conn = ImageSearchModel._get_conn(connection_id)
-            write_cursor = write_conn.cursor()
-
             count = 0
             errors = 0
             first_error_logged = False
-            emp = empresa_id or '1'
-            row = read_cursor.fetchone()
-            while row is not None:
-                imagen_id = row[0]
-                codigo = row[1]
-                image_data = row[2]
-
-                if image_data:
-                    # Extraer features
-                    try:
-                        vec = extract_features(bytes(image_data))
-                    except Exception as ex:
-                        if not first_error_logged:
-                            logger.error(f'extract_features exception on imagen_id={imagen_id}, codigo={codigo}: {ex}', exc_info=True)
-                            first_error_logged = True
-                        vec = None
-
+            with EmbeddingWriter(empresa_id, connection_id=connection_id) as writer:
+                results = extract_parallel(iter_cursor_rows(read_cursor), extract_features)
+                for imagen_id, codigo, vec, error in results:
                     if vec is not None:
-                        try:
-                            raw = vector_to_bytes(vec)
-                            write_cursor.execute("""
-                                INSERT INTO image_embeddings (imagen_id, codigo, empresa_id, embedding)
-                                VALUES (?, ?, ?, ?)
-                            """, [imagen_id, codigo, emp, raw])
-                            write_conn.commit()
-                            count += 1
-                        except Exception as ex:
-                            errors += 1
-                            if not first_error_logged:
-                                logger.error(f'save_embedding failed for imagen_id={imagen_id}: {ex}')
-                                first_error_logged = True
+                        writer.add(imagen_id, codigo, vec)
+                        count += 1
                     else:
                         errors += 1
                         if not first_error_logged:
-                            logger.warning(f'extract_features returned None for imagen_id={imagen_id}, codigo={codigo}')
+                            if error:
+                                logger.error(f'extract_features exception on imagen_id={imagen_id}, codigo={codigo}: {error}')
+                            else:
+                                logger.warning(f'extract_features returned None for imagen_id={imagen_id}, codigo={codigo}')
                             first_error_logged = True
 
-                # Siguiente fila
-                row = read_cursor.fetchone()
+                    # Actualizar progreso cada 10 imagenes
+                    if progress_callback and (count + errors) % 10 == 0:
+                        progress_callback(count, total_images, errors)
 
-                # Actualizar progreso cada 10 imagenes
-                if progress_callback and (count + errors) % 10 == 0:
-                    progress_callback(count, total_images, errors)
-
-                if (count + errors) % 100 == 0:
-                    logger.info(f'Indexed {count}/{total_images} images ({errors} errors)')
+                    if (count + errors) % 100 == 0:
+                        logger.info(f'Indexed {count}/{total_images} images ({errors} errors)')
 
             read_conn.close()
-            write_conn.close()
+
+            # Filas que no se pudieron escribir tras los reintentos
+            count = writer.written
+            errors += writer.failed
 
             logger.info(f'Reindex complete: {count} images indexed, {errors} errors')
 
-            # Recargar cache
-            ImageSearchModel.load_all_embeddings(empresa_id, connection_id=connection_id)
+            # Recargar cache, entrenar el indice aproximado y publicar nueva generacion en disco
+            ImageSearchModel.load_all_embeddings(empresa_id, connection_id=connection_id, train_ann=True)
 
             return (count, errors)
         except Exception as e:
@@ -583,7 +979,7 @@ class ImageSearchModel:
             if progress_callback:
                 progress_callback(0, total_new, 0)
 
-            # Procesar una por una (filtrado por empresa)
+            # Leer una por una (filtrado por empresa) y extraer en paralelo
             conn = ImageSearchModel._get_conn(connection_id)
             cursor = conn.cursor()
             cursor.execute("""
@@ -597,34 +993,26 @@ class ImageSearchModel:
 
             count = 0
             errors = 0
-            row = cursor.fetchone()
-            while row is not None:
-                imagen_id = row[0]
-                codigo = row[1]
-                image_data = row[2]
-
-                if image_data:
-                    try:
-                        vec = extract_features(bytes(image_data))
-                    except Exception:
-                        vec = None
-
+            # Pocas imagenes (auto-index antes de buscar): no compensa arrancar procesos
+            workers = 1 if total_new < PARALLEL_MIN_IMAGES else None
+            with EmbeddingWriter(emp, connection_id=connection_id) as writer:
+                results = extract_parallel(iter_cursor_rows(cursor), extract_features, workers=workers)
+                for imagen_id, codigo, vec, _error in results:
                     if vec is not None:
-                        emp = empresa_id or '1'
-                        ImageSearchModel.save_embedding(imagen_id, codigo, emp, vec, connection_id=connection_id)
+                        writer.add(imagen_id, codigo, vec)
                         count += 1
                     else:
                         errors += 1
 
-                row = cursor.fetchone()
-
-                if progress_callback and (count + errors) % 10 == 0:
-                    progress_callback(count, total_new, errors)
+                    if progress_callback and (count + errors) % 10 == 0:
+                        progress_callback(count, total_new, errors)
 
             conn.close()
+            count = writer.written
+            errors += writer.failed
             logger.info(f'Incremental index: {count} new images indexed, {errors} errors')
 
-            # Recargar cache
+            # Recargar cache y publicar nueva generacion del indice en disco
             ImageSearchModel.load_all_embeddings(empresa_id, connection_id=connection_id)
 
             return (count, errors)
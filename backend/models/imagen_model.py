@@ -16,10 +16,54 @@
 # ARCHIVO: models/imagen_model.py
 # ============================================
 from config.database import Database
+from utils.image_cache import derived_images
+from utils import image_derivatives
+from utils.image_derivatives import DERIVATIVE_SIZES, DERIVATIVE_FORMATS, PRECOMPUTE_SIZES, variant_name
+from utils.feature_pipeline import extract_parallel, iter_cursor_rows, INDEX_WORKERS
 import base64
 import io
+import logging
+import pyodbc
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
+# Huella de la imagen origen para la cache de derivadas, la ETag y las URL
+# versionadas (immutable): tamaño + hash de los trozos inicial, central y final
+# de 8000 bytes (HASHBYTES de SQL 2008 admite como mucho 8000), así una imagen
+# del ERP sustituida con el mismo tamaño cambia de versión. Se calcula en el
+# servidor sin transferir el BLOB.
+_SOURCE_VERSION_SQL = (
+    "DATALENGTH(imagen) AS fuente_size, "
+    "HASHBYTES('MD5', HASHBYTES('MD5', SUBSTRING(imagen, 1, 8000)) "
+    "+ HASHBYTES('MD5', SUBSTRING(imagen, DATALENGTH(imagen) / 2 - 3999, 8000)) "
+    "+ HASHBYTES('MD5', SUBSTRING(imagen, DATALENGTH(imagen) - 7999, 8000))) AS fuente_hash"
+)
+
+# Columnas de referencia de una imagen (sin BLOB) para la entrega binaria
+_REF_COLUMNS = f"id, codigo, {_SOURCE_VERSION_SQL}, SUBSTRING(imagen, 1, 16) AS cabecera"
+_REF_THUMB = "DATALENGTH(thumbnail) AS thumb_size"
+
+# Tamaños servidos por /api/stocks/imagen/<id>
+IMAGE_SIZES = tuple(DERIVATIVE_SIZES) + ('original',)
+
+# Imagenes por consulta al leer BLOB para generar derivadas
+DERIVATIVE_FETCH_BATCH = 50
+
+
+def image_mimetype(head):
+    """Tipo MIME de una imagen por sus primeros bytes (JPEG por defecto)."""
+    head = bytes(head or b'')
+    if head[:4] == b'\x89PNG':
+        return 'image/png'
+    if head[:4] == b'GIF8':
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:2] == b'BM':
+        return 'image/bmp'
+    return 'image/jpeg'
+
 
 class ImagenModel:
     @staticmethod
@@ -41,6 +85,143 @@ class ImagenModel:
         except Exception:
             return image_data
 
+    @staticmethod
+    def _tenant_key(empresa_id=None, connection_id=None):
+        """Clave de la cache de derivadas: conexion (BD cliente) + empresa ERP."""
+        if connection_id is None:
+            from flask import session, has_request_context
+            connection_id = session.get('connection') if has_request_context() else None
+        return f"{connection_id or '0'}_{empresa_id or '_all'}"
+
+    @staticmethod
+    def _source_version(size, head_hash):
+        if not size:
+            return None
+        return f"{size}-{bytes(head_hash).hex()[:16] if head_hash else '0'}"
+
+    @staticmethod
+    def _get_derived_images(cursor, sources, size='grid', fmt='jpg', empresa_id=None):
+        """Obtiene una variante derivada (utils.image_derivatives) de varias imagenes,
+        usando la cache en disco.
+
+        Args:
+            cursor: cursor abierto a la BD de la empresa
+            sources: lista de (imagen_id, version) de las imagenes origen
+        Returns:
+            dict {imagen_id: bytes}; solo se lee el BLOB de los fallos de cache
+        """
+        tenant = ImagenModel._tenant_key(empresa_id)
+        variant = variant_name(size, fmt)
+        images = {}
+        missing = {}
+        for imagen_id, version in sources:
+            data = derived_images.get(tenant, imagen_id, variant, version)
+            if data is not None:
+                images[imagen_id] = data
+            else:
+                missing[imagen_id] = version
+
+        if missing:
+            placeholders = ','.join(['?' for _ in missing])
+            cursor.execute(f"""
+                SELECT id, imagen
+                FROM view_articulo_imagen
+                WHERE id IN ({placeholders})
+            """, list(missing))
+            for imagen_id, imagen in cursor.fetchall():
+                if not imagen:
+                    continue
+                try:
+                    data = image_derivatives.render(bytes(imagen), size, fmt)
+                except Exception as e:
+                    logger.warning(f'Derived image {imagen_id}/{variant} failed: {e}')
+                    continue
+                derived_images.put(tenant, imagen_id, variant, missing[imagen_id], data)
+                images[imagen_id] = data
+        return images
+
+    @staticmethod
+    def _get_primera_imagen_grid(codigo, empresa_id=None):
+        """get_primera_imagen(quality='grid') leyendo solo metadatos si la derivada esta en cache."""
+        empresa_filter = " AND empresa = ?" if empresa_id else ""
+        params = (codigo, empresa_id) if empresa_id else (codigo,)
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT TOP 1 id, codigo, {_SOURCE_VERSION_SQL},
+                       CASE WHEN imagen IS NULL THEN thumbnail END AS thumbnail
+                FROM view_articulo_imagen
+                WHERE codigo = ?{empresa_filter}
+                ORDER BY id
+            """, params)
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            version = ImagenModel._source_version(row[2], row[3])
+            if version:
+                img_data = ImagenModel._get_derived_images(
+                    cursor, [(row[0], version)], empresa_id=empresa_id).get(row[0])
+            else:
+                img_data = row[4]
+            cursor.close()
+        finally:
+            conn.close()
+
+        if not img_data:
+            return None
+        return {
+            'id': row[0],
+            'codigo': row[1],
+            'imagen': base64.b64encode(img_data).decode('utf-8')
+        }
+
+    @staticmethod
+    def _get_thumbnails_grid(codigos, empresa_id=None):
+        """get_thumbnails_batch(quality='grid') leyendo solo los BLOB que no estan en cache."""
+        placeholders = ','.join(['?' for _ in codigos])
+        empresa_filter = " AND empresa = ?" if empresa_id else ""
+        params = codigos + [empresa_id] if empresa_id else codigos
+        thumbnails = {}
+
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                WITH FirstImages AS (
+                    SELECT id, codigo, {_SOURCE_VERSION_SQL},
+                           CASE WHEN imagen IS NULL THEN thumbnail END AS thumbnail,
+                           ROW_NUMBER() OVER (PARTITION BY codigo ORDER BY id) as rn
+                    FROM view_articulo_imagen
+                    WHERE codigo IN ({placeholders}){empresa_filter}
+                )
+                SELECT id, codigo, fuente_size, fuente_hash, thumbnail
+                FROM FirstImages
+                WHERE rn = 1
+            """, params)
+            rows = cursor.fetchall()
+
+            sources = []
+            codigo_by_id = {}
+            for row in rows:
+                codigo = row[1].strip() if row[1] else row[1]
+                version = ImagenModel._source_version(row[2], row[3])
+                if version:
+                    sources.append((row[0], version))
+                    codigo_by_id[row[0]] = codigo
+                elif row[4]:
+                    thumbnails[codigo] = base64.b64encode(row[4]).decode('utf-8')
+
+            for imagen_id, img_data in ImagenModel._get_derived_images(
+                    cursor, sources, empresa_id=empresa_id).items():
+                thumbnails[codigo_by_id[imagen_id]] = base64.b64encode(img_data).decode('utf-8')
+            cursor.close()
+        finally:
+            conn.close()
+
+        return thumbnails
+
     @staticmethod
     def get_by_codigo(codigo, empresa_id=None):
         """Obtiene todas las imágenes de un artículo por código"""
@@ -116,7 +297,15 @@ class ImagenModel:
     def get_primera_imagen(codigo, quality='thumb', empresa_id=None):
         """Obtiene el thumbnail de la primera imagen (para grid de tarjetas)
         quality='thumb': usa thumbnail si existe (pequeño, rápido)
-        quality='grid': usa imagen original redimensionada a 400px (nítido para grid)"""
+        quality='grid': usa imagen original redimensionada a 400px (nítido para grid),
+                        cacheada en disco (utils.image_cache)"""
+        if quality == 'grid':
+            try:
+                return ImagenModel._get_primera_imagen_grid(codigo, empresa_id)
+            except (pyodbc.Error, OSError) as e:
+                # Sin HASHBYTES/thumbnail en la vista o cache en disco no disponible: camino sin cache
+                logger.warning(f'Grid image cache path failed, using direct query: {e}')
+
         imagen = None
         empresa_filter = " AND empresa = ?" if empresa_id else ""
         params = (codigo, empresa_id) if empresa_id else (codigo,)
@@ -204,7 +393,8 @@ class ImagenModel:
     def get_thumbnails_batch(codigos, quality='thumb', empresa_id=None):
         """Obtiene thumbnails de múltiples artículos en una sola consulta (batch loading)
         quality='thumb': usa thumbnail si existe (pequeño, rápido)
-        quality='grid': usa imagen original redimensionada a 400px (nítido para grid)
+        quality='grid': usa imagen original redimensionada a 400px (nítido para grid),
+                        cacheada en disco (utils.image_cache)
         Retorna un diccionario {codigo: imagen_base64}"""
         if not codigos:
             return {}
@@ -212,6 +402,13 @@ class ImagenModel:
         # Limpiar espacios de los códigos
         codigos = [c.strip() if isinstance(c, str) else c for c in codigos]
 
+        if quality == 'grid':
+            try:
+                return ImagenModel._get_thumbnails_grid(codigos, empresa_id)
+            except (pyodbc.Error, OSError) as e:
+                # Sin HASHBYTES/thumbnail en la vista o cache en disco no disponible: camino sin cache
+                logger.warning(f'Grid image cache path failed, using direct query: {e}')
+
         # Crear placeholders para IN clause
         placeholders = ','.join(['?' for _ in codigos])
         empresa_filter = " AND empresa = ?" if empresa_id else ""
@@ -277,3 +474,238 @@ class ImagenModel:
                 pass
 
         return thumbnails
+
+    # ==================== ENTREGA BINARIA ====================
+
+    @staticmethod
+    def _row_to_ref(row):
+        """(id, codigo, fuente_size, fuente_hash, cabecera, thumb_size) -> dict o None."""
+        version = ImagenModel._source_version(row[2], row[3])
+        if version is None and not row[5]:
+            return None
+        return {
+            'id': row[0],
+            'codigo': row[1].strip() if row[1] else row[1],
+            'size': row[2] or 0,
+            'version': version or '0',
+            'mimetype': image_mimetype(row[4]),
+            'thumb_size': row[5] or 0,
+        }
+
+    @staticmethod
+    def _query_refs(sql, params):
+        """Ejecuta una consulta de referencias ({cols} = columnas); tolera vistas sin thumbnail."""
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql.format(cols=f"{_REF_COLUMNS}, {_REF_THUMB}"), params)
+            except Exception:
+                cursor = conn.cursor()
+                cursor.execute(sql.format(cols=f"{_REF_COLUMNS}, NULL AS thumb_size"), params)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        return [ref for ref in map(ImagenModel._row_to_ref, rows) if ref]
+
+    @staticmethod
+    def get_image_ref(imagen_id, empresa_id=None):
+        """Metadatos de una imagen (id, codigo, tamaño, version, mimetype) sin leer el BLOB."""
+        empresa_filter = " AND empresa = ?" if empresa_id else ""
+        params = (imagen_id, empresa_id) if empresa_id else (imagen_id,)
+        refs = ImagenModel._query_refs(f"""
+            SELECT {{cols}}
+            FROM view_articulo_imagen
+            WHERE id = ?{empresa_filter}
+        """, params)
+        return refs[0] if refs else None
+
+    @staticmethod
+    def get_image_refs(codigo, empresa_id=None):
+        """Referencias de todas las imágenes de un artículo (orden por id)."""
+        empresa_filter = " AND empresa = ?" if empresa_id else ""
+        params = (codigo, empresa_id) if empresa_id else (codigo,)
+        return ImagenModel._query_refs(f"""
+            SELECT {{cols}}
+            FROM view_articulo_imagen
+            WHERE codigo = ?{empresa_filter}
+            ORDER BY id
+        """, params)
+
+    @staticmethod
+    def get_primeras_image_refs(codigos, empresa_id=None):
+        """Referencia de la primera imagen de cada artículo. Retorna {codigo: ref}."""
+        if not codigos:
+            return {}
+        codigos = [c.strip() if isinstance(c, str) else c for c in codigos]
+        placeholders = ','.join(['?' for _ in codigos])
+        empresa_filter = " AND empresa = ?" if empresa_id else ""
+        params = codigos + [empresa_id] if empresa_id else codigos
+        refs = ImagenModel._query_refs(f"""
+            WITH FirstImages AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY codigo ORDER BY id) as rn
+                FROM view_articulo_imagen
+                WHERE codigo IN ({placeholders}){empresa_filter}
+            )
+            SELECT {{cols}}
+            FROM view_articulo_imagen
+            WHERE id IN (SELECT id FROM FirstImages WHERE rn = 1)
+        """, params)
+        return {ref['codigo']: ref for ref in refs}
+
+    @staticmethod
+    def variant_version(ref, size):
+        """Versión de la variante servida: cambia si cambia la imagen (o el thumbnail)."""
+        if not ref['size']:
+            return f"t{ref['thumb_size']}"  # solo hay thumbnail
+        return ref['version']
+
+    @staticmethod
+    def image_url(ref, size):
+        """URL versionada (cacheable como immutable) de una imagen."""
+        return f"/api/stocks/imagen/{ref['id']}?size={size}&v={ImagenModel.variant_version(ref, size)}"
+
+    @staticmethod
+    def get_image_variant(ref, size, fmt='jpg', empresa_id=None):
+        """Bytes de una variante derivada (thumb/grid/detail en `fmt`) desde la cache en disco;
+        si falta se genera al vuelo. Sin imagen original se sirve la columna thumbnail."""
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            data = None
+            if ref['size']:
+                data = ImagenModel._get_derived_images(
+                    cursor, [(ref['id'], ref['version'])], size, fmt, empresa_id).get(ref['id'])
+            elif ref['thumb_size']:
+                cursor.execute("SELECT thumbnail FROM view_articulo_imagen WHERE id = ?", (ref['id'],))
+                row = cursor.fetchone()
+                data = row[0] if row else None
+            cursor.close()
+        finally:
+            conn.close()
+        return bytes(data) if data else None
+
+    @staticmethod
+    def read_image_range(imagen_id, offset, length):
+        """Lee `length` bytes de la imagen original desde `offset` (SUBSTRING en servidor)."""
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT SUBSTRING(imagen, ?, ?)
+                FROM view_articulo_imagen
+                WHERE id = ?
+            """, (offset + 1, length, imagen_id))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return bytes(row[0]) if row and row[0] else b''
+
+    @staticmethod
+    def iter_image(imagen_id, total, chunk_size):
+        """Genera la imagen original en trozos de `chunk_size` (una conexión para todo el envío)."""
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            for offset in range(0, total, chunk_size):
+                cursor.execute("""
+                    SELECT SUBSTRING(imagen, ?, ?)
+                    FROM view_articulo_imagen
+                    WHERE id = ?
+                """, (offset + 1, chunk_size, imagen_id))
+                row = cursor.fetchone()
+                if not row or not row[0]:
+                    break
+                yield bytes(row[0])
+            cursor.close()
+        finally:
+            conn.close()
+
+    # ==================== DERIVADAS EN SEGUNDO PLANO ====================
+
+    @staticmethod
+    def generate_derivatives(empresa_id=None, connection_id=None, progress_callback=None, workers=None):
+        """Precalcula las variantes PRECOMPUTE_SIZES x DERIVATIVE_FORMATS de las
+        imagenes de la empresa que no esten ya en la cache de disco.
+
+        La decodificacion/redimensionado/codificacion se hace en un pool de procesos
+        (utils.feature_pipeline); solo se leen los BLOB de las imagenes pendientes.
+        Se para al escribir el 80% de IMAGE_CACHE_MAX_MB: seguir solo expulsaria
+        derivadas recien generadas.
+
+        Returns:
+            (generadas, errores)
+        """
+        tenant = ImagenModel._tenant_key(empresa_id, connection_id)
+        variants = [variant_name(size, fmt) for size in PRECOMPUTE_SIZES for fmt in DERIVATIVE_FORMATS]
+        empresa_filter = " WHERE empresa = ?" if empresa_id else ""
+        params = (empresa_id,) if empresa_id else ()
+
+        conn = Database.get_connection(connection_id)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT id, {_SOURCE_VERSION_SQL}
+                FROM view_articulo_imagen{empresa_filter}
+            """, params)
+            pending = {}
+            for imagen_id, size, head_hash in cursor.fetchall():
+                version = ImagenModel._source_version(size, head_hash)
+                if version and not all(derived_images.exists(tenant, imagen_id, v, version) for v in variants):
+                    pending[imagen_id] = version
+            cursor.close()
+        finally:
+            conn.close()
+
+        total = len(pending)
+        logger.info(f'Derivatives: {total} images pending for {tenant} ({", ".join(variants)})')
+        if progress_callback:
+            progress_callback(0, total, 0)
+        if not total:
+            return 0, 0
+
+        def _rows():
+            read_conn = Database.get_connection(connection_id)
+            try:
+                read_cursor = read_conn.cursor()
+                ids = list(pending)
+                for i in range(0, len(ids), DERIVATIVE_FETCH_BATCH):
+                    chunk = ids[i:i + DERIVATIVE_FETCH_BATCH]
+                    placeholders = ','.join(['?' for _ in chunk])
+                    read_cursor.execute(f"""
+                        SELECT id, codigo, imagen
+                        FROM view_articulo_imagen
+                        WHERE id IN ({placeholders})
+                    """, chunk)
+                    yield from iter_cursor_rows(read_cursor)
+                read_cursor.close()
+            finally:
+                read_conn.close()
+
+        budget = derived_images.max_bytes * 0.8
+        written = 0
+        done = errors = 0
+        results = extract_parallel(_rows(), image_derivatives.render_precomputed,
+                                   workers=INDEX_WORKERS if workers is None else workers)
+        for imagen_id, _codigo, rendered, error in results:
+            if error or not rendered:
+                errors += 1
+                logger.warning(f'Derivatives for image {imagen_id} failed: {error}')
+            else:
+                for variant, data in rendered.items():
+                    derived_images.put(tenant, imagen_id, variant, pending[imagen_id], data)
+                    written += len(data)
+                done += 1
+            if progress_callback and (done + errors) % 20 == 0:
+                progress_callback(done, total, errors)
+            if written >= budget:
+                logger.warning(f'Derivatives: stopped after {done}/{total} images, '
+                               f'{written // (1024 * 1024)} MB written (IMAGE_CACHE_MAX_MB too small)')
+                break
+        results.close()
+
+        if progress_callback:
+            progress_callback(done, total, errors)
+        return done, errors
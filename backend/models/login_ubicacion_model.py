@@ -0,0 +1,217 @@
+# ============================================================
+#      ██╗ ██████╗ ██████╗ ███████╗██████╗ ███████╗
+#      ██║██╔═══██╗██╔══██╗██╔════╝██╔══██╗██╔════╝
+#      ██║██║   ██║██████╔╝█████╗  ██████╔╝███████╗
+# ██   ██║██║   ██║██╔══██╗██╔══╝  ██╔══██╗╚════██║
+# ╚█████╔╝╚██████╔╝██████╔╝███████╗██║  ██║███████║
+#  ╚════╝  ╚═════╝ ╚═════╝ ╚══════╝╚═╝  ╚═╝╚══════╝
+#
+#                ──  Jobers - Iaucejo  ──
+#
+# Autor : iaucejo
+# Fecha : 2026-10-18
+# ============================================================
+
+# ============================================
+# ARCHIVO: models/login_ubicacion_model.py
+# Descripcion: Logins agrupados por ubicación y día (mapa del dashboard)
+#
+# Tabla login_ubicacion_dia (BD del cliente, migración 69): logins
+# correctos por empresa, día, lat/lon redondeadas a 2 decimales y
+# usuario, con país y ciudad. Se suma en el login (registrar) y el
+# mapa lee solo esta tabla, sin abrir el JSON de audit_log.
+#
+# Los logins anteriores a la tabla se pasan una sola vez desde
+# audit_log (completar_historico), por tramos y de más reciente a
+# más antiguo; la marca 'login_ubicacion_historico' de
+# estadisticas_watermark es el id hasta el que queda por pasar.
+# Se hace en el hilo de auditoría del login (tras la migración 69),
+# nunca al leer el mapa.
+# ============================================
+import json
+import logging
+import threading
+from decimal import Decimal
+
+from config.database import Database
+
+logger = logging.getLogger(__name__)
+
+HISTORICO_DIAS = 366   # días de audit_log que se pasan al resumen (el dashboard muestra hasta 365)
+_TRAMO = 5000          # filas de audit_log por tramo del histórico
+_MARCA = 'login_ubicacion_historico'
+
+_MERGE = """
+    MERGE login_ubicacion_dia WITH (HOLDLOCK) AS t
+    USING (SELECT ? AS empresa_id, ISNULL(CAST(? AS DATE), CAST(GETDATE() AS DATE)) AS dia,
+                  ? AS lat, ? AS lon, ? AS username) AS s
+    ON t.empresa_id = s.empresa_id AND t.dia = s.dia AND t.lat = s.lat AND t.lon = s.lon
+       AND t.username = s.username
+    WHEN MATCHED THEN
+        UPDATE SET total = t.total + ?
+    WHEN NOT MATCHED THEN
+        INSERT (empresa_id, dia, lat, lon, username, user_id, pais, ciudad, total)
+        VALUES (s.empresa_id, s.dia, s.lat, s.lon, s.username, ?, ?, ?, ?);
+"""
+
+
+def _punto(ubicacion):
+    """(lat, lon, pais, ciudad) redondeado de una ubicación de geoip, o None si no sirve para el mapa."""
+    if not ubicacion or ubicacion.get('pais_codigo') == 'LO':
+        return None
+    lat, lon = ubicacion.get('lat'), ubicacion.get('lon')
+    if lat is None or lon is None:
+        return None
+    try:
+        # Redondear a 2 decimales para agrupar ubicaciones cercanas
+        lat_r = Decimal(str(round(float(lat), 2)))
+        lon_r = Decimal(str(round(float(lon), 2)))
+    except (TypeError, ValueError):
+        return None
+    return lat_r, lon_r, (ubicacion.get('pais') or '')[:100], (ubicacion.get('ciudad') or '')[:100]
+
+
+def _fila(empresa_id, dia, username, user_id, punto, total):
+    lat, lon, pais, ciudad = punto
+    username = (username or '')[:100]
+    return (str(empresa_id)[:5], dia, lat, lon, username, total, user_id, pais, ciudad, total)
+
+
+class LoginUbicacionModel:
+    _lock = threading.Lock()
+    _completados = set()   # tenants cuyo histórico ya está pasado (en este proceso)
+
+    @staticmethod
+    def registrar(connection_id, empresa_id, user_id, username, ubicacion):
+        """
+        Sumar un login correcto a su ubicación del día (hilo de auditoría del login).
+
+        Returns:
+            bool: False si la ubicación no cuenta para el mapa (local, sin lat/lon) o falla
+        """
+        punto = _punto(ubicacion)
+        if punto is None:
+            return False
+        try:
+            conn = Database.get_connection(connection_id)
+        except Exception as e:
+            logger.error(f'Login location (connection): {e}')
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(_MERGE, _fila(empresa_id, None, username, user_id, punto, 1))
+            conn.commit()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.error(f'Login location: {e}')
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def completar_historico(connection_id):
+        """
+        Pasar al resumen los logins de audit_log anteriores a la tabla (una vez por BD).
+
+        Se llama en segundo plano (hilo de auditoría del login): lee el JSON de
+        cada login del histórico, cosa que no debe hacerse en una petición.
+        """
+        with LoginUbicacionModel._lock:
+            if connection_id in LoginUbicacionModel._completados:
+                return
+
+        try:
+            conn = Database.get_connection(connection_id)
+        except Exception as e:
+            logger.error(f'Login location history (connection): {e}')
+            return
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute("""
+                    SELECT ultimo_id FROM estadisticas_watermark WITH (UPDLOCK, HOLDLOCK)
+                    WHERE nombre = ?
+                """, (_MARCA,))
+                row = cursor.fetchone()
+                if not row or row[0] <= 0:
+                    conn.commit()
+                    break
+
+                cursor.execute("""
+                    SELECT TOP (?) id, CAST(fecha AS DATE), empresa_id, user_id, username, detalles
+                    FROM audit_log
+                    WHERE id <= ? AND accion = 'LOGIN' AND resultado = 'SUCCESS'
+                        AND detalles IS NOT NULL AND empresa_id IS NOT NULL
+                        AND fecha >= DATEADD(DAY, ?, GETDATE())
+                    ORDER BY id DESC
+                """, (_TRAMO, row[0], -HISTORICO_DIAS))
+                logins = cursor.fetchall()
+
+                grupos = {}
+                for _, dia, empresa_id, user_id, username, detalles in logins:
+                    try:
+                        punto = _punto(json.loads(detalles).get('ubicacion'))
+                    except (ValueError, TypeError, AttributeError):
+                        continue
+                    if punto is None:
+                        continue
+                    key = (empresa_id, dia, punto[0], punto[1], username or '')
+                    if key in grupos:
+                        grupos[key][2] += 1
+                    else:
+                        grupos[key] = [user_id, punto, 1]
+                if grupos:
+                    cursor.executemany(_MERGE, [
+                        _fila(empresa_id, dia, username, user_id, punto, total)
+                        for (empresa_id, dia, _, _, username), (user_id, punto, total) in grupos.items()
+                    ])
+
+                pendiente = logins[-1][0] - 1 if len(logins) == _TRAMO else 0
+                cursor.execute("""
+                    UPDATE estadisticas_watermark SET ultimo_id = ?, fecha_actualizacion = GETDATE()
+                    WHERE nombre = ?
+                """, (pendiente, _MARCA))
+                conn.commit()
+
+            with LoginUbicacionModel._lock:
+                LoginUbicacionModel._completados.add(connection_id)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f'Error pasando histórico de logins por ubicación: {e}')
+        finally:
+            cursor.close()
+            conn.close()
+
+    @staticmethod
+    def get_por_ubicacion(cursor, empresa_id, dias=30):
+        """
+        Logins de los últimos `dias` días agrupados por ubicación.
+
+        Returns:
+            list de dicts (lat, lon, pais, ciudad, total_logins, usuarios)
+        """
+        cursor.execute("""
+            SELECT lat, lon, MAX(pais), MAX(ciudad), username, SUM(total)
+            FROM login_ubicacion_dia
+            WHERE empresa_id = ? AND dia >= CAST(DATEADD(DAY, ?, GETDATE()) AS DATE)
+            GROUP BY lat, lon, username
+        """, (empresa_id, -dias))
+
+        ubicaciones = {}
+        for lat, lon, pais, ciudad, username, total in cursor.fetchall():
+            ub = ubicaciones.get((lat, lon))
+            if ub is None:
+                ub = ubicaciones[(lat, lon)] = {
+                    'lat': float(lat),
+                    'lon': float(lon),
+                    'pais': pais or '',
+                    'ciudad': ciudad or '',
+                    'total_logins': 0,
+                    'usuarios': set()
+                }
+            ub['total_logins'] += total
+            if username:
+                ub['usuarios'].add(username)
+
+        return [dict(ub, usuarios=sorted(ub['usuarios'])) for ub in ubicaciones.values()]
@@ -21,6 +21,7 @@ import math
 import time
 import logging
 from config.database import Database
+from utils.pagination import decode_cursor, encode_cursor, keyset_condition, listing_total, split_page
 
 logger = logging.getLogger(__name__)
 
@@ -97,14 +98,127 @@ class PedidoModel:
 
         return result
 
+    # Orden de los listados y clave del cursor (fecha, pedido)
+    _ORDER_KEY = 'fecha:DESC,pedido:DESC'
+
+    @staticmethod
+    def parse_cursor(cursor_token):
+        """Clave (fecha, pedido) del cursor, None en la primera pagina. ValueError si no es valido."""
+        if cursor_token is None:
+            return None
+        after = decode_cursor(cursor_token, PedidoModel._ORDER_KEY)
+        if after is not None and len(after) != 2:
+            raise ValueError('Cursor no válido')
+        return after
+
+    @staticmethod
+    def _list_columns(numpedcli_sql, location_sql):
+        """Columnas de los listados paginados (mismo orden que espera _map_pedido_row)."""
+        return f"""v.empresa, v.anyo, v.pedido, v.fecha, v.fecha_entrega, v.cliente,
+                   v.cliente_nombre, v.pedido_cliente, v.serie,
+                   CAST(v.bruto AS DECIMAL(18,2)) AS bruto, CAST(v.importe_dto AS DECIMAL(18,2)) AS importe_dto,
+                   CAST(v.total AS DECIMAL(18,2)) AS total, CAST(v.peso AS DECIMAL(18,2)) AS peso,
+                   v.divisa, v.usuario, v.fecha_alta,
+                   {numpedcli_sql}
+                   {location_sql},
+                   CASE WHEN EXISTS (SELECT 1 FROM view_externos_venliped l WHERE l.empresa = v.empresa AND l.anyo = v.anyo AND l.pedido = v.pedido AND RTRIM(ISNULL(l.articulo,'')) <> '' AND l.situacion = 'F') THEN 0 ELSE 1 END AS completo"""
+
+    @staticmethod
+    def _fetch_page(cursor, where, params, select_sql, join_sql, page, page_size,
+                    cursor_token=None, after=None, with_total=None, exact=True):
+        """
+        Página de pedidos ordenada por fecha y pedido descendentes.
+
+        Con cursor_token (None = paginación por número de página) se usa
+        paginación por cursor: TOP (n) WITH TIES sobre WHERE (fecha, pedido) < (?, ?),
+        con `after` = clave decodificada del cursor. El total es opcional en
+        ese modo (por defecto solo en la primera página).
+
+        El total se cachea unos segundos por filtros (las páginas siguientes
+        lo reutilizan); con exact=False es una estimación.
+
+        Returns:
+            (filas, total o None, total_exact, next_cursor, has_more)
+        """
+        if with_total is None:
+            with_total = after is None
+
+        total, total_exact = None, None
+        if cursor_token is None or with_total:
+            total, total_exact = listing_total(cursor, 'view_externos_venped v', where, params, exact)
+
+        if cursor_token is None:
+            # Paginated data with ROW_NUMBER (SQL Server 2008 compatible)
+            offset_start = (page - 1) * page_size + 1
+            offset_end = page * page_size
+            cursor.execute(f"""
+                SELECT * FROM (
+                    SELECT ROW_NUMBER() OVER (ORDER BY v.fecha DESC, v.pedido DESC) AS rn,
+                           {select_sql}
+                    FROM view_externos_venped v
+                    {join_sql}
+                    WHERE {where}
+                ) sub
+                WHERE rn BETWEEN ? AND ?
+            """, params + [offset_start, offset_end])
+            return cursor.fetchall(), total, total_exact, None, None
+
+        page_where, page_params = where, list(params)
+        if after is not None:
+            seek_sql, seek_params = keyset_condition(['v.fecha', 'v.pedido'], after, descending=True)
+            page_where = f"{where} AND {seek_sql}"
+            page_params.extend(seek_params)
+
+        # 0 AS rn: mismas posiciones de columna que la consulta con ROW_NUMBER
+        cursor.execute(f"""
+            SELECT TOP (?) WITH TIES 0 AS rn,
+                   {select_sql}
+            FROM view_externos_venped v
+            {join_sql}
+            WHERE {page_where}
+            ORDER BY v.fecha DESC, v.pedido DESC
+        """, [page_size + 1] + page_params)
+        rows, has_more = split_page(cursor.fetchall(), page_size, key=lambda row: (row[4], row[3]))
+        next_cursor = encode_cursor(PedidoModel._ORDER_KEY, [rows[-1][4], rows[-1][3]]) \
+            if has_more and rows else None
+        return rows, total, total_exact, next_cursor, has_more
+
+    @staticmethod
+    def _page_result(pedidos, total, total_exact, page, page_size, cursor_token, next_cursor, has_more):
+        total_pages = (math.ceil(total / page_size) if total > 0 else 1) if total is not None else None
+        result = {
+            'pedidos': pedidos,
+            'total': total,
+            'total_exact': total_exact,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': total_pages
+        }
+        if cursor_token is not None:
+            result['page'] = None
+            result['next_cursor'] = next_cursor
+            result['has_more'] = has_more
+        return result
+
     @staticmethod
-    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50):
+    def get_by_user(cliente_id, empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, page=1, page_size=50,
+                    cursor=None, with_total=None, exact=True):
         """
         Obtiene pedidos de un cliente con paginacion servidor.
 
+        Con `cursor` ('' = primera pagina) pagina por cursor en lugar de por
+        numero de pagina; el total solo se calcula en la primera pagina salvo
+        que se pida con with_total. Con exact=False el total es una estimacion
+        (total_exact=False: hay al menos `total` pedidos).
+
         Returns:
-            dict: { pedidos, total, page, page_size, total_pages }
+            dict: { pedidos, total, total_exact, page, page_size, total_pages[, next_cursor, has_more] }
+
+        Raises:
+            ValueError: cursor no valido
         """
+        cursor_token = cursor  # `cursor` pasa a ser el cursor de BD
+        after = PedidoModel.parse_cursor(cursor_token)
         t0 = time.time()
         conn = Database.get_connection()
         t1 = time.time()
@@ -140,43 +254,14 @@ class PedidoModel:
 
         where = " AND ".join(where_parts)
 
-        # 1. Count total
-        cursor.execute(f"SELECT COUNT(*) FROM view_externos_venped v WHERE {where}", params)
-        total = cursor.fetchone()[0]
-        t2 = time.time()
-        logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
-
-        # 2. Paginated data with ROW_NUMBER (SQL Server 2008 compatible)
-        offset_start = (page - 1) * page_size + 1
-        offset_end = page * page_size
-
-        data_query = f"""
-            SELECT * FROM (
-                SELECT ROW_NUMBER() OVER (ORDER BY v.fecha DESC, v.pedido DESC) AS rn,
-                       v.empresa, v.anyo, v.pedido, v.fecha, v.fecha_entrega, v.cliente,
-                       v.cliente_nombre, v.pedido_cliente, v.serie,
-                       CAST(v.bruto AS DECIMAL(18,2)) AS bruto, CAST(v.importe_dto AS DECIMAL(18,2)) AS importe_dto,
-                       CAST(v.total AS DECIMAL(18,2)) AS total, CAST(v.peso AS DECIMAL(18,2)) AS peso,
-                       v.divisa, v.usuario, v.fecha_alta,
-                       {numpedcli_sql}
-                       {location_sql},
-                       CASE WHEN EXISTS (SELECT 1 FROM view_externos_venliped l WHERE l.empresa = v.empresa AND l.anyo = v.anyo AND l.pedido = v.pedido AND RTRIM(ISNULL(l.articulo,'')) <> '' AND l.situacion = 'F') THEN 0 ELSE 1 END AS completo
-                FROM view_externos_venped v
-                {join_sql}
-                WHERE {where}
-            ) sub
-            WHERE rn BETWEEN ? AND ?
-        """
-        data_params = params + [offset_start, offset_end]
+        select_sql = PedidoModel._list_columns(numpedcli_sql, location_sql)
 
         t3 = time.time()
-        cursor.execute(data_query, data_params)
-        t4 = time.time()
-        logger.warning(f'[PERF-MODEL] SQL execute: {t4-t3:.3f}s')
-
-        rows = cursor.fetchall()
+        rows, total, total_exact, next_cursor, has_more = PedidoModel._fetch_page(
+            cursor, where, params, select_sql, join_sql, page, page_size,
+            cursor_token=cursor_token, after=after, with_total=with_total, exact=exact)
         t5 = time.time()
-        logger.warning(f'[PERF-MODEL] fetchall: {t5-t4:.3f}s | rows={len(rows)}')
+        logger.warning(f'[PERF-MODEL] COUNT + SQL execute + fetchall: {t5-t3:.3f}s | total={total} rows={len(rows)}')
 
         pedidos = [PedidoModel._map_pedido_row(row, has_numpedcli, offset=1) for row in rows]
 
@@ -185,14 +270,7 @@ class PedidoModel:
 
         conn.close()
 
-        total_pages = math.ceil(total / page_size) if total > 0 else 1
-        return {
-            'pedidos': pedidos,
-            'total': total,
-            'page': page,
-            'page_size': page_size,
-            'total_pages': total_pages
-        }
+        return PedidoModel._page_result(pedidos, total, total_exact, page, page_size, cursor_token, next_cursor, has_more)
 
     @staticmethod
     def get_by_id(empresa, anyo, pedido):
@@ -260,13 +338,21 @@ class PedidoModel:
         return pedido_data
 
     @staticmethod
-    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None):
+    def get_all(empresa_id=None, anyo=None, fecha_desde=None, fecha_hasta=None, cliente=None, pais=None, provincia=None, page=1, page_size=50, clientes_permitidos=None, control_comercial=None,
+                cursor=None, with_total=None, exact=True):
         """
         Obtiene todos los pedidos con paginacion servidor (para administradores).
 
+        Con `cursor` pagina por cursor y con exact=False estima el total (ver get_by_user).
+
         Returns:
-            dict: { pedidos, total, page, page_size, total_pages }
+            dict: { pedidos, total, total_exact, page, page_size, total_pages[, next_cursor, has_more] }
+
+        Raises:
+            ValueError: cursor no valido
         """
+        cursor_token = cursor  # `cursor` pasa a ser el cursor de BD
+        after = PedidoModel.parse_cursor(cursor_token)
         t0 = time.time()
         conn = Database.get_connection()
         t1 = time.time()
@@ -315,43 +401,14 @@ class PedidoModel:
 
         where = " AND ".join(where_parts)
 
-        # 1. Count total
-        cursor.execute(f"SELECT COUNT(*) FROM view_externos_venped v WHERE {where}", params)
-        total = cursor.fetchone()[0]
-        t2 = time.time()
-        logger.warning(f'[PERF-MODEL] COUNT: {t2-t1:.3f}s | total={total}')
-
-        # 2. Paginated data with ROW_NUMBER (SQL Server 2008 compatible)
-        offset_start = (page - 1) * page_size + 1
-        offset_end = page * page_size
-
-        data_query = f"""
-            SELECT * FROM (
-                SELECT ROW_NUMBER() OVER (ORDER BY v.fecha DESC, v.pedido DESC) AS rn,
-                       v.empresa, v.anyo, v.pedido, v.fecha, v.fecha_entrega, v.cliente,
-                       v.cliente_nombre, v.pedido_cliente, v.serie,
-                       CAST(v.bruto AS DECIMAL(18,2)) AS bruto, CAST(v.importe_dto AS DECIMAL(18,2)) AS importe_dto,
-                       CAST(v.total AS DECIMAL(18,2)) AS total, CAST(v.peso AS DECIMAL(18,2)) AS peso,
-                       v.divisa, v.usuario, v.fecha_alta,
-                       {numpedcli_sql}
-                       {location_sql},
-                       CASE WHEN EXISTS (SELECT 1 FROM view_externos_venliped l WHERE l.empresa = v.empresa AND l.anyo = v.anyo AND l.pedido = v.pedido AND RTRIM(ISNULL(l.articulo,'')) <> '' AND l.situacion = 'F') THEN 0 ELSE 1 END AS completo
-                FROM view_externos_venped v
-                {join_sql}
-                WHERE {where}
-            ) sub
-            WHERE rn BETWEEN ? AND ?
-        """
-        data_params = params + [offset_start, offset_end]
+        select_sql = PedidoModel._list_columns(numpedcli_sql, location_sql)
 
         t3 = time.time()
-        cursor.execute(data_query, data_params)
-        t4 = time.time()
-        logger.warning(f'[PERF-MODEL] SQL execute: {t4-t3:.3f}s')
-
-        rows = cursor.fetchall()
+        rows, total, total_exact, next_cursor, has_more = PedidoModel._fetch_page(
+            cursor, where, params, select_sql, join_sql, page, page_size,
+            cursor_token=cursor_token, after=after, with_total=with_total, exact=exact)
         t5 = time.time()
-        logger.warning(f'[PERF-MODEL] fetchall: {t5-t4:.3f}s | rows={len(rows)}')
+        logger.warning(f'[PERF-MODEL] COUNT + SQL execute + fetchall: {t5-t3:.3f}s | total={total} rows={len(rows)}')
 
         pedidos = [PedidoModel._map_pedido_row(row, has_numpedcli, offset=1) for row in rows]
 
@@ -360,14 +417,7 @@ class PedidoModel:
 
         conn.close()
 
-        total_pages = math.ceil(total / page_size) if total > 0 else 1
-        return {
-            'pedidos': pedidos,
-            'total': total,
-            'page': page,
-            'page_size': page_size,
-            'total_pages': total_pages
-        }
+        return PedidoModel._page_result(pedidos, total, total_exact, page, page_size, cursor_token, next_cursor, has_more)
 
     @staticmethod
     def get_lineas(empresa, anyo, pedido):
@@ -14,13 +14,53 @@
 
 # ============================================
 # ARCHIVO: models/precio_model.py
+#
+# Los precios de view_externos_articulos_precios se cachean en
+# memoria por tenant (conexión + empresa) durante PRECIOS_CACHE_TTL
+# segundos, compartidos entre peticiones:
+# - con la cache fría y un lote pequeño (<= PRECIOS_IN_MAX códigos)
+#   solo se consultan esos códigos (IN) y se añaden a la tabla
+# - con un lote grande se carga la lista completa de la empresa
+# Las tablas no se modifican una vez publicadas (copy-on-write).
 # ============================================
 from config.database import Database
 import logging
+import sys
+import threading
+import time
+
+from utils.env import env_int
 
 logger = logging.getLogger(__name__)
 
 
+PRECIOS_CACHE_TTL = env_int('PRECIOS_CACHE_TTL', 300)   # segundos (0 = sin cache)
+PRECIOS_IN_MAX = env_int('PRECIOS_IN_MAX', 200)         # códigos máx. para consultar con IN
+_IN_BATCH = 500                                          # parámetros por consulta IN
+
+
+def _clean(value):
+    # Códigos y calidades se repiten en todas las tablas: intern ahorra memoria
+    return sys.intern(value.strip()) if isinstance(value, str) else value
+
+
+class _PriceTable:
+    """Precios de un tenant: lista completa o solo los códigos ya consultados."""
+    __slots__ = ('loaded_at', 'complete', 'codigos', 'precios')
+
+    def __init__(self, precios, codigos=None, loaded_at=None):
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self.complete = codigos is None
+        self.codigos = frozenset() if codigos is None else frozenset(codigos)
+        self.precios = precios     # {(codigo, calidad): precio}
+
+    def fresh(self):
+        return time.monotonic() - self.loaded_at < PRECIOS_CACHE_TTL
+
+    def covers(self, codigos):
+        return self.complete or codigos <= self.codigos
+
+
 class PrecioModel:
     @staticmethod
     def get_precio(empresa_id, codigo, calidad, connection=None):
@@ -51,46 +91,119 @@ class PrecioModel:
             # La vista puede no existir en algunas instalaciones
             return None
 
+    _cache = {}                  # tenant -> _PriceTable
+    _cache_lock = threading.Lock()
+    _stats = {'hits': 0, 'partial': 0, 'full': 0}
+
+    @staticmethod
+    def _tenant_key(empresa_id, connection=None):
+        """Clave del tenant: conexión (BD de la empresa cliente) + empresa ERP."""
+        if connection is None:
+            from flask import session, has_request_context
+            connection = session.get('connection') if has_request_context() else None
+        return f"{connection or '0'}_{empresa_id}"
+
+    @staticmethod
+    def _fetch(cursor, empresa_id, codigos=None):
+        """Lee precios de la vista (todos, o solo los de `codigos`)."""
+        if codigos is None:
+            cursor.execute("""
+                SELECT codigo, calidad, precio
+                FROM view_externos_articulos_precios
+                WHERE empresa = ?
+            """, (empresa_id,))
+            rows = cursor.fetchall()
+        else:
+            rows = []
+            codigos = list(codigos)
+            for i in range(0, len(codigos), _IN_BATCH):
+                batch = codigos[i:i + _IN_BATCH]
+                cursor.execute(f"""
+                    SELECT codigo, calidad, precio
+                    FROM view_externos_articulos_precios
+                    WHERE empresa = ? AND codigo IN ({','.join('?' * len(batch))})
+                """, [empresa_id] + batch)
+                rows.extend(cursor.fetchall())
+
+        return {(_clean(row[0]), _clean(row[1])): float(row[2]) if row[2] else None for row in rows}
+
     @staticmethod
     def get_precios_batch(empresa_id, stocks, connection=None):
         """Obtiene precios para un lote de artículos.
 
+        Usa la tabla cacheada del tenant; si no cubre el lote consulta solo
+        los códigos que faltan (lote pequeño) o recarga la lista completa.
+
         Args:
             empresa_id: ID empresa ERP
             stocks: Lista de dicts con 'codigo' y 'calidad'
             connection: ID para conexión (opcional)
 
         Returns:
-            dict keyed by (codigo, calidad) → precio (float)
+            dict keyed by (codigo, calidad) → precio (float). Compartido: no modificar.
         """
         if not stocks:
             return {}
 
+        codigos = {_clean(s.get('codigo')) for s in stocks if s.get('codigo')}
+        key = PrecioModel._tenant_key(empresa_id, connection)
+        with PrecioModel._cache_lock:
+            table = PrecioModel._cache.get(key)
+        if table is not None and not table.fresh():
+            table = None
+        if table is not None and table.covers(codigos):
+            with PrecioModel._cache_lock:
+                PrecioModel._stats['hits'] += 1
+            return table.precios
+
+        missing = codigos - table.codigos if table is not None else codigos
         try:
             conn = Database.get_connection(connection)
-            cursor = conn.cursor()
-
-            # Obtener todos los precios de la empresa de una vez
-            cursor.execute("""
-                SELECT codigo, calidad, precio
-                FROM view_externos_articulos_precios
-                WHERE empresa = ?
-            """, (empresa_id,))
-
-            precios = {}
-            for row in cursor.fetchall():
-                codigo = row[0].strip() if isinstance(row[0], str) else row[0]
-                calidad = row[1].strip() if isinstance(row[1], str) else row[1]
-                key = (codigo, calidad)
-                precios[key] = float(row[2]) if row[2] else None
-
-            cursor.close()
-            conn.close()
-            return precios
+            try:
+                cursor = conn.cursor()
+                if len(missing) <= PRECIOS_IN_MAX:
+                    precios = PrecioModel._fetch(cursor, empresa_id, missing)
+                    if table is not None:
+                        precios = {**table.precios, **precios}
+                        table = _PriceTable(precios, table.codigos | missing, table.loaded_at)
+                    else:
+                        table = _PriceTable(precios, missing)
+                    stat = 'partial'
+                else:
+                    table = _PriceTable(PrecioModel._fetch(cursor, empresa_id))
+                    stat = 'full'
+                cursor.close()
+            finally:
+                conn.close()
         except Exception as e:
             # La vista puede no existir en algunas instalaciones
+            logger.debug(f'Precios no disponibles ({e})')
             return {}
 
+        with PrecioModel._cache_lock:
+            PrecioModel._stats[stat] += 1
+            if PRECIOS_CACHE_TTL > 0:
+                current = PrecioModel._cache.get(key)
+                # No pisar una tabla completa más reciente con una parcial
+                if current is None or not current.complete or table.complete or not current.fresh():
+                    PrecioModel._cache[key] = table
+        return table.precios
+
+    @staticmethod
+    def invalidate_cache(empresa_id=None, connection=None):
+        """Descarta los precios cacheados del tenant (o de todos si no se indica empresa)."""
+        with PrecioModel._cache_lock:
+            if empresa_id is None:
+                PrecioModel._cache.clear()
+            else:
+                PrecioModel._cache.pop(PrecioModel._tenant_key(empresa_id, connection), None)
+
+    @staticmethod
+    def cache_stats():
+        with PrecioModel._cache_lock:
+            return dict(PrecioModel._stats, tenants=len(PrecioModel._cache),
+                        precios=sum(len(t.precios) for t in PrecioModel._cache.values()))
+
     @staticmethod
     def inyectar_precios(empresa_id, stocks, connection=None):
         """Inyecta precios en una lista de stocks.
@@ -17,6 +17,41 @@
 # ARCHIVO: models/stock_model.py
 # ============================================
 from config.database import Database
+from utils.stock_snapshot import (SnapshotStore, SnapshotUnsupported, StockSnapshot, SNAPSHOT_ENABLED,
+                                  SNAPSHOT_REFRESH)
+from utils.text_index import tokenize
+from utils.pagination import (CountCache, decode_cursor, encode_cursor, keyset_condition, listing_total,
+                              split_page)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columnas de view_externos_stock en el orden que espera _row_to_stock
+_FIELDS = ('empresa', 'codigo', 'descripcion', 'calidad', 'color', 'tono', 'calibre',
+           'formato', 'serie', 'unidad', 'pallet', 'caja', 'unidadescaja', 'cajaspallet',
+           'existencias', 'ean13', 'pesocaja', 'pesopallet', 'tipo_producto', 'piezascaja')
+_NUMERIC_FIELDS = ('unidadescaja', 'cajaspallet', 'existencias', 'pesocaja', 'pesopallet', 'piezascaja')
+
+# Códigos por consulta al releer filas cambiadas (límite de parámetros de SQL Server)
+_SNAPSHOT_FETCH_BATCH = 500
+
+# Filas por lote al exportar en streaming (fetchmany / trozos del snapshot)
+_EXPORT_BATCH = 1000
+
+# Columnas de la búsqueda inteligente (filtro simple 'descripcion'), resuelta con el
+# índice de texto del snapshot
+_TEXT_FIELDS = ('codigo', 'descripcion', 'formato', 'serie', 'color')
+# Máximo de códigos de esa búsqueda que se pasan a SQL como IN (...)
+_TEXT_IN_MAX = 1000
+# Intercalación con la que la búsqueda inteligente en SQL ignora acentos y mayúsculas
+_TEXT_COLLATION = 'Latin1_General_CI_AI'
+
+# Snapshots en memoria de la vista, por tenant (conexión + empresa ERP)
+stock_snapshots = SnapshotStore()
+
+# Facetas calculadas, por tenant + versión del snapshot + filtros. Con snapshot la
+# clave cambia al cambiar el stock; sin él caducan como el snapshot (refresco).
+facet_cache = CountCache(ttl=SNAPSHOT_REFRESH, max_entries=256)
 
 
 def _s(val):
@@ -50,10 +85,90 @@ def _row_to_stock(row):
     }
 
 
+class _SnapshotSource:
+    """Lecturas de view_externos_stock con las que se construye/refresca el snapshot."""
+
+    def __init__(self, empresa_erp):
+        from flask import session, has_request_context
+        self.empresa_erp = empresa_erp
+        # El refresco se hace en un hilo sin sesión: se guarda la conexión de la petición
+        self.connection_id = session.get('connection') if has_request_context() else None
+
+    def signatures(self):
+        """Firma (checksum, filas) de cada código: detecta altas, bajas y cambios."""
+        conn = Database.get_connection(self.connection_id)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT codigo, CHECKSUM_AGG(BINARY_CHECKSUM({', '.join(_FIELDS)})), COUNT(*)
+                FROM view_externos_stock
+                WHERE empresa = ?
+                GROUP BY codigo
+            """, (self.empresa_erp,))
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        finally:
+            conn.close()
+
+    def load(self, codigos=None):
+        """Filas crudas de la empresa (todas o las de esos códigos)."""
+        conn = Database.get_connection(self.connection_id)
+        try:
+            cursor = conn.cursor()
+            query = f"SELECT {', '.join(_FIELDS)} FROM view_externos_stock WHERE empresa = ?"
+            if codigos is None:
+                cursor.execute(query, (self.empresa_erp,))
+                return [tuple(row) for row in cursor.fetchall()]
+
+            rows = []
+            codigos = list(codigos)
+            for i in range(0, len(codigos), _SNAPSHOT_FETCH_BATCH):
+                batch = codigos[i:i + _SNAPSHOT_FETCH_BATCH]
+                placeholders = ','.join(['?' for _ in batch])
+                cursor.execute(f"{query} AND codigo IN ({placeholders})", [self.empresa_erp] + batch)
+                rows.extend(tuple(row) for row in cursor.fetchall())
+            return rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def build(rows, signatures):
+        snapshot = StockSnapshot(rows, _FIELDS, _row_to_stock, signatures, numeric=_NUMERIC_FIELDS)
+        # El índice de texto se construye aquí (en el hilo de refresco) y no en la primera búsqueda
+        snapshot.text_index(_TEXT_FIELDS)
+        return snapshot
+
+
 class StockModel:
+    @staticmethod
+    def _tenant_key(empresa_erp):
+        """Clave del tenant: conexión (BD de la empresa cliente) + empresa ERP."""
+        from flask import session, has_request_context
+        connection_id = session.get('connection') if has_request_context() else None
+        return f"{connection_id or '0'}_{empresa_erp}"
+
+    @staticmethod
+    def _snapshot():
+        """
+        Snapshot en memoria de la empresa de sesión, o None si está
+        desactivado (STOCK_SNAPSHOT=false) o no se ha podido cargar
+        (en ese caso se consulta la vista como siempre).
+        """
+        if not SNAPSHOT_ENABLED:
+            return None
+        empresa_erp = Database.get_empresa_erp()
+        try:
+            return stock_snapshots.get(StockModel._tenant_key(empresa_erp), _SnapshotSource(empresa_erp))
+        except Exception as e:
+            logger.warning(f'Stock snapshot not available, querying view ({e})')
+            return None
+
     @staticmethod
     def get_all():
         """Obtiene todos los stocks de la empresa actual (de sesión)"""
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            return snapshot.records()
+
         conn = Database.get_connection()  # Obtiene empresa_cli_id de sesión
         empresa_erp = Database.get_empresa_erp()  # Obtiene de sesión
         try:
@@ -73,6 +188,10 @@ class StockModel:
     @staticmethod
     def get_by_codigo(codigo):
         """Obtiene un stock por código"""
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            return snapshot.get(codigo)
+
         conn = Database.get_connection()
         empresa_erp = Database.get_empresa_erp()
         try:
@@ -141,6 +260,9 @@ class StockModel:
     VALID_ORDER_COLUMNS = ['codigo', 'descripcion', 'calidad', 'color', 'tono',
                            'calibre', 'formato', 'serie', 'existencias', 'tipo_producto']
 
+    # Columnas de cada stock, en orden (cabecera de la exportación CSV)
+    EXPORT_COLUMNS = list(_FIELDS)
+
     # Columnas válidas para filtros (seguridad contra SQL injection)
     VALID_FILTER_COLUMNS = ['codigo', 'descripcion', 'calidad', 'color', 'tono',
                             'calibre', 'formato', 'serie', 'existencias', 'tipo_producto']
@@ -185,6 +307,20 @@ class StockModel:
         """
         sql_op = StockModel.VALID_OPERATORS.get(operador, '=')
 
+        # Lista de valores (búsqueda inteligente ya resuelta a códigos)
+        if operador == 'in':
+            if not valor:
+                return ("1=0", [])
+            return (f"{columna} IN ({','.join('?' * len(valor))})", list(valor))
+        # Palabra de la búsqueda inteligente en SQL: alguno de los tokens (ya sin
+        # acentos), comparando sin acentos ni mayúsculas
+        if operador == 'text_like':
+            if not valor:
+                return ("1=0", [])
+            likes = [f"{columna} COLLATE {_TEXT_COLLATION} LIKE ?" for _ in valor]
+            params = ['%' + t.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]') + '%'
+                      for t in valor]
+            return (likes[0] if len(likes) == 1 else f"({' OR '.join(likes)})", params)
         # Operadores de texto con LIKE
         if operador == 'contains':
             return (f"{columna} LIKE ?", f"%{valor}%")
@@ -222,88 +358,144 @@ class StockModel:
             return (f"{columna} {sql_op} ?", valor)
 
     @staticmethod
-    def search(filtros, page=None, limit=None, order_by='codigo', order_dir='ASC'):
+    def _parse_filtros(filtros):
+        """
+        Normaliza los filtros de search() (simples o columna__operador) a una
+        lista de condiciones (columnas, operador, valor). Con varias columnas
+        basta con que cumpla una (OR). La usan la consulta SQL y el snapshot.
+        """
+        condiciones = []
+        for key, valor in filtros.items():
+            if not valor:  # Ignorar valores vacíos
+                continue
+
+            # Intentar parsear como filtro con operador (columna__operador)
+            parsed = StockModel._parse_filter_key(key)
+            if parsed:
+                columna, operador = parsed
+                condiciones.append(((columna,), operador, valor))
+            # Compatibilidad con filtros simples (sin operador)
+            elif key in StockModel.VALID_FILTER_COLUMNS:
+                if key == 'existencias':
+                    # Para existencias, usar >= si viene como filtro simple
+                    condiciones.append((('existencias',), 'gte', float(valor)))
+                elif key == 'descripcion':
+                    # Búsqueda inteligente: todas las palabras, en cualquiera de las columnas de
+                    # texto, sin acentos, por prefijo/subcadena o con erratas (ver _resolve_text)
+                    if tokenize(valor):
+                        condiciones.append((_TEXT_FIELDS, 'text', valor))
+                else:
+                    # Por defecto usa LIKE %valor% para texto
+                    condiciones.append(((key,), 'contains', valor))
+            # Filtro especial existencias_min (compatibilidad)
+            elif key == 'existencias_min':
+                condiciones.append((('existencias',), 'gte', float(valor)))
+        return condiciones
+
+    @staticmethod
+    def _resolve_text(condiciones, snapshot):
+        """
+        Sustituye la búsqueda inteligente ('text') por condiciones SQL: primero
+        se resuelve a un conjunto de códigos con el índice de texto y la consulta
+        solo lee esos códigos (IN). Sin snapshot, o si casan demasiados códigos,
+        cada palabra es una condición (AND) que basta con que cumpla una de las
+        columnas de texto, comparando sin acentos; con snapshot la palabra se
+        cambia por los tokens del índice con que casa, así se mantienen las erratas.
+        """
+        resueltas = []
+        for columnas, operador, valor in condiciones:
+            if operador != 'text':
+                resueltas.append((columnas, operador, valor))
+                continue
+            index = snapshot.text_index(columnas) if snapshot is not None else None
+            claves = index.search(valor) if index is not None else None
+            if claves is not None and len(claves) <= _TEXT_IN_MAX:
+                resueltas.append((('codigo',), 'in', sorted(snapshot.codigos(claves))))
+                continue
+            for palabra in sorted(set(tokenize(valor))):
+                tokens = index.terms(palabra) if index is not None else [palabra]
+                # Si la palabra está contenida en los tokens basta con ella (un solo LIKE)
+                if any(palabra in t for t in tokens):
+                    tokens = [palabra]
+                resueltas.append((columnas, 'text_like', tokens))
+        return resueltas
+
+    @staticmethod
+    def search(filtros, page=None, limit=None, order_by='codigo', order_dir='ASC',
+               cursor=None, with_total=None, exact=True):
         """
         Busca stocks con filtros opcionales, paginación y ordenación.
 
+        Se resuelve sobre el snapshot en memoria si está disponible; si no
+        (o si algún filtro no tiene equivalente exacto en memoria), en SQL.
+
         Args:
             filtros: dict con filtros de búsqueda
             page: número de página (1-based), None para sin paginación
             limit: registros por página, None para sin paginación
             order_by: columna para ordenar (default: codigo)
             order_dir: dirección de ordenación ASC o DESC (default: ASC)
+            cursor: paginación por cursor ('' = primera página, o el
+                next_cursor de la respuesta anterior). Ignora `page`.
+            with_total: en modo cursor, calcular el total (default: solo
+                en la primera página)
+            exact: False = total estimado (barato) en lugar de COUNT(*) exacto.
+                En ambos casos el total se cachea unos segundos por filtros y
+                las páginas siguientes lo reutilizan.
 
         Returns:
-            Si hay paginación: dict con 'data', 'total', 'page', 'limit', 'pages'
+            Si hay paginación: dict con 'data', 'total', 'total_exact', 'page', 'limit', 'pages'
+            Si hay cursor: dict con 'data', 'limit', 'next_cursor', 'has_more', 'total', 'total_exact'
             Si no hay paginación: lista de stocks (comportamiento original)
+
+        Raises:
+            ValueError: cursor no válido
         """
+        order_by, order_dir = StockModel._orden(order_by, order_dir)
+
+        condiciones = StockModel._parse_filtros(filtros)
+
+        if cursor is not None:
+            return StockModel._search_cursor(condiciones, order_by, order_dir, cursor, limit, with_total, exact)
+
+        paginado = page is not None and limit is not None
+        if paginado:
+            page = max(1, int(page))
+            limit = max(1, min(500, int(limit)))  # Máximo 500 registros por página
+            offset = (page - 1) * limit
+
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            try:
+                stocks, total = snapshot.search(condiciones, order_by, order_dir == 'DESC',
+                                                offset if paginado else 0, limit if paginado else None)
+            except SnapshotUnsupported:
+                pass
+            else:
+                if paginado:
+                    return {
+                        'data': stocks,
+                        'total': total,
+                        'total_exact': True,
+                        'page': page,
+                        'limit': limit,
+                        'pages': (total + limit - 1) // limit
+                    }
+                return stocks
+
         conn = Database.get_connection()
         empresa_erp = Database.get_empresa_erp()
         try:
             cursor = conn.cursor()
 
-            # Validar columna de ordenación (prevenir SQL injection)
-            if order_by not in StockModel.VALID_ORDER_COLUMNS:
-                order_by = 'codigo'
-
-            # Validar dirección de ordenación
-            order_dir = 'DESC' if order_dir.upper() == 'DESC' else 'ASC'
-
             # Construir WHERE clause
-            where_conditions = ["empresa = ?"]
-            params = [empresa_erp]
-
-            # Procesar filtros - soporta tanto formato simple como con operador
-            for key, valor in filtros.items():
-                if not valor:  # Ignorar valores vacíos
-                    continue
-
-                # Intentar parsear como filtro con operador (columna__operador)
-                parsed = StockModel._parse_filter_key(key)
-                if parsed:
-                    columna, operador = parsed
-                    condition, param = StockModel._build_filter_condition(columna, operador, valor)
-                    if condition:  # Solo añadir si hay condición válida
-                        where_conditions.append(condition)
-                        # param puede ser un valor simple o una lista (para BETWEEN)
-                        if isinstance(param, list):
-                            params.extend(param)
-                        else:
-                            params.append(param)
-                # Compatibilidad con filtros simples (sin operador)
-                elif key in StockModel.VALID_FILTER_COLUMNS:
-                    # Por defecto usa LIKE %valor% para texto
-                    if key == 'existencias':
-                        # Para existencias, usar >= si viene como filtro simple
-                        where_conditions.append("existencias >= ?")
-                        params.append(float(valor))
-                    elif key == 'descripcion':
-                        # Búsqueda inteligente: partir por espacios, buscar cada palabra en descripcion O formato
-                        palabras = [p.strip() for p in valor.split() if p.strip()]
-                        for palabra in palabras:
-                            where_conditions.append("(descripcion LIKE ? OR formato LIKE ?)")
-                            params.append(f"%{palabra}%")
-                            params.append(f"%{palabra}%")
-                    else:
-                        where_conditions.append(f"{key} LIKE ?")
-                        params.append(f"%{valor}%")
-                # Filtro especial existencias_min (compatibilidad)
-                elif key == 'existencias_min':
-                    where_conditions.append("existencias >= ?")
-                    params.append(float(valor))
-
-            where_clause = " AND ".join(where_conditions)
+            condiciones = StockModel._resolve_text(condiciones, snapshot)
+            where_clause, params = StockModel._where(condiciones, empresa_erp)
 
             # Si hay paginación, usar ROW_NUMBER() (compatible con SQL Server 2008)
-            if page is not None and limit is not None:
-                page = max(1, int(page))
-                limit = max(1, min(500, int(limit)))  # Máximo 500 registros por página
-                offset = (page - 1) * limit
-
-                # Primero obtener el total de registros
-                count_query = f"SELECT COUNT(*) FROM view_externos_stock WHERE {where_clause}"
-                cursor.execute(count_query, params)
-                total = cursor.fetchone()[0]
+            if paginado:
+                # Primero obtener el total de registros (cacheado por filtros)
+                total, total_exact = listing_total(cursor, 'view_externos_stock', where_clause, params, exact)
 
                 # Query con paginación usando ROW_NUMBER()
                 query = f"""
@@ -335,11 +527,12 @@ class StockModel:
             stocks = [_row_to_stock(row) for row in cursor.fetchall()]
 
             # Devolver con metadatos de paginación si aplica
-            if page is not None and limit is not None:
+            if paginado:
                 total_pages = (total + limit - 1) // limit  # Redondeo hacia arriba
                 return {
                     'data': stocks,
                     'total': total,
+                    'total_exact': total_exact,
                     'page': page,
                     'limit': limit,
                     'pages': total_pages
@@ -349,6 +542,169 @@ class StockModel:
         finally:
             conn.close()
 
+    @staticmethod
+    def iter_search(filtros, order_by='codigo', order_dir='ASC', batch_size=_EXPORT_BATCH):
+        """
+        Resultado completo de search() sin paginar, en lotes de dicts, para
+        exportar en streaming: solo hay un lote en memoria cada vez (además
+        del snapshot, si está cargado). En SQL se lee con fetchmany.
+
+        La conexión se abre al pedir el primer lote y se cierra al agotar
+        (o cerrar) el generador.
+        """
+        if order_by not in StockModel.VALID_ORDER_COLUMNS:
+            order_by = 'codigo'
+        order_dir = 'DESC' if order_dir.upper() == 'DESC' else 'ASC'
+        condiciones = StockModel._parse_filtros(filtros)
+
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            try:
+                positions = snapshot.select(condiciones, order_by, order_dir == 'DESC')
+            except SnapshotUnsupported:
+                pass
+            else:
+                for i in range(0, len(positions), batch_size):
+                    yield snapshot.records(positions[i:i + batch_size])
+                return
+
+        conn = Database.get_connection()
+        empresa_erp = Database.get_empresa_erp()
+        try:
+            cursor = conn.cursor()
+            condiciones = StockModel._resolve_text(condiciones, snapshot)
+            where_clause, params = StockModel._where(condiciones, empresa_erp)
+            cursor.execute(f"""
+                SELECT {', '.join(_FIELDS)}
+                FROM view_externos_stock
+                WHERE {where_clause}
+                ORDER BY {order_by} {order_dir}
+            """, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [_row_to_stock(row) for row in rows]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _where(condiciones, empresa_erp):
+        """WHERE y parámetros SQL de las condiciones de _parse_filtros."""
+        where_conditions = ["empresa = ?"]
+        params = [empresa_erp]
+
+        for columnas, operador, valor in condiciones:
+            partes = []
+            for columna in columnas:
+                condition, param = StockModel._build_filter_condition(columna, operador, valor)
+                if condition:  # Solo añadir si hay condición válida
+                    partes.append(condition)
+                    # param puede ser un valor simple o una lista (para BETWEEN)
+                    if isinstance(param, list):
+                        params.extend(param)
+                    else:
+                        params.append(param)
+            if len(partes) > 1:
+                where_conditions.append(f"({' OR '.join(partes)})")
+            elif partes:
+                where_conditions.append(partes[0])
+
+        return " AND ".join(where_conditions), params
+
+    @staticmethod
+    def _orden(order_by, order_dir):
+        """Columna y dirección de ordenación validadas (prevenir SQL injection)."""
+        if order_by not in StockModel.VALID_ORDER_COLUMNS:
+            order_by = 'codigo'
+        order_dir = 'DESC' if (order_dir or '').upper() == 'DESC' else 'ASC'
+        return order_by, order_dir
+
+    @staticmethod
+    def parse_cursor(cursor, order_by='codigo', order_dir='ASC'):
+        """Clave (valor, codigo) del cursor, None en la primera página. ValueError si no es válido."""
+        order_by, order_dir = StockModel._orden(order_by, order_dir)
+        after = decode_cursor(cursor, f'{order_by}:{order_dir}')
+        if after is not None and len(after) != 2:
+            raise ValueError('Cursor no válido')
+        return after
+
+    @staticmethod
+    def _search_cursor(condiciones, order_by, order_dir, cursor, limit, with_total, exact=True):
+        """
+        Paginación por cursor (keyset) ordenando por (order_by, codigo).
+
+        En SQL cada página es un TOP (n) WITH TIES sobre WHERE (col, codigo) > (?, ?),
+        sin numerar las filas anteriores ni volver a contar.
+        """
+        limit = max(1, min(500, int(limit or 50)))
+        descending = order_dir == 'DESC'
+        order_key = f'{order_by}:{order_dir}'
+        after = StockModel.parse_cursor(cursor, order_by, order_dir)
+        if with_total is None:
+            with_total = after is None
+
+        def result(stocks, has_more, total, last_key, total_exact=True):
+            return {
+                'data': stocks,
+                'limit': limit,
+                'next_cursor': encode_cursor(order_key, list(last_key)) if has_more and last_key else None,
+                'has_more': has_more,
+                'total': total,
+                'total_exact': total_exact if total is not None else None
+            }
+
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            try:
+                stocks, total, has_more, last_key = snapshot.seek(condiciones, order_by, descending,
+                                                                   after, limit)
+                return result(stocks, has_more, total, last_key)
+            except SnapshotUnsupported:
+                pass
+
+        conn = Database.get_connection()
+        empresa_erp = Database.get_empresa_erp()
+        try:
+            cursor_db = conn.cursor()
+            condiciones = StockModel._resolve_text(condiciones, snapshot)
+            where_clause, params = StockModel._where(condiciones, empresa_erp)
+
+            total, total_exact = None, None
+            if with_total:
+                total, total_exact = listing_total(cursor_db, 'view_externos_stock', where_clause, params, exact)
+
+            columns = ['codigo'] if order_by == 'codigo' else [order_by, 'codigo']
+            page_params = list(params)
+            if after is not None:
+                seek_sql, seek_params = keyset_condition(
+                    columns, after[-len(columns):], descending, nullable_first=order_by != 'codigo')
+                where_clause = f"{where_clause} AND {seek_sql}"
+                page_params.extend(seek_params)
+
+            order_sql = ', '.join(f"{c} {order_dir}" for c in columns)
+            cursor_db.execute(f"""
+                SELECT TOP (?) WITH TIES
+                       empresa, codigo, descripcion, calidad, color, tono, calibre,
+                       formato, serie, unidad, pallet, caja, unidadescaja, cajaspallet,
+                       existencias, ean13, pesocaja, pesopallet, tipo_producto, piezascaja
+                FROM view_externos_stock
+                WHERE {where_clause}
+                ORDER BY {order_sql}
+            """, [limit + 1] + page_params)
+
+            # Cursor y empates sobre los valores crudos (NULL incluido)
+            order_pos, codigo_pos = _FIELDS.index(order_by), _FIELDS.index('codigo')
+
+            def key(row):
+                value = _s(row[order_pos])
+                return (value.casefold() if isinstance(value, str) else value, _s(row[codigo_pos]).casefold())
+            rows, has_more = split_page(cursor_db.fetchall(), limit, key)
+            last_key = (_s(rows[-1][order_pos]), _s(rows[-1][codigo_pos])) if rows else None
+            return result([_row_to_stock(row) for row in rows], has_more, total, last_key, total_exact)
+        finally:
+            conn.close()
+
     @staticmethod
     def get_valores_unicos(columna, limite=100):
         """
@@ -365,6 +721,10 @@ class StockModel:
         if columna not in StockModel.VALID_FILTER_COLUMNS:
             return []
 
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            return snapshot.distinct(columna, max(0, min(limite, 500)))
+
         conn = Database.get_connection()
         empresa_erp = Database.get_empresa_erp()
         try:
@@ -385,9 +745,110 @@ class StockModel:
         finally:
             conn.close()
 
+    @staticmethod
+    def get_facetas(filtros, columnas=None, limite=100):
+        """
+        Valores distintos con su número de filas para los filtros estilo Excel
+        de varias columnas a la vez, sobre el resultado de los filtros activos.
+
+        Args:
+            filtros: mismos filtros que search()
+            columnas: columnas a calcular (default: todas las de VALID_FILTER_COLUMNS)
+            limite: máximo de valores por columna (default 100, max 500)
+
+        Returns:
+            dict: { total, facetas: { columna: [{valor, total}, ...] } }
+        """
+        columnas = [c for c in (columnas or StockModel.VALID_FILTER_COLUMNS)
+                    if c in StockModel.VALID_FILTER_COLUMNS]
+        limite = max(1, min(int(limite), 500))
+        condiciones = StockModel._parse_filtros(filtros)
+        empresa_erp = Database.get_empresa_erp()
+        snapshot = StockModel._snapshot()
+
+        def calcular():
+            if snapshot is not None:
+                try:
+                    return snapshot.facets(condiciones, columnas, limite)
+                except SnapshotUnsupported:
+                    pass
+            return StockModel._get_facetas_sql(condiciones, columnas, limite, snapshot, empresa_erp)
+
+        clave_filtros = tuple((cols, op, valor.casefold() if isinstance(valor, str) else valor)
+                              for cols, op, valor in condiciones)
+        key = (StockModel._tenant_key(empresa_erp), snapshot.created if snapshot is not None else None,
+               tuple(columnas), limite, clave_filtros)
+        total, facetas = facet_cache.get_or_count(key, calcular)
+        return {
+            'total': total,
+            'facetas': {columna: [{'valor': valor, 'total': n} for valor, n in valores]
+                        for columna, valores in facetas.items()}
+        }
+
+    @staticmethod
+    def _get_facetas_sql(condiciones, columnas, limite, snapshot, empresa_erp):
+        """Facetas en una sola consulta (GROUPING SETS, una agrupación por columna)."""
+        conn = Database.get_connection()
+        try:
+            cursor = conn.cursor()
+            condiciones = StockModel._resolve_text(condiciones, snapshot)
+            where_clause, params = StockModel._where(condiciones, empresa_erp)
+            n = len(columnas)
+            cursor.execute(f"""
+                SELECT {', '.join(columnas)}, {', '.join(f'GROUPING({c})' for c in columnas)}, COUNT(*)
+                FROM view_externos_stock
+                WHERE {where_clause}
+                GROUP BY GROUPING SETS ({', '.join(f'({c})' for c in columnas)}, ())
+                ORDER BY {', '.join(columnas)}
+            """, params)
+
+            total = 0
+            facetas = {columna: [] for columna in columnas}
+            for row in cursor.fetchall():
+                grouping = list(row[n:2 * n])
+                if all(grouping):
+                    # Agrupación vacía (): total de filas filtradas
+                    total = row[-1]
+                    continue
+                pos = grouping.index(0)
+                columna, valor = columnas[pos], row[pos]
+                # Sin NULL ni vacíos, como get_valores_unicos
+                if valor is None or len(facetas[columna]) >= limite:
+                    continue
+                if columna in _NUMERIC_FIELDS:
+                    valor = float(valor)
+                    if valor == 0:
+                        continue
+                else:
+                    valor = _s(valor)
+                    if not valor:
+                        continue
+                facetas[columna].append((valor, row[-1]))
+            return total, facetas
+        finally:
+            conn.close()
+
     @staticmethod
     def get_resumen():
         """Obtiene un resumen de estadísticas del stock"""
+        snapshot = StockModel._snapshot()
+        if snapshot is not None:
+            row = snapshot.aggregate('existencias')
+        else:
+            row = StockModel._get_resumen_sql()
+
+        resumen = {
+            'total_productos': row[0],
+            'total_existencias': float(row[1]) if row[1] else 0.0,
+            'promedio_existencias': float(row[2]) if row[2] else 0.0,
+            'minimo_existencias': float(row[3]) if row[3] else 0.0,
+            'maximo_existencias': float(row[4]) if row[4] else 0.0
+        }
+
+        return resumen
+
+    @staticmethod
+    def _get_resumen_sql():
         conn = Database.get_connection()
         empresa_erp = Database.get_empresa_erp()
         try:
@@ -402,16 +863,6 @@ class StockModel:
                 FROM view_externos_stock
                 WHERE empresa = ?
             """, (empresa_erp,))
-            row = cursor.fetchone()
-
-            resumen = {
-                'total_productos': row[0],
-                'total_existencias': float(row[1]) if row[1] else 0.0,
-                'promedio_existencias': float(row[2]) if row[2] else 0.0,
-                'minimo_existencias': float(row[3]) if row[3] else 0.0,
-                'maximo_existencias': float(row[4]) if row[4] else 0.0
-            }
-
-            return resumen
+            return cursor.fetchone()
         finally:
             conn.close()
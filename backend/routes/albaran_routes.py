@@ -122,6 +122,12 @@ def get_mis_albaranes():
         type: integer
         required: false
         default: 50
+      - name: exact
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false = total estimado (ver total_exact), mas barato en filtros amplios
     responses:
       200:
         description: Lista paginada de albaranes del usuario
@@ -143,6 +149,7 @@ def get_mis_albaranes():
     fecha_hasta = request.args.get('fecha_hasta')
     page = request.args.get('page', 1, type=int)
     page_size = min(request.args.get('page_size', 50, type=int), 200)
+    exact = request.args.get('exact', 'true').lower() not in ('0', 'false', 'no')
 
     try:
         t1 = time.time()
@@ -155,7 +162,8 @@ def get_mis_albaranes():
                 fecha_hasta=fecha_hasta,
                 page=page,
                 page_size=page_size,
-                control_comercial=control
+                control_comercial=control,
+                exact=exact
             )
         else:
             logger.warning(f'[PERF] GET /api/albaranes/mis-albaranes cliente={cliente_id} anyo={anyo} page={page}')
@@ -166,7 +174,8 @@ def get_mis_albaranes():
                 fecha_desde=fecha_desde,
                 fecha_hasta=fecha_hasta,
                 page=page,
-                page_size=page_size
+                page_size=page_size,
+                exact=exact
             )
         t2 = time.time()
         logger.warning(f'[PERF] DB query + fetch: {t2-t1:.3f}s | rows={len(result["albaranes"])}')
@@ -174,6 +183,7 @@ def get_mis_albaranes():
         response = jsonify({
             'success': True,
             'total': result['total'],
+            'total_exact': result['total_exact'],
             'page': result['page'],
             'page_size': result['page_size'],
             'total_pages': result['total_pages'],
@@ -230,6 +240,12 @@ def get_todos_albaranes():
         type: integer
         required: false
         default: 50
+      - name: exact
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false = total estimado (ver total_exact), mas barato en filtros amplios
     responses:
       200:
         description: Lista paginada de todos los albaranes
@@ -250,6 +266,7 @@ def get_todos_albaranes():
     provincia = request.args.get('provincia')
     page = request.args.get('page', 1, type=int)
     page_size = min(request.args.get('page_size', 50, type=int), 200)
+    exact = request.args.get('exact', 'true').lower() not in ('0', 'false', 'no')
 
     logger.warning(f'[PERF] GET /api/albaranes empresa={empresa_id} anyo={anyo} cliente={cliente} pais={pais} provincia={provincia} page={page}')
 
@@ -264,7 +281,8 @@ def get_todos_albaranes():
             pais=pais,
             provincia=provincia,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            exact=exact
         )
         t2 = time.time()
         logger.warning(f'[PERF] DB query + fetch: {t2-t1:.3f}s | rows={len(result["albaranes"])}')
@@ -272,6 +290,7 @@ def get_todos_albaranes():
         response = jsonify({
             'success': True,
             'total': result['total'],
+            'total_exact': result['total_exact'],
             'page': result['page'],
             'page_size': result['page_size'],
             'total_pages': result['total_pages'],
@@ -15,6 +15,7 @@
 # ============================================
 # ARCHIVO: routes/db_info_routes.py
 # ============================================
+import os
 from flask import Blueprint, jsonify, session
 from flask_login import login_required
 from utils.auth import superusuario_required, csrf_required
@@ -331,3 +332,24 @@ def shrink_log():
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+@db_info_bp.route('/api/db-info/pool-stats', methods=['GET'])
+@login_required
+@superusuario_required
+def get_pool_stats():
+    """
+    Estadísticas de los pools de conexión del worker que atiende la petición
+    ---
+    tags:
+      - Sistema
+    responses:
+      200:
+        description: Tamaño, conexiones en uso, esperas y tiempos de conexión por pool
+    """
+    from config.database_central import DatabaseCentral
+    return jsonify({
+        'pid': os.getpid(),
+        'central': DatabaseCentral.get_pool_stats(),
+        'empresas': Database.get_pool_stats()
+    }), 200
@@ -16,14 +16,76 @@
 # ARCHIVO: routes/estadisticas_routes.py
 # Descripcion: Rutas para estadisticas del dashboard
 # ============================================
-from flask import Blueprint, jsonify, request, session
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify, request, session, copy_current_request_context
 from flask_login import login_required, current_user
 from models.estadisticas_model import EstadisticasModel
 from utils.auth import administrador_required
+from utils.pagination import CountCache
+from utils.env import env_int
 
 estadisticas_bp = Blueprint('estadisticas', __name__)
 
 
+DASHBOARD_WORKERS = env_int('DASHBOARD_WORKERS', 4)        # consultas en paralelo por proceso
+DASHBOARD_CACHE_TTL = env_int('DASHBOARD_CACHE_TTL', 30)   # segundos que se reutiliza un widget
+
+# widget -> (método de EstadisticasModel, {parámetro: (default, máximo)})
+# Los widgets devuelven lo mismo que su endpoint /api/estadisticas/<widget>
+_WIDGETS = {
+    'resumen': ('get_resumen', {}),
+    'productos-mas-solicitados': ('get_productos_mas_solicitados', {'limit': (10, 100)}),
+    'propuestas-por-dia': ('get_propuestas_por_periodo', {'dias': (30, 365)}),
+    'propuestas-por-estado': ('get_propuestas_por_estado', {}),
+    'usuarios-mas-activos': ('get_usuarios_mas_activos', {'limit': (10, 100)}),
+    'propuestas-por-mes': ('get_propuestas_por_mes', {'meses': (12, 120)}),
+    'consultas-por-estado': ('get_consultas_por_estado', {}),
+    'articulos-mas-vistos': ('get_articulos_mas_vistos', {'limit': (10, 100), 'dias': (30, 365)}),
+    'actividad-por-dia': ('get_actividad_por_dia', {'dias': (30, 365)}),
+    'acciones-distribucion': ('get_acciones_distribucion', {'dias': (30, 365)}),
+    'actividad-por-hora': ('get_actividad_por_hora', {'dias': (30, 365)}),
+    'usuarios-mas-interaccion': ('get_usuarios_mas_interaccion', {'limit': (10, 100), 'dias': (30, 365)}),
+    'logins-por-ubicacion': ('get_logins_por_ubicacion', {'dias': (30, 365)}),
+}
+
+# Resultados por (tenant, empresa, widget, parámetros), compartidos entre administradores
+dashboard_cache = CountCache(ttl=DASHBOARD_CACHE_TTL, max_entries=512)
+_executor = None
+_executor_pid = None
+_inflight = {}                   # clave -> Future en curso (peticiones simultáneas esperan la misma)
+_inflight_lock = threading.RLock()
+
+
+def _get_executor():
+    # Por proceso: un pool creado antes del fork de gunicorn no tiene hilos en el worker
+    global _executor, _executor_pid
+    with _inflight_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _widget_done(key, future):
+    if future.exception() is None:
+        dashboard_cache.put(key, future.result())
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def _submit_widget(key, fn):
+    """Future con el resultado de `fn`, compartido con otras peticiones de la misma clave."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _inflight[key] = _get_executor().submit(fn)
+            future.add_done_callback(lambda f: _widget_done(key, f))
+        return future
+
+
 def get_empresa_id():
     """Obtiene el empresa_id de la sesión para filtros (usuario logueado)."""
     # Todos los endpoints de estadísticas requieren login, usar sesión
@@ -501,3 +563,83 @@ def get_articulos_mas_vistos():
     except Exception as e:
         print(f"Error en articulos-mas-vistos: {e}")
         return jsonify([])
+
+
+@estadisticas_bp.route('/api/estadisticas/dashboard', methods=['GET'])
+@login_required
+@administrador_required
+def get_dashboard():
+    """
+    Obtener varios widgets del dashboard en una sola peticion
+    ---
+    tags:
+      - Estadisticas
+    security:
+      - cookieAuth: []
+    parameters:
+      - name: widgets
+        in: query
+        type: string
+        description: >
+          Widgets separados por comas (default todos): resumen, productos-mas-solicitados,
+          propuestas-por-dia, propuestas-por-estado, usuarios-mas-activos, propuestas-por-mes,
+          consultas-por-estado, articulos-mas-vistos, actividad-por-dia, acciones-distribucion,
+          actividad-por-hora, usuarios-mas-interaccion, logins-por-ubicacion
+      - name: dias
+        in: query
+        type: integer
+        description: >
+          Parametros comunes (dias, limit, meses). Para un solo widget se prefija
+          con su nombre, p.ej. propuestas-por-dia.dias=7
+    responses:
+      200:
+        description: Datos de cada widget (igual que su endpoint) y errores por widget
+        schema:
+          type: object
+          properties:
+            data:
+              type: object
+            errors:
+              type: object
+      400:
+        description: Widget desconocido
+    """
+    nombres = [w.strip() for w in request.args.get('widgets', '').split(',') if w.strip()] or list(_WIDGETS)
+    desconocidos = [w for w in nombres if w not in _WIDGETS]
+    if desconocidos:
+        return jsonify({'error': f"Widgets no validos: {', '.join(desconocidos)}"}), 400
+
+    empresa_id = get_empresa_id()
+    tenant = session.get('connection')
+    data, errors, futures = {}, {}, {}
+    for nombre in dict.fromkeys(nombres):
+        metodo, spec = _WIDGETS[nombre]
+        params = {}
+        for param, (default, maximo) in spec.items():
+            valor = request.args.get(f'{nombre}.{param}', type=int)
+            if valor is None:
+                valor = request.args.get(param, default, type=int)
+            params[param] = max(1, min(valor, maximo))
+
+        key = (tenant, empresa_id, nombre, tuple(sorted(params.items())))
+        cached = dashboard_cache.peek(key)
+        if cached is not None:
+            data[nombre] = cached
+            continue
+
+        @copy_current_request_context
+        def run(metodo=metodo, params=params):
+            return getattr(EstadisticasModel, metodo)(empresa_id, **params)
+
+        futures[nombre] = _submit_widget(key, run)
+
+    for nombre, future in futures.items():
+        try:
+            data[nombre] = future.result()
+        except Exception as e:
+            print(f"Error en dashboard ({nombre}): {e}")
+            data[nombre] = None
+            errors[nombre] = str(e)
+    if 'logins-por-ubicacion' in data and data['logins-por-ubicacion'] is not None:
+        data['logins-por-ubicacion'] = {'ubicaciones': data['logins-por-ubicacion']}
+    return jsonify({'data': data, 'errors': errors})
@@ -4,7 +4,10 @@
 
 from flask import Blueprint, request, jsonify, session
 from flask_login import login_required, current_user
-from models.image_search_model import ImageSearchModel, extract_features, EMBEDDING_VERSION
+from models.image_search_model import (
+    ImageSearchModel, extract_features, extract_query_features, query_feature_cache,
+    resolve_weights, EMBEDDING_VERSION, WEIGHT_PROFILES
+)
 from models.stock_model import StockModel
 from utils.auth import administrador_required, csrf_required
 import threading
@@ -43,14 +46,29 @@ def search_by_image():
             top_k:
               type: integer
               default: 20
+            weight_profile:
+              type: string
+              default: default
+              description: Perfil de pesos por grupo de features (default, colour-first, texture-first, pattern-first)
+            weights:
+              type: object
+              description: Pesos por grupo que sustituyen a los del perfil (ej. {"hog": 0.3})
     responses:
       200:
         description: Resultados de busqueda
+      400:
+        description: Imagen o perfil de pesos no valido
     """
     data = request.get_json()
     if not data or not data.get('image'):
         return jsonify({'success': False, 'error': 'No image provided'}), 400
 
+    weight_profile = data.get('weight_profile') or 'default'
+    try:
+        weights = resolve_weights(weight_profile, data.get('weights'))
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
+
     try:
         # Decodificar imagen base64
         image_b64 = data['image']
@@ -61,8 +79,8 @@ def search_by_image():
         image_bytes = base64.b64decode(image_b64)
         top_k = data.get('top_k', 20)
 
-        # Extraer features de la imagen de consulta
-        query_vector = extract_features(image_bytes)
+        # Extraer features de la imagen de consulta (cache por contenido)
+        query_vector, from_cache = extract_query_features(image_bytes)
         if query_vector is None:
             return jsonify({'success': False, 'error': 'Could not process image'}), 400
 
@@ -85,7 +103,7 @@ def search_by_image():
 
         # Buscar similares
         try:
-            results = ImageSearchModel.search(query_vector, empresa_id=empresa_id, top_k=top_k)
+            results = ImageSearchModel.search(query_vector, empresa_id=empresa_id, top_k=top_k, weights=weights)
         except ValueError as ve:
             error_msg = str(ve)
             if 'REINDEX_NEEDED' in error_msg:
@@ -148,7 +166,9 @@ def search_by_image():
         resp = {
             'success': True,
             'results': results,
-            'total': len(results)
+            'total': len(results),
+            'weight_profile': weight_profile,
+            'features_cached': from_cache
         }
         if enrich_error:
             resp['enrich_error'] = enrich_error
@@ -188,6 +208,8 @@ def get_index_status():
         'progress': _reindex_status.get('progress', 0),
         'reindex_total': _reindex_status.get('total', 0),
         'embedding_version': EMBEDDING_VERSION,
+        'weight_profiles': list(WEIGHT_PROFILES),
+        'query_cache': query_feature_cache.stats(),
         'needs_reindex': version_mismatch,
         'last_reindex_error': _reindex_status.get('error'),
         'last_reindex_errors_count': _reindex_status.get('errors_count', 0)
@@ -218,9 +240,7 @@ def reindex_images():
     connection_id = session.get('connection')
 
     # Invalidar cache inmediatamente para evitar usar embeddings viejos
-    cache_key = empresa_id or '_all'
-    with ImageSearchModel._cache_lock:
-        ImageSearchModel._cache.pop(cache_key, None)
+    ImageSearchModel.invalidate_cache(empresa_id, connection_id=connection_id)
     logger.info(f'Cache invalidated for empresa_id={empresa_id} before reindex')
 
     # Marcar running=True ANTES de lanzar el thread (evitar race condition con poll)
@@ -317,12 +337,10 @@ def debug_embeddings():
         result['db_error'] = str(e)
 
     # 3. Cache state
-    cache_key = empresa_id or '_all'
-    with ImageSearchModel._cache_lock:
-        cached = ImageSearchModel._cache.get(cache_key)
+    cached = ImageSearchModel.get_cached_index(empresa_id, connection_id)
     if cached:
         result['cache_count'] = len(cached)
-        result['cache_dims'] = len(cached[0][2]) if cached else None
+        result['cache_dims'] = cached.dims
     else:
         result['cache_count'] = 0
         result['cache_dims'] = None
@@ -365,9 +383,7 @@ def clear_embeddings():
     ImageSearchModel.clear_embeddings(empresa_id)
 
     # Limpiar cache
-    cache_key = empresa_id or '_all'
-    with ImageSearchModel._cache_lock:
-        ImageSearchModel._cache.pop(cache_key, None)
+    ImageSearchModel.invalidate_cache(empresa_id)
 
     logger.info(f'Embeddings cleared manually for empresa_id={empresa_id}')
 
@@ -713,6 +713,10 @@ def update_parametro(clave):
     success = ParametrosModel.set(clave, nuevo_valor, empresa_id, connection)
 
     if success:
+        if clave == 'MOSTRAR_PRECIOS':
+            # Al (re)activar precios no servir la lista cacheada de antes
+            from models.precio_model import PrecioModel
+            PrecioModel.invalidate_cache(empresa_id, connection)
         return jsonify({
             'message': 'Parámetro actualizado correctamente',
             'clave': clave,
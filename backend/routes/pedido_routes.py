@@ -122,6 +122,22 @@ def get_mis_pedidos():
         type: integer
         required: false
         default: 50
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Paginacion por cursor (vacio = primera pagina, despues next_cursor). Ignora page.
+      - name: count
+        in: query
+        type: boolean
+        required: false
+        description: En modo cursor, incluir el total (por defecto solo en la primera pagina)
+      - name: exact
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false = total estimado (ver total_exact), mas barato en filtros amplios
     responses:
       200:
         description: Lista paginada de pedidos del usuario
@@ -143,6 +159,19 @@ def get_mis_pedidos():
     fecha_hasta = request.args.get('fecha_hasta')
     page = request.args.get('page', 1, type=int)
     page_size = min(request.args.get('page_size', 50, type=int), 200)
+    cursor = request.args.get('cursor')
+    count = request.args.get('count')
+    with_total = None if count is None else count.lower() in ('1', 'true', 'yes')
+    exact = request.args.get('exact', 'true').lower() not in ('0', 'false', 'no')
+
+    try:
+        PedidoModel.parse_cursor(cursor)
+    except ValueError as e:
+        # Cursor no valido o de otra consulta
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
 
     try:
         t1 = time.time()
@@ -155,7 +184,10 @@ def get_mis_pedidos():
                 fecha_hasta=fecha_hasta,
                 page=page,
                 page_size=page_size,
-                control_comercial=control
+                control_comercial=control,
+                cursor=cursor,
+                with_total=with_total,
+                exact=exact
             )
         else:
             logger.warning(f'[PERF] GET /api/pedidos/mis-pedidos cliente={cliente_id} anyo={anyo} page={page}')
@@ -166,19 +198,27 @@ def get_mis_pedidos():
                 fecha_desde=fecha_desde,
                 fecha_hasta=fecha_hasta,
                 page=page,
-                page_size=page_size
+                page_size=page_size,
+                cursor=cursor,
+                with_total=with_total,
+                exact=exact
             )
         t2 = time.time()
         logger.warning(f'[PERF] DB query + fetch: {t2-t1:.3f}s | rows={len(result["pedidos"])}')
 
-        response = jsonify({
+        payload = {
             'success': True,
             'total': result['total'],
+            'total_exact': result['total_exact'],
             'page': result['page'],
             'page_size': result['page_size'],
             'total_pages': result['total_pages'],
             'pedidos': result['pedidos']
-        })
+        }
+        if cursor is not None:
+            payload['next_cursor'] = result['next_cursor']
+            payload['has_more'] = result['has_more']
+        response = jsonify(payload)
         t3 = time.time()
         logger.warning(f'[PERF] JSON serialize: {t3-t2:.3f}s | TOTAL: {t3-t0:.3f}s')
 
@@ -230,6 +270,22 @@ def get_todos_pedidos():
         type: integer
         required: false
         default: 50
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Paginacion por cursor (vacio = primera pagina, despues next_cursor). Ignora page.
+      - name: count
+        in: query
+        type: boolean
+        required: false
+        description: En modo cursor, incluir el total (por defecto solo en la primera pagina)
+      - name: exact
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: false = total estimado (ver total_exact), mas barato en filtros amplios
     responses:
       200:
         description: Lista paginada de todos los pedidos
@@ -251,6 +307,19 @@ def get_todos_pedidos():
     provincia = request.args.get('provincia')
     page = request.args.get('page', 1, type=int)
     page_size = min(request.args.get('page_size', 50, type=int), 200)
+    cursor = request.args.get('cursor')
+    count = request.args.get('count')
+    with_total = None if count is None else count.lower() in ('1', 'true', 'yes')
+    exact = request.args.get('exact', 'true').lower() not in ('0', 'false', 'no')
+
+    try:
+        PedidoModel.parse_cursor(cursor)
+    except ValueError as e:
+        # Cursor no valido o de otra consulta
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
 
     logger.warning(f'[PERF] GET /api/pedidos empresa={empresa_id} anyo={anyo} cliente={cliente} pais={pais} provincia={provincia} page={page}')
 
@@ -265,19 +334,27 @@ def get_todos_pedidos():
             pais=pais,
             provincia=provincia,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            cursor=cursor,
+            with_total=with_total,
+            exact=exact
         )
         t2 = time.time()
         logger.warning(f'[PERF] DB query + fetch: {t2-t1:.3f}s | rows={len(result["pedidos"])}')
 
-        response = jsonify({
+        payload = {
             'success': True,
             'total': result['total'],
+            'total_exact': result['total_exact'],
             'page': result['page'],
             'page_size': result['page_size'],
             'total_pages': result['total_pages'],
             'pedidos': result['pedidos']
-        })
+        }
+        if cursor is not None:
+            payload['next_cursor'] = result['next_cursor']
+            payload['has_more'] = result['has_more']
+        response = jsonify(payload)
         t3 = time.time()
         logger.warning(f'[PERF] JSON serialize: {t3-t2:.3f}s | TOTAL: {t3-t0:.3f}s')
 
@@ -15,15 +15,33 @@
 # ============================================
 # ARCHIVO: routes/stock_routes.py
 # ============================================
-from flask import Blueprint, jsonify, request, session, Response
-from flask_login import current_user
-from utils.auth import api_key_or_login_required
+from flask import Blueprint, jsonify, request, session, Response, stream_with_context
+from flask_login import current_user, login_required
+from utils.auth import api_key_or_login_required, administrador_required, csrf_required
 from controllers.stock_controller import StockController
-from models.imagen_model import ImagenModel
+from models.imagen_model import ImagenModel, IMAGE_SIZES, image_mimetype
 from models.ficha_tecnica_model import FichaTecnicaModel
+from utils.image_cache import derived_images
+from utils.env import env_int
+from utils.image_derivatives import (
+    DERIVATIVE_SIZES, DERIVATIVE_FORMATS, FORMAT_MIMETYPES, PRECOMPUTE_SIZES, negotiate_format
+)
+import logging
+import os
+import threading
 
 stock_bp = Blueprint('stocks', __name__)
 
+# Entrega binaria de imágenes: tamaño de trozo al enviar originales y
+# ámbito de Cache-Control ('private' = solo navegador; 'public' permite CDN)
+IMAGE_STREAM_CHUNK = env_int('IMAGE_STREAM_CHUNK_KB', 256) * 1024
+IMAGE_CACHE_SCOPE = 'public' if os.environ.get('IMAGE_CACHE_PUBLIC', '').lower() in ('1', 'true', 'yes') else 'private'
+
+logger = logging.getLogger(__name__)
+
+# Estado de la generación de derivadas en segundo plano (por proceso)
+_derivatives_status = {'running': False, 'progress': 0, 'total': 0, 'errors_count': 0, 'error': None}
+
 # Definir las rutas (protegidas con sesión o API key)
 @stock_bp.route('/api/stocks', methods=['GET'])
 @api_key_or_login_required
@@ -35,6 +53,14 @@ def get_all():
       - Stocks
     security:
       - apiKeyAuth: []
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        description: >
+          Exportación en streaming (un stock por línea en NDJSON, o CSV con cabecera).
+          Pensado para integraciones que descargan el catálogo completo.
     responses:
       200:
         description: Lista de todos los stocks
@@ -83,6 +109,11 @@ def search():
     security:
       - apiKeyAuth: []
     parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        description: Exportar todo el resultado en streaming (ignora la paginación)
       - name: codigo
         in: query
         type: string
@@ -90,7 +121,9 @@ def search():
       - name: descripcion
         in: query
         type: string
-        description: Filtrar por descripción (búsqueda parcial)
+        description: >
+          Búsqueda inteligente: todas las palabras en código, descripción, formato,
+          serie o color, sin acentos, por prefijo/subcadena o con erratas
       - name: formato
         in: query
         type: string
@@ -143,6 +176,23 @@ def search():
         enum: [ASC, DESC]
         description: Dirección de ordenación
         default: ASC
+      - name: cursor
+        in: query
+        type: string
+        description: >
+          Paginación por cursor (alternativa a page). Vacío para la primera página;
+          después, el next_cursor de la respuesta anterior con los mismos filtros y orden.
+      - name: count
+        in: query
+        type: boolean
+        description: En modo cursor, incluir el total (por defecto solo en la primera página)
+      - name: exact
+        in: query
+        type: boolean
+        default: true
+        description: >
+          false = total estimado (último total conocido o "al menos N"); ver total_exact.
+          El total se cachea unos segundos y las páginas siguientes lo reutilizan.
     responses:
       200:
         description: Lista de stocks filtrados. Con paginación incluye metadatos.
@@ -162,6 +212,9 @@ def search():
                 total:
                   type: integer
                   description: Total de registros
+                total_exact:
+                  type: boolean
+                  description: false si total es una estimación (hay al menos total registros)
                 page:
                   type: integer
                   description: Página actual
@@ -171,6 +224,25 @@ def search():
                 pages:
                   type: integer
                   description: Total de páginas
+            - type: object
+              description: Con cursor - página y cursor de la siguiente
+              properties:
+                data:
+                  type: array
+                  items:
+                    type: object
+                limit:
+                  type: integer
+                next_cursor:
+                  type: string
+                  description: Cursor de la página siguiente (null si no hay más)
+                has_more:
+                  type: boolean
+                total:
+                  type: integer
+                  description: Total de registros (null si no se ha pedido)
+      400:
+        description: Cursor no válido
       401:
         description: No autenticado
       500:
@@ -222,6 +294,59 @@ def get_valores_unicos(columna):
     return StockController.get_valores_unicos(columna)
 
 
+@stock_bp.route('/api/stocks/facetas', methods=['GET'])
+@api_key_or_login_required
+def get_facetas():
+    """
+    Valores únicos con su recuento para todos los filtros estilo Excel
+    ---
+    tags:
+      - Stocks
+    security:
+      - apiKeyAuth: []
+    description: >
+      Calcula en una sola pasada, sobre el resultado de los filtros activos
+      (mismos parámetros que /api/stocks/search), los valores distintos de cada
+      columna y cuántas filas tienen cada uno. Sustituye a una llamada a
+      valores-unicos por columna.
+    parameters:
+      - name: columnas
+        in: query
+        type: string
+        description: Columnas separadas por comas (default todas las filtrables)
+      - name: limite
+        in: query
+        type: integer
+        description: Máximo de valores por columna (default 100, max 500)
+        default: 100
+    responses:
+      200:
+        description: Facetas por columna
+        schema:
+          type: object
+          properties:
+            total:
+              type: integer
+              description: Filas que cumplen los filtros
+            facetas:
+              type: object
+              additionalProperties:
+                type: array
+                items:
+                  type: object
+                  properties:
+                    valor:
+                      type: string
+                    total:
+                      type: integer
+      400:
+        description: Columna no válida
+      401:
+        description: No autenticado
+    """
+    return StockController.get_facetas()
+
+
 @stock_bp.route('/api/stocks/resumen', methods=['GET'])
 @api_key_or_login_required
 def get_resumen():
@@ -334,6 +459,18 @@ def get_imagenes(codigo):
         type: string
         required: true
         description: Código del producto
+      - name: format
+        in: query
+        type: string
+        enum: [base64, url]
+        default: base64
+        description: "url: devuelve [{id, codigo, url}] con URLs de /api/stocks/imagen/<id> en lugar de base64"
+      - name: size
+        in: query
+        type: string
+        enum: [thumb, grid, original]
+        default: original
+        description: Tamaño de las URLs con format=url
     responses:
       200:
         description: Lista de imágenes del artículo (base64)
@@ -356,6 +493,15 @@ def get_imagenes(codigo):
     """
     try:
         empresa_id = get_empresa_id()
+        if request.args.get('format') == 'url':
+            size = request.args.get('size', 'original')
+            if size not in IMAGE_SIZES:
+                size = 'original'
+            refs = ImagenModel.get_image_refs(codigo, empresa_id)
+            return jsonify([
+                {'id': ref['id'], 'codigo': ref['codigo'], 'url': ImagenModel.image_url(ref, size)}
+                for ref in refs
+            ]), 200
         imagenes = ImagenModel.get_by_codigo(codigo, empresa_id)
         return jsonify(imagenes), 200
     except Exception as e:
@@ -378,6 +524,12 @@ def get_thumbnail(codigo):
         type: string
         required: true
         description: Código del producto
+      - name: format
+        in: query
+        type: string
+        enum: [base64, url]
+        default: base64
+        description: "url: devuelve {id, codigo, url} en lugar de la imagen en base64"
     responses:
       200:
         description: Primera imagen del artículo (base64)
@@ -400,6 +552,12 @@ def get_thumbnail(codigo):
     """
     try:
         empresa_id = get_empresa_id()
+        if request.args.get('format') == 'url':
+            ref = ImagenModel.get_primeras_image_refs([codigo], empresa_id).get(codigo.strip())
+            if not ref:
+                return jsonify({'error': 'No hay imagen disponible'}), 404
+            return jsonify({'id': ref['id'], 'codigo': ref['codigo'],
+                            'url': ImagenModel.image_url(ref, 'thumb')}), 200
         imagen = ImagenModel.get_primera_imagen(codigo, empresa_id=empresa_id)
         if imagen:
             return jsonify(imagen), 200
@@ -431,9 +589,18 @@ def get_thumbnails_batch():
               items:
                 type: string
               description: Lista de códigos de productos
+            quality:
+              type: string
+              enum: [thumb, grid]
+              default: thumb
+            format:
+              type: string
+              enum: [base64, url]
+              default: base64
+              description: "base64: {codigo: imagen_base64}; url: {codigo: url de /api/stocks/imagen/<id>} (cacheable)"
     responses:
       200:
-        description: Diccionario con thumbnails {codigo: imagen_base64}
+        description: Diccionario {codigo: imagen_base64} (o {codigo: url} con format=url)
         schema:
           type: object
           additionalProperties:
@@ -463,12 +630,189 @@ def get_thumbnails_batch():
             quality = 'thumb'
 
         empresa_id = get_empresa_id()
+        # base64 por defecto (integraciones con API key); el frontend pide format=url
+        if data.get('format') == 'url':
+            refs = ImagenModel.get_primeras_image_refs(codigos, empresa_id)
+            return jsonify({codigo: ImagenModel.image_url(ref, quality) for codigo, ref in refs.items()}), 200
+
         thumbnails = ImagenModel.get_thumbnails_batch(codigos, quality, empresa_id=empresa_id)
         return jsonify(thumbnails), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@stock_bp.route('/api/stocks/imagen/<int:imagen_id>', methods=['GET'])
+@api_key_or_login_required
+def get_imagen_binaria(imagen_id):
+    """
+    Imagen de un artículo en binario (cacheable, con ETag y Range)
+    ---
+    tags:
+      - Stocks
+    security:
+      - apiKeyAuth: []
+    parameters:
+      - name: imagen_id
+        in: path
+        type: integer
+        required: true
+      - name: size
+        in: query
+        type: string
+        enum: [thumb, grid, detail, original]
+        default: original
+        description: "thumb (160px), grid (400px), detail (1200px) u original. Las derivadas se sirven en AVIF/WebP si el cliente lo indica en Accept, si no en JPEG"
+      - name: v
+        in: query
+        type: string
+        description: Versión de la imagen (la incluyen las URLs devueltas por la API); con ella la respuesta es immutable
+    responses:
+      200:
+        description: Imagen (image/jpeg, image/webp, image/avif, image/png...)
+      206:
+        description: Rango de bytes de la imagen original
+      304:
+        description: No modificada (If-None-Match)
+      404:
+        description: Imagen no encontrada
+      416:
+        description: Rango no satisfacible
+    """
+    size = request.args.get('size', 'original')
+    if size not in IMAGE_SIZES:
+        return jsonify({'error': f'size debe ser uno de {", ".join(IMAGE_SIZES)}'}), 400
+
+    try:
+        empresa_id = get_empresa_id()
+        ref = ImagenModel.get_image_ref(imagen_id, empresa_id)
+        if not ref:
+            return jsonify({'error': 'Imagen no encontrada'}), 404
+
+        version = ImagenModel.variant_version(ref, size)
+        # Derivadas: formato según Accept (la ETag y Vary dependen de él)
+        fmt = negotiate_format(request.accept_mimetypes) if size in DERIVATIVE_SIZES and ref['size'] else None
+        etag = f'{imagen_id}-{version}-{size}' + (f'.{fmt}' if fmt else '')
+        if request.args.get('v') == version:
+            cache_control = f'{IMAGE_CACHE_SCOPE}, max-age=31536000, immutable'
+        else:
+            cache_control = f'{IMAGE_CACHE_SCOPE}, no-cache'
+
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        elif size == 'original' and ref['size']:
+            resp = _original_image_response(ref, etag)
+        else:
+            data = ImagenModel.get_image_variant(ref, size, fmt or 'jpg', empresa_id)
+            if not data:
+                return jsonify({'error': 'Imagen no encontrada'}), 404
+            resp = Response(data, mimetype=FORMAT_MIMETYPES[fmt] if fmt else image_mimetype(data))
+            resp.set_etag(etag)
+            resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+        if fmt:
+            resp.vary.add('Accept')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = cache_control
+        resp.headers['Accept-Ranges'] = 'bytes'
+        return resp
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _original_image_response(ref, etag):
+    """Imagen original: Range con SUBSTRING en el servidor o envío completo por trozos."""
+    total = ref['size']
+    byte_range = request.range
+    if byte_range and request.if_range and request.if_range.etag not in (None, etag):
+        byte_range = None  # If-Range de otra versión: enviar la imagen completa
+
+    if byte_range:
+        bounds = byte_range.range_for_length(total)
+        if bounds is None:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = f'bytes */{total}'
+            return resp
+        start, stop = bounds
+        resp = Response(ImagenModel.read_image_range(ref['id'], start, stop - start),
+                        status=206, mimetype=ref['mimetype'])
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+        return resp
+
+    chunks = ImagenModel.iter_image(ref['id'], total, IMAGE_STREAM_CHUNK)
+    resp = Response(stream_with_context(chunks), mimetype=ref['mimetype'])
+    resp.headers['Content-Length'] = str(total)
+    return resp
+
+
+@stock_bp.route('/api/stocks/imagenes/derivadas', methods=['GET'])
+@login_required
+@administrador_required
+def get_derivadas_status():
+    """
+    Estado de la generación de derivadas de imágenes (tamaños y formatos)
+    ---
+    tags:
+      - Stocks
+    responses:
+      200:
+        description: Progreso, formatos generados y estadísticas de la cache en disco
+    """
+    return jsonify({
+        'success': True,
+        **_derivatives_status,
+        'sizes': DERIVATIVE_SIZES,
+        'precompute': PRECOMPUTE_SIZES,
+        'formats': DERIVATIVE_FORMATS,
+        'cache': derived_images.stats()
+    })
+
+
+@stock_bp.route('/api/stocks/imagenes/derivadas', methods=['POST'])
+@login_required
+@administrador_required
+@csrf_required
+def generar_derivadas():
+    """
+    Generar en segundo plano las derivadas (IMAGE_DERIVATIVE_PRECOMPUTE x WebP/AVIF/JPEG) de todas las imágenes
+    ---
+    tags:
+      - Stocks
+    responses:
+      200:
+        description: Generación iniciada
+      409:
+        description: Ya hay una generación en curso
+    """
+    global _derivatives_status
+
+    if _derivatives_status['running']:
+        return jsonify({'success': False, 'error': 'Generation already in progress'}), 409
+
+    empresa_id = get_empresa_id()
+    connection_id = session.get('connection')
+    _derivatives_status = {'running': True, 'progress': 0, 'total': 0, 'errors_count': 0, 'error': None}
+
+    def _progress_callback(done, total, errors_count):
+        global _derivatives_status
+        _derivatives_status = {'running': True, 'progress': done, 'total': total,
+                               'errors_count': errors_count, 'error': None}
+
+    def _derivatives_thread():
+        global _derivatives_status
+        try:
+            done, errors_count = ImagenModel.generate_derivatives(
+                empresa_id, connection_id=connection_id, progress_callback=_progress_callback)
+            logger.info(f'Derivatives complete: {done} images, {errors_count} errors')
+            _derivatives_status = {'running': False, 'progress': done, 'total': done + errors_count,
+                                   'errors_count': errors_count, 'error': None}
+        except Exception as e:
+            logger.error(f'Derivatives generation failed: {e}', exc_info=True)
+            _derivatives_status = {'running': False, 'progress': 0, 'total': 0, 'errors_count': 0, 'error': str(e)}
+
+    threading.Thread(target=_derivatives_thread, daemon=True).start()
+    return jsonify({'success': True, 'message': 'Derivative generation started in background'})
+
+
 @stock_bp.route('/api/stocks/<string:codigo>/view', methods=['POST'])
 @api_key_or_login_required
 def track_article_view(codigo):
@@ -493,23 +837,12 @@ def track_article_view(codigo):
         description: Error del servidor
     """
     try:
-        from models.audit_model import AuditModel, AuditAction
+        from models.articulo_vista_model import ArticuloVistaModel
         empresa_id = session.get('empresa_id', '1')
         user_id = current_user.id if current_user and current_user.is_authenticated else None
-        username = current_user.username if current_user and current_user.is_authenticated else None
-        ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-        user_agent = request.headers.get('User-Agent', '')
-
-        AuditModel.log(
-            accion=AuditAction.ARTICLE_VIEW,
-            user_id=user_id,
-            username=username,
-            empresa_id=empresa_id,
-            recurso='articulo',
-            recurso_id=codigo,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
+
+        # Contador en memoria resumido por dia (no una fila de audit_log por vista)
+        ArticuloVistaModel.registrar(codigo, empresa_id, user_id)
         return jsonify({'ok': True}), 200
     except Exception as e:
         return jsonify({'ok': False}), 200
@@ -29,6 +29,7 @@ from database.users_db import (
     change_password, add_user_to_empresa, get_user_empresas, set_email_verified
 )
 from models.email_config_model import EmailConfigModel
+from models.estadisticas_resumen_model import EstadisticasResumenModel
 from utils.password_policy import validate_password, get_password_error_message
 import os
 from datetime import datetime
@@ -1746,6 +1747,7 @@ def eliminar_usuario_cascada(user_id):
             # 6. Eliminar registros de auditoría del usuario
             cursor.execute("DELETE FROM audit_log WHERE user_id = ?", (user_id,))
             eliminados['audit_log'] = cursor.rowcount
+            EstadisticasResumenModel.borrar_usuario(cursor, user_id)
 
             # 7. Finalmente, eliminar el usuario
             cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
@@ -30,6 +30,16 @@ def mock_database():
         yield {'connection': mock_conn, 'cursor': mock_cursor}
 
 
+@pytest.fixture(autouse=True)
+def flush_audit_log(mock_database):
+    """Escribir audit_log y contadores de vistas al terminar cada test (con la BD aún mockeada)."""
+    yield
+    from models.audit_model import audit_writer
+    from models.articulo_vista_model import view_counter
+    audit_writer.flush()
+    view_counter.flush()
+
+
 @pytest.fixture(autouse=True)
 def mock_database_central():
     """Mock global de DatabaseCentral.get_connection."""
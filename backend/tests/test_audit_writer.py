@@ -0,0 +1,90 @@
+"""Tests de la escritura asíncrona por lotes de audit_log (utils/audit_writer.py)."""
+import threading
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from utils.audit_writer import AuditWriter
+
+
+class TestAuditWriter:
+    def test_batches_per_tenant(self):
+        """Cada tenant se escribe en lotes de batch_size filas, en orden de llegada."""
+        writes = []
+        writer = AuditWriter(lambda tenant, rows: writes.append((tenant, list(rows))),
+                             batch_size=2, interval=60)
+        with patch.object(writer, '_ensure_thread'):
+            for i, tenant in enumerate([1, 2, 1, 1]):
+                writer.submit(tenant, (i,))
+            assert writer.flush()
+
+        assert writes == [(1, [(0,), (2,)]), (1, [(3,)]), (2, [(1,)])]
+        assert writer.stats()['written'] == 4 and writer.stats()['pending'] == 0
+
+    def test_drop_oldest_and_retry(self):
+        """Con la cola llena se descartan las más antiguas; un lote fallido vuelve a la cola."""
+        write = MagicMock(side_effect=[ConnectionError('BD caída'), None])
+        writer = AuditWriter(write, max_queue=3, batch_size=10, interval=60)
+        with patch.object(writer, '_ensure_thread'):
+            for i in range(5):
+                writer.submit(1, (i,))
+            assert writer.stats()['dropped'] == 2
+
+            assert not writer.flush()
+            assert writer.stats()['pending'] == 3
+            assert writer.flush()
+
+        assert write.call_args.args == (1, [(2,), (3,), (4,)])
+
+    def test_failing_tenant_does_not_block_others(self):
+        """Si la BD de un tenant falla, las filas de los demás se escriben igual."""
+        writes = []
+
+        def write(tenant, rows):
+            if tenant == 'A':
+                raise ConnectionError('BD de A caída')
+            writes.append((tenant, list(rows)))
+
+        writer = AuditWriter(write, batch_size=1, interval=60)
+        with patch.object(writer, '_ensure_thread'):
+            writer.submit('A', ('a1',))
+            writer.submit('A', ('a2',))
+            writer.submit('B', ('b1',))
+            for _ in range(5):
+                assert not writer.flush()
+
+        assert writes == [('B', [('b1',)])]
+        assert writer.stats()['pending'] == 2 and writer._queues['A'][0] == ('a1',)
+
+    def test_background_flush_and_stop(self):
+        """El hilo escribe sin que el llamante espere y stop() vacía lo pendiente."""
+        written = threading.Event()
+        writer = AuditWriter(lambda tenant, rows: written.set(), batch_size=1, interval=60)
+        writer.submit(1, ('a',))
+        assert written.wait(5)
+        writer.stop()
+        assert not writer._thread.is_alive()
+
+
+class TestAuditModelLog:
+    def test_log_is_queued(self, app):
+        """AuditModel.log con connection encola y vuelve sin tocar la BD; return_id inserta en el momento."""
+        from models import audit_model
+        from models.audit_model import AuditModel
+
+        writer = AuditWriter(MagicMock(), interval=60)
+        with app.test_request_context(), \
+                patch.object(audit_model, 'audit_writer', writer), \
+                patch.object(writer, '_ensure_thread'), \
+                patch('models.audit_model.Database.get_connection') as get_connection:
+            assert AuditModel.log('ARTICLE_VIEW', connection_id=3, recurso_id='A' * 200) is None
+            get_connection.assert_not_called()
+            assert writer.stats()['pending'] == 1
+            assert len(writer._queues[3][0][6]) == 100  # recurso_id truncado al encolar
+            assert isinstance(writer._queues[3][0][0], datetime)  # fecha del evento, no del volcado
+
+            cursor = get_connection.return_value.cursor.return_value
+            cursor.fetchone.return_value = (42,)
+            assert AuditModel.log('LOGIN', connection_id=3, return_id=True) == 42
+
+            writer.flush()
+        writer.write_batch.assert_called_once()
@@ -0,0 +1,126 @@
+"""Tests del pool de conexiones pyodbc (config/connection_pool.py)."""
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from config.connection_pool import ConnectionPool, PoolTimeoutError
+
+
+def _fake_connect(*args, **kwargs):
+    raw = MagicMock()
+    raw.autocommit = False
+    return raw
+
+
+@pytest.fixture
+def fake_connect():
+    with patch('config.connection_pool.pyodbc.connect', side_effect=_fake_connect) as mock_connect:
+        yield mock_connect
+
+
+class TestConnectionPool:
+    def test_close_returns_connection_to_pool(self, fake_connect):
+        """close() devuelve la conexión al pool y la siguiente petición la reutiliza."""
+        pool = ConnectionPool('DSN=test', max_size=2)
+        conn = pool.acquire()
+        raw = conn._raw
+        conn.close()
+        conn.close()  # idempotente
+
+        conn2 = pool.acquire()
+        assert conn2._raw is raw
+        assert fake_connect.call_count == 1
+        assert pool.stats()['reused'] == 1
+
+    def test_release_rolls_back_and_resets_autocommit(self, fake_connect):
+        """Al devolver una conexión se deshace la transacción y se restaura autocommit."""
+        pool = ConnectionPool('DSN=test', max_size=1)
+        conn = pool.acquire()
+        conn.autocommit = True
+        raw = conn._raw
+        conn.close()
+        raw.rollback.assert_called_once()
+        assert raw.autocommit is False
+
+    def test_context_manager_commits_and_releases(self, fake_connect):
+        """`with` hace commit al salir y devuelve la conexión."""
+        pool = ConnectionPool('DSN=test', max_size=1)
+        with pool.acquire() as conn:
+            raw = conn._raw
+        raw.commit.assert_called_once()
+        assert pool.stats()['in_use'] == 0
+        assert pool.stats()['idle'] == 1
+
+    def test_timeout_when_exhausted(self, fake_connect):
+        """Con el pool lleno, acquire() espera y lanza PoolTimeoutError."""
+        pool = ConnectionPool('DSN=test', max_size=1, timeout=0.05)
+        conn = pool.acquire()
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire()
+        stats = pool.stats()
+        assert stats['waits'] == 1
+        assert stats['timeouts'] == 1
+        conn.close()
+
+    def test_waiter_gets_released_connection(self, fake_connect):
+        """Un hilo esperando recibe la conexión en cuanto otro la libera."""
+        pool = ConnectionPool('DSN=test', max_size=1, timeout=5)
+        conn = pool.acquire()
+        result = {}
+
+        def worker():
+            c = pool.acquire()
+            result['raw'] = c._raw
+            c.close()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        raw = conn._raw
+        conn.close()
+        t.join(timeout=5)
+        assert result['raw'] is raw
+        assert fake_connect.call_count == 1
+
+    def test_max_lifetime_discards_connection(self, fake_connect):
+        """Las conexiones que superan max_lifetime no vuelven al pool."""
+        pool = ConnectionPool('DSN=test', max_size=1, max_lifetime=0.0001)
+        conn = pool.acquire()
+        raw = conn._raw
+        threading.Event().wait(0.01)
+        conn.close()
+        raw.close.assert_called_once()
+        assert pool.stats()['idle'] == 0
+
+    def test_dead_connection_replaced_after_ping(self, fake_connect):
+        """Una conexión ociosa que falla el SELECT 1 se sustituye por otra nueva."""
+        pool = ConnectionPool('DSN=test', max_size=1, ping_interval=0)
+        conn = pool.acquire()
+        raw = conn._raw
+        conn.close()
+        raw.cursor.side_effect = Exception('conexión perdida')
+
+        conn2 = pool.acquire()
+        assert conn2._raw is not raw
+        assert fake_connect.call_count == 2
+        assert pool.stats()['ping_failures'] == 1
+
+
+class TestPoolStatsEndpoint:
+    def test_pool_stats_requires_auth(self, client):
+        """GET /api/db-info/pool-stats sin sesión devuelve 401."""
+        response = client.get('/api/db-info/pool-stats')
+        assert response.status_code == 401
+
+    def test_pool_stats_requires_superuser(self, admin_client):
+        """GET /api/db-info/pool-stats con rol administrador devuelve 403."""
+        response = admin_client['client'].get('/api/db-info/pool-stats')
+        assert response.status_code == 403
+
+    def test_pool_stats(self, superuser_client):
+        """GET /api/db-info/pool-stats devuelve estadísticas de pool central y de empresas."""
+        response = superuser_client['client'].get('/api/db-info/pool-stats')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert 'central' in data
+        assert isinstance(data['empresas'], list)
@@ -0,0 +1,120 @@
+"""Tests del índice vectorial de la búsqueda visual (utils/embedding_index.py)."""
+import numpy as np
+
+from utils import embedding_index
+from utils.embedding_index import EmbeddingIndex
+
+
+def _brute_force(codigos, imagen_ids, matrix, query, k):
+    """Referencia: coseno fila a fila, orden descendente y dedupe por código."""
+    scores = []
+    for codigo, imagen_id, vec in zip(codigos, imagen_ids, matrix):
+        denom = np.linalg.norm(vec) * np.linalg.norm(query)
+        scores.append((codigo, imagen_id, float(np.dot(vec, query) / denom) if denom else 0.0))
+    scores.sort(key=lambda x: x[2], reverse=True)
+    seen, deduped = set(), []
+    for codigo, imagen_id, sim in scores:
+        if codigo not in seen:
+            seen.add(codigo)
+            deduped.append((codigo, imagen_id, sim))
+    return deduped[:k]
+
+
+class TestEmbeddingIndex:
+    def test_top_k_matches_brute_force(self):
+        """top_k coincide con el cálculo vector a vector (dedupe por código incluido)."""
+        rng = np.random.default_rng(0)
+        n = 500
+        matrix = rng.random((n, 32), dtype=np.float32)
+        codigos = [f'ART{i % 120:04d}' for i in range(n)]
+        imagen_ids = list(range(n))
+        query = rng.random(32, dtype=np.float32)
+
+        index = EmbeddingIndex(codigos, imagen_ids, matrix)
+        got = index.top_k(query, 20)
+        expected = _brute_force(codigos, imagen_ids, matrix, query, 20)
+
+        assert [g[0] for g in got] == [e[0] for e in expected]
+        assert [g[1] for g in got] == [e[1] for e in expected]
+        np.testing.assert_allclose([g[2] for g in got], [e[2] for e in expected], rtol=1e-5)
+
+    def test_zero_vectors_score_zero(self):
+        """Filas con norma 0 puntúan 0 en lugar de NaN."""
+        matrix = np.array([[0, 0], [1, 0]], dtype=np.float32)
+        index = EmbeddingIndex(['A', 'B'], [1, 2], matrix)
+        got = index.top_k(np.array([1, 0], dtype=np.float32), 5)
+        assert got[0][:2] == ('B', 2)
+        assert got[1] == ('A', 1, 0.0)
+
+    def test_empty_index(self):
+        """Un índice vacío es falsy y no devuelve resultados."""
+        index = EmbeddingIndex.from_rows([])
+        assert not index
+        assert index.top_k(np.ones(4, dtype=np.float32), 5) == []
+
+
+class TestEmbeddingIndexOnDisk:
+    def _index(self):
+        rng = np.random.default_rng(1)
+        matrix = rng.random((50, 8), dtype=np.float32)
+        codigos = [f'ART{i % 7}' for i in range(50)]
+        return EmbeddingIndex(codigos, list(range(50)), matrix)
+
+    def test_save_and_load_memmap(self, tmp_path):
+        """El índice guardado se abre como memmap y devuelve los mismos resultados."""
+        index = self._index()
+        manifest = embedding_index.save_index(index, '1_1', 3, directory=str(tmp_path))
+        assert embedding_index.read_manifest('1_1', directory=str(tmp_path)) == manifest
+
+        loaded = embedding_index.load_index(manifest, directory=str(tmp_path))
+        assert isinstance(loaded.matrix, np.memmap)
+        query = np.ones(8, dtype=np.float32)
+        assert loaded.top_k(query, 5) == index.top_k(query, 5)
+
+    def test_new_generation_replaces_old_files(self, tmp_path):
+        """Una nueva generación sustituye el manifiesto y borra los ficheros anteriores."""
+        index = self._index()
+        first = embedding_index.save_index(index, '1_1', 3, directory=str(tmp_path))
+        second = embedding_index.save_index(index, '1_1', 3, directory=str(tmp_path))
+
+        assert first['generation'] != second['generation']
+        assert not (tmp_path / first['matrix']).exists()
+        assert (tmp_path / second['matrix']).exists()
+
+    def test_remove_index(self, tmp_path):
+        """remove_index elimina manifiesto y datos."""
+        embedding_index.save_index(self._index(), '1_1', 3, directory=str(tmp_path))
+        embedding_index.remove_index('1_1', directory=str(tmp_path))
+        assert embedding_index.read_manifest('1_1', directory=str(tmp_path)) is None
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestIVFPQ:
+    def test_recall_against_exact_search(self):
+        """El índice aproximado recupera casi todos los códigos de la búsqueda exacta."""
+        from utils.ann_index import IVFPQIndex, recall_at_k
+
+        rng = np.random.default_rng(0)
+        centers = rng.random((40, 64), dtype=np.float32)
+        labels = rng.integers(0, 40, 2000)
+        matrix = centers[labels] + rng.normal(0, 0.1, (2000, 64)).astype(np.float32)
+        index = EmbeddingIndex([f'ART{i // 2}' for i in range(2000)], range(2000), matrix)
+        index.ann = IVFPQIndex.train(index.matrix, index.norms, iters=5)
+
+        queries = matrix[rng.choice(2000, 20, replace=False)]
+        result = recall_at_k(index, queries, k=10, nprobe=8)
+        assert result['recall'] >= 0.9
+
+    def test_ann_persisted_with_index(self, tmp_path):
+        """El índice aproximado se guarda y se carga junto a la matriz."""
+        from utils.ann_index import IVFPQIndex
+
+        rng = np.random.default_rng(0)
+        matrix = rng.random((300, 16), dtype=np.float32)
+        index = EmbeddingIndex([f'ART{i}' for i in range(300)], range(300), matrix)
+        index.ann = IVFPQIndex.train(index.matrix, index.norms, iters=3)
+
+        manifest = embedding_index.save_index(index, '1_1', 3, directory=str(tmp_path))
+        loaded = embedding_index.load_index(manifest, directory=str(tmp_path))
+        query = matrix[5]
+        assert loaded.top_k(query, 5, use_ann=True) == index.top_k(query, 5, use_ann=True)
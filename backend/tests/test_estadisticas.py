@@ -95,3 +95,300 @@ class TestEstadisticasEndpoints:
         response = admin_client['client'].get('/api/estadisticas/propuestas-por-dia?dias=7')
         assert response.status_code == 200
         mock_get.assert_called_once()
+
+    @patch('models.estadisticas_model.EstadisticasModel.get_logins_por_ubicacion')
+    @patch('models.estadisticas_model.EstadisticasModel.get_propuestas_por_periodo')
+    @patch('models.estadisticas_model.EstadisticasModel.get_resumen')
+    def test_dashboard_batched(self, mock_resumen, mock_periodo, mock_logins, admin_client):
+        """GET /api/estadisticas/dashboard devuelve varios widgets en una respuesta y cachea cada uno."""
+        from utils.pagination import CountCache
+        mock_resumen.return_value = {'total_propuestas': 10}
+        mock_periodo.return_value = [{'fecha': '2026-05-04', 'cantidad': 2, 'total_items': 5}]
+        mock_logins.side_effect = Exception('BD caída')
+        url = ('/api/estadisticas/dashboard?widgets=resumen,propuestas-por-dia,logins-por-ubicacion'
+               '&dias=400&propuestas-por-dia.dias=7')
+        with patch('routes.estadisticas_routes.dashboard_cache', CountCache(ttl=30)):
+            response = admin_client['client'].get(url)
+            assert response.status_code == 200
+            body = response.get_json()
+            assert body['data']['resumen'] == {'total_propuestas': 10}
+            assert body['data']['propuestas-por-dia'] == mock_periodo.return_value
+            assert body['data']['logins-por-ubicacion'] is None
+            assert body['errors'] == {'logins-por-ubicacion': 'BD caída'}
+            mock_periodo.assert_called_once_with('1', dias=7)
+            mock_logins.assert_called_once_with('1', dias=365)
+
+            admin_client['client'].get(url)
+            assert mock_resumen.call_count == 1 and mock_periodo.call_count == 1
+            assert mock_logins.call_count == 2  # los errores no se cachean
+
+    def test_dashboard_widget_desconocido(self, admin_client):
+        """Un widget que no existe devuelve 400."""
+        response = admin_client['client'].get('/api/estadisticas/dashboard?widgets=resumen,precios')
+        assert response.status_code == 400
+
+
+class TestArticuloVistas:
+    def test_hyperloglog(self):
+        """Estimación de distintos con error pequeño; la unión de sketches no cuenta dos veces."""
+        from utils.view_counter import HyperLogLog
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(5000):
+            a.add(i)
+        for i in range(2500, 7500):
+            b.add(i)
+        assert abs(a.count() - 5000) < 5000 * 0.1
+        union = HyperLogLog(a.to_bytes()).merge(b)
+        assert abs(union.count() - 7500) < 7500 * 0.1
+
+        small = HyperLogLog()
+        for user in [1, 2, 3, 2, 1]:
+            small.add(user)
+        assert small.count() == 3
+
+    def test_counter_aggregates_and_retries(self):
+        """Las vistas se agregan por clave y día; un volcado fallido vuelve a lo pendiente."""
+        from datetime import datetime
+        from utils.view_counter import HyperLogLog, ViewCounter
+        write = MagicMock(side_effect=[ConnectionError('BD caída'), None])
+        counter = ViewCounter(write, interval=60)
+        when = datetime(2026, 5, 4, 10, 0)
+        with patch.object(counter, '_ensure_thread'):
+            counter.add(1, '1', 'A100', user_id=7, when=when)
+            counter.add(1, '1', 'A100', user_id=7, when=when.replace(hour=12))
+            counter.add(1, '1', 'A100', user_id=None, when=when)
+            assert not counter.flush()
+            counter.add(1, '1', 'A100', user_id=8, when=when)
+            assert counter.flush()
+
+        (tenant, batch), _ = write.call_args
+        [(empresa, codigo, dia, vistas, hll, ultima)] = batch
+        assert (tenant, empresa, codigo, dia, vistas) == (1, '1', 'A100', when.date(), 4)
+        assert HyperLogLog(hll).count() == 2 and ultima == when.replace(hour=12)
+
+    def test_write_batch_merges_existing_sketch(self):
+        """El volcado suma a la fila existente fusionando usuarios y crea las nuevas."""
+        from datetime import date, datetime
+        from models.articulo_vista_model import ArticuloVistaModel
+        from utils.view_counter import HyperLogLog
+        previo, nuevo = HyperLogLog(), HyperLogLog()
+        previo.add(1)
+        nuevo.add(1)
+        nuevo.add(2)
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [('A100 ', previo.to_bytes())]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        ahora = datetime(2026, 5, 4, 10, 0)
+        with patch('models.articulo_vista_model.Database.get_connection', return_value=conn):
+            ArticuloVistaModel._write_batch(3, [('1', 'A100', date(2026, 5, 4), 2, nuevo.to_bytes(), ahora),
+                                                ('1', 'B200', date(2026, 5, 4), 1, nuevo.to_bytes(), ahora)])
+
+        (update_sql, updates), (insert_sql, inserts) = [c.args for c in cursor.executemany.call_args_list]
+        assert 'UPDATE articulo_vistas_dia' in update_sql and 'INSERT INTO articulo_vistas_dia' in insert_sql
+        assert updates[0][0] == 2 and updates[0][2] == 2 and updates[0][-1] == 'A100'
+        assert inserts[0][:5] == ('1', 'B200', date(2026, 5, 4), 1, 2)
+        conn.commit.assert_called_once()
+
+    def test_write_batch_codes_case_insensitive(self):
+        """'abc' y 'ABC' son la misma fila (clave primaria CI): se suman, no se insertan dos veces."""
+        from datetime import date, datetime
+        from models.articulo_vista_model import ArticuloVistaModel
+        from utils.view_counter import HyperLogLog
+        sketch = HyperLogLog()
+        sketch.add(1)
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [('ABC ', None)]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        ahora = datetime(2026, 5, 4, 10, 0)
+        with patch('models.articulo_vista_model.Database.get_connection', return_value=conn):
+            ArticuloVistaModel._write_batch(3, [('1', 'abc', date(2026, 5, 4), 2, sketch.to_bytes(), ahora),
+                                                ('1', 'ABC', date(2026, 5, 4), 1, sketch.to_bytes(), ahora)])
+
+        [(update_sql, updates)] = [c.args for c in cursor.executemany.call_args_list]
+        assert len(updates) == 1 and updates[0][0] == 3 and updates[0][2] == 1
+
+    def test_mas_vistos_from_rollup(self):
+        """Más vistos: suma de vistas por código y usuarios de la unión de los sketches diarios."""
+        from datetime import datetime
+        from models.articulo_vista_model import ArticuloVistaModel
+        from utils.view_counter import HyperLogLog
+        dia1, dia2 = HyperLogLog(), HyperLogLog()
+        dia1.add(1)
+        dia2.add(1)
+        dia2.add(2)
+        ultima = datetime(2026, 5, 4, 10, 0)
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [('A100 ', 9, ultima), ('B200', 4, ultima)],
+            [('A100', dia1.to_bytes(), 1), ('A100', dia2.to_bytes(), 2), ('B200', None, 3)],
+        ]
+        assert ArticuloVistaModel.get_mas_vistos(cursor, '1') == [('A100', 9, 2, ultima), ('B200', 4, 3, ultima)]
+        assert 'audit_log' not in cursor.execute.call_args_list[0].args[0]
+
+    def test_view_endpoint_counts_in_memory(self, admin_client):
+        """POST /api/stocks/<codigo>/view suma al contador sin escribir en audit_log."""
+        from utils.view_counter import ViewCounter
+        counter = ViewCounter(MagicMock(), interval=60)
+        with patch('models.articulo_vista_model.view_counter', counter), \
+                patch.object(counter, '_ensure_thread'), \
+                patch('models.audit_model.AuditModel.log') as log:
+            response = admin_client['client'].post('/api/stocks/A100/view')
+        assert response.status_code == 200 and response.get_json() == {'ok': True}
+        assert counter.stats()['views'] == 1
+        log.assert_not_called()
+
+    def test_registrar_sin_connection_escribe_solo_esa_vista(self, app):
+        """Sin connection se escribe solo esa vista (BD de la sesión); lo pendiente de otros tenants no se vuelca."""
+        from models.articulo_vista_model import ArticuloVistaModel
+        from utils.view_counter import ViewCounter
+        counter = ViewCounter(MagicMock(), interval=60)
+        with app.test_request_context(), \
+                patch('models.articulo_vista_model.view_counter', counter), \
+                patch.object(counter, '_ensure_thread'), \
+                patch.object(ArticuloVistaModel, '_write_batch') as write:
+            counter.add(5, '1', 'B200')
+            ArticuloVistaModel.registrar('A100', '1', user_id=7)
+
+        [(connection_id, [entrada])] = [c.args for c in write.call_args_list]
+        assert connection_id is None and entrada[:2] == ('1', 'A100') and entrada[3] == 1
+        assert counter.stats()['pending'] == 1
+        counter.write_batch.assert_not_called()
+
+
+class TestEstadisticasResumen:
+    def test_actualizar_por_tramos_desde_la_marca(self):
+        """Solo se suman los ids posteriores a la marca, por tramos, y la marca avanza con cada uno."""
+        from models.estadisticas_resumen_model import EstadisticasResumenModel
+        cursor = MagicMock()
+        cursor.fetchone.side_effect = [
+            (120000,), None, (50000,), (100000,), (120000,),   # audit_log: límite y marcas
+            None, None,                                        # propuestas: vacía
+        ]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        with patch.object(EstadisticasResumenModel, '_actualizado', {}):
+            sumadas = EstadisticasResumenModel.actualizar(conn, tenant='t')
+            assert EstadisticasResumenModel.actualizar(conn, tenant='t') is None  # dentro del intervalo
+
+        assert sumadas == {'audit_resumen_hora': 120000, 'propuestas_resumen_dia': 0}
+        merges = [c.args[1] for c in cursor.execute.call_args_list if 'MERGE' in c.args[0]]
+        assert merges == [(0, 50000), (50000, 100000), (100000, 120000)]
+        marcas = [c.args[1] for c in cursor.execute.call_args_list if 'estadisticas_watermark SET' in c.args[0]
+                  or 'INSERT INTO estadisticas_watermark' in c.args[0]]
+        assert marcas == [('audit_resumen_hora', 50000), (100000, 'audit_resumen_hora'),
+                          (120000, 'audit_resumen_hora')]
+
+    def test_actualizar_error_no_rompe_lectura(self):
+        """Si falla la actualización se deshace el tramo y se reintenta en la siguiente lectura."""
+        from models.estadisticas_resumen_model import EstadisticasResumenModel
+        conn = MagicMock()
+        conn.cursor.return_value.execute.side_effect = Exception('tabla no existe')
+        with patch.object(EstadisticasResumenModel, '_actualizado', {}) as actualizado:
+            assert EstadisticasResumenModel.actualizar(conn, tenant='t') == {}
+            assert 't' not in actualizado
+        conn.rollback.assert_called_once()
+
+    def test_actualizar_concurrente_espera(self):
+        """Mientras un hilo actualiza, otro del mismo tenant espera a que acabe y no repite el trabajo."""
+        import threading
+        from models.estadisticas_resumen_model import EstadisticasResumenModel
+        dentro, seguir = threading.Event(), threading.Event()
+        llamadas = []
+
+        def lento(conn, cursor, nombre, origen, merge):
+            llamadas.append(nombre)
+            dentro.set()
+            seguir.wait(5)
+            return 0
+
+        resultados = []
+        with patch.object(EstadisticasResumenModel, '_actualizado', {}) as actualizado, \
+                patch.object(EstadisticasResumenModel, '_en_curso', {}), \
+                patch.object(EstadisticasResumenModel, '_actualizar_resumen', side_effect=lento):
+            primero = threading.Thread(target=lambda: EstadisticasResumenModel.actualizar(MagicMock(), 't'))
+            primero.start()
+            assert dentro.wait(5)
+            assert 't' not in actualizado  # aún no se marca: la actualización no ha terminado
+            segundo = threading.Thread(
+                target=lambda: resultados.append(EstadisticasResumenModel.actualizar(MagicMock(), 't')))
+            segundo.start()
+            seguir.set()
+            primero.join(5)
+            segundo.join(5)
+            assert 't' in actualizado
+
+        assert resultados == [None] and llamadas == ['audit_resumen_hora', 'propuestas_resumen_dia']
+
+    @patch('models.estadisticas_model.EstadisticasResumenModel.actualizar')
+    def test_actividad_desde_resumen(self, mock_actualizar):
+        """Las estadísticas de actividad leen el resumen por hora, no audit_log."""
+        from models.estadisticas_model import EstadisticasModel
+        conn = MagicMock()
+        conn.cursor.return_value.fetchall.return_value = [(9, 40), (10, 12)]
+        with patch('models.estadisticas_model.Database.get_connection', return_value=conn):
+            data = EstadisticasModel.get_actividad_por_hora('1', dias=7)
+        assert data == [{'hora': 9, 'total': 40}, {'hora': 10, 'total': 12}]
+        sql, params = conn.cursor.return_value.execute.call_args.args
+        assert 'FROM audit_resumen_hora' in sql and 'audit_log' not in sql
+        assert params == ('1', '1', -7, -7, -7)
+        mock_actualizar.assert_called_once_with(conn)
+
+
+class TestLoginUbicacion:
+    def test_registrar_en_login(self):
+        """El login suma a su ubicación redondeada; las IPs locales no cuentan para el mapa."""
+        from decimal import Decimal
+        from models.login_ubicacion_model import LoginUbicacionModel
+        conn = MagicMock()
+        with patch('models.login_ubicacion_model.Database.get_connection', return_value=conn):
+            assert LoginUbicacionModel.registrar(3, '1', 7, 'ana', {
+                'lat': 40.41678, 'lon': -3.70379, 'pais': 'España', 'ciudad': 'Madrid', 'pais_codigo': 'ES'})
+            assert not LoginUbicacionModel.registrar(3, '1', 7, 'ana', {'pais_codigo': 'LO', 'pais': 'Local'})
+
+        sql, params = conn.cursor.return_value.execute.call_args.args
+        assert 'MERGE login_ubicacion_dia' in sql
+        assert params == ('1', None, Decimal('40.42'), Decimal('-3.7'), 'ana', 1, 7, 'España', 'Madrid', 1)
+        conn.commit.assert_called_once()
+
+    def test_historico_una_vez(self):
+        """Los logins anteriores se pasan desde audit_log una sola vez, agrupados."""
+        import json
+        from models.login_ubicacion_model import LoginUbicacionModel
+        madrid = json.dumps({'ubicacion': {'lat': 40.41, 'lon': -3.70, 'pais': 'España', 'ciudad': 'Madrid'}})
+        cursor = MagicMock()
+        cursor.fetchone.side_effect = [(90,), (0,)]
+        cursor.fetchall.return_value = [
+            (90, '2026-05-04', '1', 7, 'ana', madrid),
+            (80, '2026-05-04', '1', 7, 'ana', madrid),
+            (70, '2026-05-04', '1', 8, 'luis', '{no json'),
+        ]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        with patch.object(LoginUbicacionModel, '_completados', set()), \
+                patch('models.login_ubicacion_model.Database.get_connection', return_value=conn):
+            LoginUbicacionModel.completar_historico(3)
+            LoginUbicacionModel.completar_historico(3)
+
+        [filas] = [c.args[1] for c in cursor.executemany.call_args_list]
+        assert len(filas) == 1 and filas[0][4:6] == ('ana', 2)
+        assert cursor.fetchall.call_count == 1
+        assert cursor.execute.call_args_list[-2].args[1] == (0, 'login_ubicacion_historico')
+
+    def test_mapa_desde_resumen(self):
+        """El mapa agrupa el resumen por ubicación sin leer audit_log."""
+        from decimal import Decimal
+        from models.estadisticas_model import EstadisticasModel
+        conn = MagicMock()
+        conn.cursor.return_value.fetchall.return_value = [
+            (Decimal('40.42'), Decimal('-3.70'), 'España', 'Madrid', 'luis', 1),
+            (Decimal('40.42'), Decimal('-3.70'), 'España', 'Madrid', 'ana', 3),
+        ]
+        with patch('models.estadisticas_model.Database.get_connection', return_value=conn), \
+                patch('models.estadisticas_model.LoginUbicacionModel.completar_historico') as historico:
+            data = EstadisticasModel.get_logins_por_ubicacion('1', dias=30)
+        historico.assert_not_called()  # el histórico se pasa en el login, no al leer
+        assert data == [{'lat': 40.42, 'lon': -3.7, 'pais': 'España', 'ciudad': 'Madrid',
+                         'total_logins': 4, 'usuarios': ['ana', 'luis']}]
+        assert 'audit_log' not in conn.cursor.return_value.execute.call_args.args[0]
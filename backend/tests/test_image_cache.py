@@ -0,0 +1,128 @@
+"""Tests de la cache en disco de imágenes derivadas (utils/image_cache.py)."""
+import base64
+import io
+import os
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from models.imagen_model import ImagenModel
+from utils.image_cache import DerivedImageCache
+
+
+def _jpeg(width=800, height=600):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 120, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class TestDerivedImageCache:
+    def test_new_version_replaces_old(self, tmp_path):
+        """Al cambiar la imagen origen (nueva versión) la derivada anterior se borra."""
+        cache = DerivedImageCache(str(tmp_path))
+        cache.put('1_01', 7, 'w400.jpg', '100-aa', b'old')
+        cache.put('1_01', 7, 'w400.jpg', '120-bb', b'new')
+
+        assert cache.get('1_01', 7, 'w400.jpg', '100-aa') is None
+        assert cache.get('1_01', 7, 'w400.jpg', '120-bb') == b'new'
+        assert len(os.listdir(os.path.dirname(cache.path('1_01', 7, 'w400.jpg', '120-bb')))) == 1
+
+    def test_lru_eviction_by_size(self, tmp_path):
+        """Superado el tamaño máximo se borran las derivadas menos usadas."""
+        cache = DerivedImageCache(str(tmp_path), max_bytes=250)
+        for i in range(3):
+            cache.put('t', i, 'w400.jpg', 'v', b'x' * 100)
+            os.utime(cache.path('t', i, 'w400.jpg', 'v'), (1000 + i, 1000 + i))
+        cache.put('t', 3, 'w400.jpg', 'v', b'x' * 100)
+
+        assert cache.get('t', 0, 'w400.jpg', 'v') is None
+        assert cache.get('t', 3, 'w400.jpg', 'v') is not None
+        assert cache.stats()['size_bytes'] <= 250
+
+
+class TestGridThumbnails:
+    def test_cache_hit_skips_blob(self, app, tmp_path):
+        """La segunda petición 'grid' solo lee metadatos: el BLOB no se vuelve a pedir."""
+        cursor = MagicMock()
+        metadata = [(7, 'ART1 ', 12345, b'\x01\x02', None)]
+        cursor.fetchall.side_effect = [metadata, [(7, _jpeg())], metadata]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        with app.test_request_context(), \
+                patch('models.imagen_model.Database.get_connection', return_value=conn), \
+                patch('models.imagen_model.derived_images', DerivedImageCache(str(tmp_path))):
+            first = ImagenModel.get_thumbnails_batch(['ART1'], quality='grid', empresa_id='1')
+            second = ImagenModel.get_thumbnails_batch(['ART1'], quality='grid', empresa_id='1')
+
+        assert first == second
+        assert list(first) == ['ART1']
+        blob_queries = [c for c in cursor.execute.call_args_list if 'SELECT id, imagen' in c.args[0]]
+        assert len(blob_queries) == 1
+        assert Image.open(io.BytesIO(base64.b64decode(first['ART1']))).width == 400
+
+
+class TestDerivatives:
+    def test_render_all_sizes_and_formats(self):
+        """render_all genera cada tamaño en cada formato sin ampliar imágenes pequeñas."""
+        from utils.image_derivatives import DERIVATIVE_FORMATS, render_all
+
+        variants = render_all(_jpeg(800, 600), formats=['webp', 'jpg'])
+        assert set(variants) == {f'{s}.{f}' for s in ('thumb', 'grid', 'detail') for f in ('webp', 'jpg')}
+        assert Image.open(io.BytesIO(variants['thumb.webp'])).format == 'WEBP'
+        assert Image.open(io.BytesIO(variants['grid.jpg'])).size == (400, 300)
+        assert Image.open(io.BytesIO(variants['detail.jpg'])).width == 800
+        assert 'jpg' in DERIVATIVE_FORMATS
+
+    def test_negotiate_format(self):
+        """Solo se sirve WebP/AVIF si el cliente lo declara explícitamente en Accept."""
+        from werkzeug.datastructures import MIMEAccept
+        from utils.image_derivatives import negotiate_format
+
+        formats = ['avif', 'webp', 'jpg']
+        assert negotiate_format(MIMEAccept([('image/avif', 1), ('image/webp', 1), ('*/*', 0.8)]), formats) == 'avif'
+        assert negotiate_format(MIMEAccept([('image/webp', 1), ('*/*', 0.8)]), formats) == 'webp'
+        assert negotiate_format(MIMEAccept([('image/*', 1)]), formats) == 'jpg'
+
+    def test_generate_skips_existing(self, tmp_path):
+        """La generación en segundo plano solo lee el BLOB de imágenes sin derivadas."""
+        from models import imagen_model
+        from utils.image_derivatives import DERIVATIVE_FORMATS
+
+        cache = DerivedImageCache(str(tmp_path))
+        for size in ('thumb', 'grid', 'detail'):
+            for fmt in DERIVATIVE_FORMATS:
+                cache.put('1_01', 1, f'{size}.{fmt}', '100-0102', b'ya generada')
+
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(1, 100, b'\x01\x02'), (2, 200, b'\x03\x04')]
+        cursor.fetchone.side_effect = [(2, 'ART2', _jpeg()), None]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        with patch('models.imagen_model.Database.get_connection', return_value=conn), \
+                patch.object(imagen_model, 'derived_images', cache):
+            done, errors = ImagenModel.generate_derivatives('01', connection_id=1, workers=1)
+
+        assert (done, errors) == (1, 0)
+        blob_query = cursor.execute.call_args_list[-1]
+        assert 'imagen' in blob_query.args[0] and blob_query.args[1] == [2]
+        assert cache.get('1_01', 2, 'grid.jpg', '200-0304') is not None
+        assert cache.get('1_01', 2, 'detail.jpg', '200-0304') is None
+
+    def test_generate_stops_at_cache_budget(self, tmp_path):
+        """La precarga se para antes de llenar la cache (no expulsa sus propias derivadas)."""
+        from models import imagen_model
+
+        cache = DerivedImageCache(str(tmp_path), max_bytes=1)
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(1, 100, b'\x01'), (2, 200, b'\x02')]
+        cursor.fetchone.side_effect = [(1, 'ART1', _jpeg()), (2, 'ART2', _jpeg()), None]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        with patch('models.imagen_model.Database.get_connection', return_value=conn), \
+                patch.object(imagen_model, 'derived_images', cache):
+            done, errors = ImagenModel.generate_derivatives('01', connection_id=1, workers=1)
+
+        assert (done, errors) == (1, 0)
@@ -0,0 +1,169 @@
+"""Tests del modelo de búsqueda visual (escritura por lotes de embeddings)."""
+import numpy as np
+
+from models.image_search_model import EmbeddingWriter
+
+
+class TestEmbeddingWriter:
+    def test_batches_with_single_commit(self, mock_database):
+        """Los embeddings se insertan con executemany en lotes, un commit por lote."""
+        conn, cursor = mock_database['connection'], mock_database['cursor']
+        vec = np.ones(4, dtype=np.float32)
+
+        with EmbeddingWriter('1', batch_size=3) as writer:
+            for i in range(7):
+                writer.add(i, f'ART{i}', vec)
+
+        assert writer.written == 7
+        assert writer.batches == 3
+        assert cursor.executemany.call_count == 3
+        assert conn.commit.call_count == 3
+        assert cursor.fast_executemany is True
+        first_batch = cursor.executemany.call_args_list[0][0][1]
+        assert first_batch[0] == (0, 'ART0', '1', vec.tobytes(), 'cbir_unweighted')
+
+    def test_failed_batch_is_retried(self, mock_database):
+        """Si un lote falla se hace rollback y se reintenta."""
+        conn, cursor = mock_database['connection'], mock_database['cursor']
+        cursor.executemany.side_effect = [Exception('deadlock'), None]
+
+        writer = EmbeddingWriter('1', batch_size=10, retries=1)
+        writer.add(1, 'ART1', np.ones(4, dtype=np.float32))
+        writer.flush()
+
+        assert writer.written == 1
+        assert writer.failed == 0
+        conn.rollback.assert_called()
+
+    def test_batch_counted_as_failed_after_retries(self, mock_database):
+        """Tras agotar los reintentos, las filas del lote cuentan como fallidas."""
+        cursor = mock_database['cursor']
+        cursor.executemany.side_effect = Exception('tabla bloqueada')
+
+        writer = EmbeddingWriter('1', batch_size=10, retries=0)
+        writer.add(1, 'ART1', np.ones(4, dtype=np.float32))
+        writer.add(2, 'ART2', np.ones(4, dtype=np.float32))
+        writer.flush()
+
+        assert writer.written == 0
+        assert writer.failed == 2
+
+
+class TestWeightProfiles:
+    def test_default_weights_match_legacy_weighted_vectors(self):
+        """Ponderar en consulta da el mismo coseno que los vectores v3 ponderados al extraer."""
+        from models.image_search_model import (
+            FEATURE_BLOCK_OFFSETS, FEATURE_GROUPS, FEATURE_WEIGHTS, resolve_weights
+        )
+        from utils.embedding_index import EmbeddingIndex
+
+        rng = np.random.default_rng(0)
+        dims = int(FEATURE_BLOCK_OFFSETS[-1])
+
+        def unweighted(n):
+            m = rng.random((n, dims), dtype=np.float32)
+            for a, b in zip(FEATURE_BLOCK_OFFSETS[:-1], FEATURE_BLOCK_OFFSETS[1:]):
+                m[:, a:b] /= np.linalg.norm(m[:, a:b], axis=1, keepdims=True)
+            return m
+
+        matrix, query = unweighted(50), unweighted(1)[0]
+        w_dim = np.repeat([FEATURE_WEIGHTS[g] for g, _ in FEATURE_GROUPS], np.diff(FEATURE_BLOCK_OFFSETS))
+        legacy = EmbeddingIndex(range(50), range(50), matrix * w_dim)
+        index = EmbeddingIndex(range(50), range(50), matrix, block_offsets=FEATURE_BLOCK_OFFSETS)
+
+        np.testing.assert_allclose(
+            index.similarities(query, resolve_weights()),
+            legacy.similarities(query * w_dim),
+            rtol=1e-5
+        )
+
+    def test_resolve_weights_validation(self):
+        """Perfiles y grupos desconocidos o pesos negativos lanzan ValueError."""
+        import pytest
+        from models.image_search_model import resolve_weights
+
+        assert len(resolve_weights('texture-first', {'hog': 0.5})) == 8
+        with pytest.raises(ValueError):
+            resolve_weights('inexistente')
+        with pytest.raises(ValueError):
+            resolve_weights(None, {'inexistente': 1})
+        with pytest.raises(ValueError):
+            resolve_weights(None, {'hog': -1})
+        with pytest.raises(ValueError):
+            resolve_weights(['default'])
+        with pytest.raises(ValueError):
+            resolve_weights(None, [['hog', 1]])
+
+    def test_search_rejects_unknown_profile(self, admin_client):
+        """POST /api/image-search/search con perfil desconocido devuelve 400."""
+        response = admin_client['client'].post(
+            '/api/image-search/search',
+            json={'image': 'aGVsbG8=', 'weight_profile': 'inexistente'},
+            headers={'X-CSRF-Token': admin_client['csrf_token']}
+        )
+        assert response.status_code == 400
+
+    def test_search_rejects_malformed_weights(self, admin_client):
+        """POST /api/image-search/search con weights que no es un objeto devuelve 400."""
+        response = admin_client['client'].post(
+            '/api/image-search/search',
+            json={'image': 'aGVsbG8=', 'weights': [0.5]},
+            headers={'X-CSRF-Token': admin_client['csrf_token']}
+        )
+        assert response.status_code == 400
+
+
+class TestFastFeatures:
+    def test_fast_extractor_matches_reference(self):
+        """El extractor vectorizado produce el mismo vector que el de referencia."""
+        from models.image_search_model import extract_features_fast, extract_features_reference
+        from utils.fast_features import _sample_tiles
+
+        for image in _sample_tiles(3, size=300):
+            expected = extract_features_reference(image)
+            np.testing.assert_allclose(extract_features_fast(image), expected, atol=1e-5)
+
+    def test_uniform_lbp_matches_skimage(self):
+        """uniform_lbp coincide pixel a pixel con skimage (incluidos empates por interpolacion)."""
+        import cv2
+        from skimage.feature import local_binary_pattern
+        from utils.fast_features import uniform_lbp
+
+        gray = (np.random.default_rng(0).random((64, 64)) * 255).astype(np.uint8)
+        gray = cv2.GaussianBlur(gray, (7, 7), 0)
+        for radius in (1, 2, 3):
+            expected = local_binary_pattern(gray, 8 * radius, radius, method='uniform')
+            np.testing.assert_array_equal(uniform_lbp(gray, 8 * radius, radius), expected)
+
+
+class TestQueryFeatureCache:
+    def test_repeated_query_skips_extraction(self):
+        """La misma imagen solo se extrae una vez; el resto de consultas sale de cache."""
+        from unittest.mock import patch
+        from models import image_search_model
+        from utils.feature_cache import QueryFeatureCache
+
+        vec = np.arange(4, dtype=np.float32)
+        with patch.object(image_search_model, 'query_feature_cache', QueryFeatureCache(max_entries=2)), \
+                patch.object(image_search_model, 'extract_features', return_value=vec) as extract:
+            first, cached_first = image_search_model.extract_query_features(b'foto')
+            second, cached_second = image_search_model.extract_query_features(b'foto')
+
+        assert extract.call_count == 1
+        assert (cached_first, cached_second) == (False, True)
+        np.testing.assert_array_equal(first, second)
+
+    def test_lru_eviction_and_version_key(self):
+        """El LRU descarta la entrada menos usada y la clave incluye la version."""
+        from utils.feature_cache import QueryFeatureCache
+
+        cache = QueryFeatureCache(max_entries=2)
+        keys = [QueryFeatureCache.make_key(b, 4) for b in (b'a', b'b', b'c')]
+        cache.put(keys[0], np.zeros(2))
+        cache.put(keys[1], np.zeros(2))
+        cache.get(keys[0])
+        cache.put(keys[2], np.zeros(2))
+
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert QueryFeatureCache.make_key(b'a', 5) != keys[0]
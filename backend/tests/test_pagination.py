@@ -0,0 +1,147 @@
+"""Tests de la paginación por cursor (utils/pagination.py) en stocks y pedidos."""
+import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from utils.pagination import (CountCache, decode_cursor, encode_cursor, keyset_condition, listing_total,
+                              split_page)
+
+
+class TestCursor:
+    def test_roundtrip_and_order_check(self):
+        """El cursor conserva fechas y se rechaza si se usa con otra ordenación."""
+        fecha = datetime.datetime(2026, 3, 1, 10, 30)
+        token = encode_cursor('fecha:DESC', [fecha, 'A100', 2.5, None])
+        assert decode_cursor(token, 'fecha:DESC') == [fecha, 'A100', 2.5, None]
+        assert decode_cursor('', 'fecha:DESC') is None
+        with pytest.raises(ValueError):
+            decode_cursor(token, 'fecha:ASC')
+        with pytest.raises(ValueError):
+            decode_cursor('no-es-un-cursor', 'fecha:DESC')
+
+    def test_keyset_condition(self):
+        """(col, codigo) > (?, ?) expandido, con NULL primero en ASC y último en DESC."""
+        assert keyset_condition(['a', 'b'], [1, 'x']) == ("(a > ? OR (a = ? AND b > ?))", [1, 1, 'x'])
+        sql, params = keyset_condition(['a', 'b'], [1, 'x'], descending=True, nullable_first=True)
+        assert sql == "((a < ? OR (a = ? AND b < ?)) OR a IS NULL)" and params == [1, 1, 'x']
+        assert keyset_condition(['a', 'b'], [None, 'x'], nullable_first=True) == \
+            ("((a IS NULL AND b > ?) OR a IS NOT NULL)", ['x'])
+
+    def test_split_page_keeps_ties(self):
+        """La página incluye los empates de su última fila."""
+        rows = [(1, 'a'), (2, 'b'), (2, 'b'), (3, 'c')]
+        assert split_page(rows, 2, key=lambda r: r) == (rows[:3], True)
+        assert split_page(rows[:2], 2, key=lambda r: r) == (rows[:2], False)
+
+    def test_count_cache_ttl(self):
+        cache = CountCache(ttl=60)
+        count = MagicMock(return_value=42)
+        assert cache.get_or_count(('k',), count) == 42
+        assert cache.get_or_count(('k',), count) == 42
+        assert count.call_count == 1
+
+
+class TestListingTotal:
+    def test_total_reused_across_pages(self, app):
+        """El mismo filtro (sin distinguir mayúsculas) no vuelve a contar dentro del TTL."""
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (1234,)
+        cache = CountCache(ttl=60)
+        with app.test_request_context():
+            assert listing_total(cursor, 'v', 'v.x LIKE ?', ['%ABC%'], cache=cache) == (1234, True)
+            assert listing_total(cursor, 'v', 'v.x LIKE ?', ['%abc%'], cache=cache) == (1234, True)
+            assert listing_total(cursor, 'v', 'v.x LIKE ?', ['%abd%'], cache=cache) == (1234, True)
+        assert cursor.execute.call_count == 2
+        assert cache.stats()['hits'] == 1
+
+    def test_estimate(self, app):
+        """exact=False: conteo acotado ("al menos N") o último total exacto caducado."""
+        cursor = MagicMock()
+        cache = CountCache(ttl=0, stale_ttl=60)
+        with app.test_request_context(), patch('utils.pagination.COUNT_ESTIMATE_CAP', 100):
+            cursor.fetchone.return_value = (101,)
+            assert listing_total(cursor, 'v', '1=1', [], exact=False, cache=cache) == (100, False)
+            sql, params = cursor.execute.call_args.args
+            assert 'TOP (?)' in sql and params == [101]
+
+            cursor.fetchone.return_value = (5000,)
+            listing_total(cursor, 'v', '1=1', [], cache=cache)
+            executed = cursor.execute.call_count
+            assert listing_total(cursor, 'v', '1=1', [], exact=False, cache=cache) == (5000, False)
+            assert cursor.execute.call_count == executed
+
+
+class TestCursorQueries:
+    def test_stock_cursor_sql(self, app):
+        """Sin snapshot, la página siguiente es un TOP WITH TIES con keyset y sin COUNT."""
+        cursor = MagicMock()
+        cursor.fetchall.return_value = []
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        token = encode_cursor('descripcion:ASC', ['Gres', 'A100'])
+
+        with app.test_request_context(), \
+                patch('models.stock_model.SNAPSHOT_ENABLED', False), \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model.Database.get_connection', return_value=conn):
+            from models.stock_model import StockModel
+            result = StockModel.search({'calidad': 'EXTRA'}, limit=20, order_by='descripcion', cursor=token)
+
+        assert result == {'data': [], 'limit': 20, 'next_cursor': None, 'has_more': False,
+                          'total': None, 'total_exact': None}
+        assert cursor.execute.call_count == 1
+        sql, params = cursor.execute.call_args.args
+        assert 'TOP (?) WITH TIES' in sql and 'ORDER BY descripcion ASC, codigo ASC' in sql
+        assert params == [21, '1', '%EXTRA%', 'Gres', 'Gres', 'A100']
+
+    def test_invalid_cursor_returns_400(self, admin_client):
+        response = admin_client['client'].get('/api/stocks/search?cursor=xyz')
+        assert response.status_code == 400
+
+    def test_data_error_with_valid_cursor_is_not_400(self, admin_client):
+        """Un ValueError de los datos con un cursor válido no se confunde con un cursor no válido."""
+        token = encode_cursor('codigo:ASC', ['', 'A100'])
+        with patch('controllers.stock_controller.StockModel.search', side_effect=ValueError('dato')):
+            response = admin_client['client'].get(f'/api/stocks/search?cursor={token}')
+        assert response.status_code == 500
+
+    def test_pedidos_invalid_cursor_returns_400(self, admin_client):
+        with patch('routes.pedido_routes.PedidoModel.get_all') as get_all:
+            response = admin_client['client'].get('/api/pedidos?cursor=xyz')
+        assert response.status_code == 400
+        get_all.assert_not_called()
+
+    def test_pedidos_cursor_pages(self, app):
+        """Pedidos: la primera página cuenta y devuelve next_cursor; la siguiente no vuelve a contar."""
+        from models.pedido_model import PedidoModel
+
+        def row(pedido, fecha):
+            return (0, 1, 2026, pedido, fecha, None, 'C1', 'Cliente', '', 'A',
+                    100, 0, 100, 10, 'EUR', 'u', None, '', '', 1)
+
+        fecha = datetime.datetime(2026, 3, 1)
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (3,)
+        cursor.fetchall.side_effect = [[row(9, fecha), row(8, fecha), row(7, fecha)], [row(7, fecha)]]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        with app.test_request_context(), \
+                patch.object(PedidoModel, '_has_numpedcli', False), \
+                patch.object(PedidoModel, '_has_clientes_dir', False), \
+                patch('models.pedido_model.Database.get_connection', return_value=conn), \
+                patch('utils.pagination.count_cache', CountCache(ttl=60)):
+            first = PedidoModel.get_all(empresa_id='1', page_size=2, cursor='')
+            assert [p['pedido'] for p in first['pedidos']] == [9, 8]
+            assert first['total'] == 3 and first['has_more']
+
+            executed = cursor.execute.call_count
+            second = PedidoModel.get_all(empresa_id='1', page_size=2, cursor=first['next_cursor'])
+
+        assert [p['pedido'] for p in second['pedidos']] == [7]
+        assert second['total'] is None and not second['has_more'] and second['next_cursor'] is None
+        assert cursor.execute.call_count == executed + 1
+        sql, params = cursor.execute.call_args.args
+        assert '(v.fecha < ? OR (v.fecha = ? AND v.pedido < ?))' in sql
+        assert params[0] == 3 and params[-3:] == [fecha, fecha, 8]
@@ -0,0 +1,216 @@
+"""Tests del snapshot en memoria de view_externos_stock (utils/stock_snapshot.py)."""
+from unittest.mock import MagicMock, patch
+
+from models.stock_model import StockModel, _SnapshotSource
+from utils.stock_snapshot import SnapshotStore
+
+
+def _row(codigo, descripcion, formato, calidad, existencias):
+    return ('1', f'{codigo}  ', descripcion, calidad, 'BLANCO', 'T1', '2',
+            formato, 'SERIE', 'M2', 'EUR', 'C', 6, 40, existencias, None, 20, 800, 'PAV', 6)
+
+
+ROWS = [
+    _row('B200', 'Porcelánico Mate', '60X60', 'EXTRA', 120.0),
+    _row('A100', 'Gres Brillo', '30X60', 'COMERCIAL', None),
+    _row('C300', 'porcelanico brillo', '60X120', 'EXTRA', 15.5),
+    _row('a050', 'Azulejo', '20X20', '', 0),
+]
+
+
+class FakeSource:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.loads = []
+
+    def signatures(self):
+        sigs = {}
+        for row in self.rows:
+            sigs[row[1]] = (hash(row), 1)
+        return sigs
+
+    def load(self, codigos=None):
+        self.loads.append(codigos)
+        if codigos is None:
+            return list(self.rows)
+        return [r for r in self.rows if r[1] in codigos]
+
+    build = staticmethod(_SnapshotSource.build)
+
+
+def _snapshot(rows=ROWS):
+    return SnapshotStore(refresh=60).get('t', FakeSource(rows))
+
+
+class TestStockSnapshot:
+    def test_search_filters_sort_and_page(self):
+        """Filtros, orden (NULL primero, sin distinguir mayúsculas) y paginación como en SQL."""
+        snap = _snapshot()
+        condiciones = StockModel._parse_filtros({'calidad': 'ext', 'color': 'BLANCO'})
+        stocks, total = snap.search(condiciones, 'codigo')
+        assert total == 2 and [s['codigo'] for s in stocks] == ['B200', 'C300']
+
+        stocks, total = snap.search([], 'existencias', offset=0, limit=2)
+        assert total == 4
+        assert [s['codigo'] for s in stocks] == ['A100', 'a050']
+        assert stocks[0]['existencias'] == 0.0  # NULL se entrega como 0, igual que _row_to_stock
+
+        stocks, _ = snap.search([], 'codigo', descending=True)
+        assert [s['codigo'] for s in stocks] == ['C300', 'B200', 'A100', 'a050']
+
+        condiciones = StockModel._parse_filtros({'existencias__between': '10,200', 'codigo__neq': 'b200'})
+        assert [s['codigo'] for s in snap.search(condiciones, 'codigo')[0]] == ['C300']
+
+    def test_text_search(self):
+        """Búsqueda inteligente: sin acentos, todas las palabras, por subcadena o con erratas."""
+        snap = _snapshot()
+
+        def buscar(texto):
+            return sorted(s['codigo'] for s in snap.search(StockModel._parse_filtros({'descripcion': texto}),
+                                                           'codigo')[0])
+
+        assert buscar('PORCELANICO') == ['B200', 'C300']
+        assert buscar('porcel 60x') == ['B200', 'C300']
+        assert buscar('brillo 30x') == ['A100']
+        assert buscar('porcelanco mate') == ['B200']
+        assert buscar('a05') == ['a050']
+        assert buscar('zzz') == []
+
+    def test_distinct_get_and_aggregate(self):
+        """Valores únicos sin vacíos, búsqueda por código y resumen ignorando NULL."""
+        snap = _snapshot()
+        assert snap.distinct('calidad', 100) == ['COMERCIAL', 'EXTRA']
+        assert snap.get('c300 ')['descripcion'] == 'porcelanico brillo'
+        assert snap.get('ZZZ') is None
+        assert snap.aggregate('existencias') == (4, 135.5, 135.5 / 3, 0.0, 120.0)
+
+    def test_facets(self):
+        """Valores con recuento de varias columnas sobre las filas filtradas, sin NULL ni vacíos."""
+        snap = _snapshot(ROWS + [_row('C300', 'porcelanico brillo', '60x120 ', 'EXTRA', 3.0)])
+        total, facetas = snap.facets(StockModel._parse_filtros({'descripcion': 'porcelanico'}),
+                                     ['formato', 'calidad', 'existencias'], 10)
+        assert total == 3
+        assert facetas == {
+            'formato': [('60X120', 2), ('60X60', 1)],
+            'calidad': [('EXTRA', 3)],
+            'existencias': [(3.0, 1), (15.5, 1), (120.0, 1)],
+        }
+        assert snap.facets([], ['calidad'], 1)[1] == {'calidad': [('COMERCIAL', 1)]}
+
+    def test_incremental_refresh_reloads_changed_codes(self):
+        """El refresco solo relee las filas de los códigos cuya firma ha cambiado."""
+        source = FakeSource(ROWS)
+        store = SnapshotStore(refresh=0, max_age=3600)
+        first = store.get('t', source)
+
+        source.rows[0] = _row('B200', 'Porcelánico Mate', '60X60', 'EXTRA', 80.0)
+        source.rows.pop(1)
+        # El refresco va en segundo plano: mientras, se sirve el snapshot anterior
+        assert store.get('t', source) is first
+        store.wait('t', timeout=5)
+        second = store.get('t', source)
+
+        assert source.loads == [None, ['B200  ']]
+        assert len(second) == 3 and second.get('B200')['existencias'] == 80.0
+        assert first.get('B200')['existencias'] == 120.0  # el snapshot anterior no se modifica
+        store.wait('t', timeout=5)
+        assert store.get('t', source) is second  # sin cambios: mismo snapshot
+
+
+class TestStockModelSnapshot:
+    def test_search_served_from_memory(self, app):
+        """Con snapshot, search() no consulta la vista; LIKE sobre números vuelve a SQL."""
+        source = FakeSource(ROWS)
+        with app.test_request_context(), \
+                patch('models.stock_model.stock_snapshots', SnapshotStore(refresh=60)) as store, \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model._SnapshotSource', return_value=source), \
+                patch('models.stock_model.Database.get_connection') as get_connection:
+            cursor = MagicMock()
+            cursor.fetchone.return_value = (0,)
+            cursor.fetchall.return_value = []
+            get_connection.return_value.cursor.return_value = cursor
+
+            result = StockModel.search({'formato': '60x'}, page=1, limit=1, order_by='existencias',
+                                       order_dir='DESC')
+            assert result['total'] == 2 and result['pages'] == 2
+            assert result['data'][0]['codigo'] == 'B200'
+            assert StockModel.get_resumen()['total_productos'] == 4
+            get_connection.assert_not_called()
+
+            StockModel.search({'existencias__contains': '5'})
+            assert 'LIKE' in cursor.execute.call_args.args[0]
+
+            # Si otro filtro obliga a ir a SQL, la búsqueda de texto llega ya resuelta a códigos
+            StockModel.search({'existencias__contains': '5', 'descripcion': 'porcelanico'})
+            sql, params = cursor.execute.call_args.args
+            assert 'codigo IN (?,?)' in sql and params[-2:] == ['B200', 'C300']
+            assert store.stats()['full'] == 1
+
+    def test_cursor_pages_cover_all_rows(self, app):
+        """Con cursor, las páginas concatenadas dan todas las filas una vez (también con códigos repetidos)."""
+        rows = ROWS + [_row('B200', 'Porcelánico Mate', '60X60', 'EXTRA', 120.0)]
+        with app.test_request_context(), \
+                patch('models.stock_model.stock_snapshots', SnapshotStore(refresh=60)), \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model._SnapshotSource', return_value=FakeSource(rows)):
+            for order_dir in ('ASC', 'DESC'):
+                full = StockModel.search({}, order_by='existencias', order_dir=order_dir)
+                seen, token = [], ''
+                while token is not None:
+                    page = StockModel.search({}, limit=1, order_by='existencias', order_dir=order_dir,
+                                             cursor=token)
+                    seen.extend(page['data'])
+                    token = page['next_cursor']
+                assert seen == full
+
+    def test_facetas_endpoint(self, admin_client):
+        """Una sola petición devuelve las facetas de varias columnas con los filtros activos."""
+        with patch('models.stock_model.stock_snapshots', SnapshotStore(refresh=60)), \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model._SnapshotSource', return_value=FakeSource(ROWS)):
+            response = admin_client['client'].get('/api/stocks/facetas?calidad=extra&columnas=formato,calidad')
+            assert response.status_code == 200
+            assert response.get_json() == {
+                'total': 2,
+                'facetas': {
+                    'formato': [{'valor': '60X120', 'total': 1}, {'valor': '60X60', 'total': 1}],
+                    'calidad': [{'valor': 'EXTRA', 'total': 2}],
+                },
+            }
+            assert admin_client['client'].get('/api/stocks/facetas?columnas=precio').status_code == 400
+
+    def test_facetas_sql(self):
+        """Sin snapshot: una consulta GROUPING SETS con una agrupación por columna y el total."""
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [
+            (None, None, 1, 1, 4),
+            (None, None, 0, 1, 1),
+            ('COMERCIAL', None, 0, 1, 1),
+            ('EXTRA ', None, 0, 1, 2),
+            (None, 0, 1, 0, 1),
+            (None, 15.5, 1, 0, 3),
+        ]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        with patch('models.stock_model.Database.get_connection', return_value=conn):
+            total, facetas = StockModel._get_facetas_sql([], ['calidad', 'existencias'], 10, None, '1')
+        assert total == 4
+        assert facetas == {'calidad': [('COMERCIAL', 1), ('EXTRA', 2)], 'existencias': [(15.5, 3)]}
+        assert 'GROUPING SETS ((calidad), (existencias), ())' in cursor.execute.call_args.args[0]
+
+    def test_text_search_sql_fallback(self):
+        """Sin códigos del índice: cada palabra (sin acentos) en cualquier columna de texto, erratas incluidas."""
+        from models import stock_model
+
+        condiciones = StockModel._parse_filtros({'descripcion': 'Porcelánico 60x'})
+        where, params = StockModel._where(StockModel._resolve_text(condiciones, None), '1')
+        assert where.count(' AND ') == 2
+        assert 'color COLLATE Latin1_General_CI_AI LIKE ?' in where
+        assert params == ['1'] + ['%60x%'] * 5 + ['%porcelanico%'] * 5
+
+        with patch.object(stock_model, '_TEXT_IN_MAX', 0):
+            resueltas = StockModel._resolve_text(
+                StockModel._parse_filtros({'descripcion': 'porcelanco mate'}), _snapshot())
+        assert resueltas == [(stock_model._TEXT_FIELDS, 'text_like', ['mate']),
+                             (stock_model._TEXT_FIELDS, 'text_like', ['porcelanico'])]
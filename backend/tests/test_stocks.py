@@ -1,5 +1,5 @@
 """Tests de endpoints de stocks: búsqueda, detalle, auth requerida."""
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 
 class TestStocksAuth:
@@ -34,3 +34,174 @@ class TestStocksEndpoints:
             response = client.get('/api/stocks?connection=1',
                                   headers={'X-API-Key': 'test-key-123'})
             assert response.status_code == 200
+
+
+IMAGE_REF = {'id': 7, 'codigo': 'ART1', 'size': 10, 'version': '10-abcd',
+             'mimetype': 'image/jpeg', 'thumb_size': 0}
+
+
+class TestImagenBinaria:
+    def test_imagen_requires_auth(self, client):
+        """GET /api/stocks/imagen/<id> sin autenticación devuelve 401."""
+        response = client.get('/api/stocks/imagen/7')
+        assert response.status_code == 401
+
+    @patch('routes.stock_routes.ImagenModel.get_image_variant', return_value=b'\xff\xd8\xffgrid')
+    @patch('routes.stock_routes.ImagenModel.get_image_ref', return_value=IMAGE_REF)
+    def test_versioned_url_is_immutable_and_revalidates(self, _ref, _variant, admin_client):
+        """Con ?v= la respuesta es immutable; con If-None-Match devuelve 304 sin leer la imagen."""
+        client = admin_client['client']
+        response = client.get('/api/stocks/imagen/7?size=grid&v=10-abcd')
+        assert response.status_code == 200
+        assert response.data == b'\xff\xd8\xffgrid'
+        assert 'immutable' in response.headers['Cache-Control']
+        etag = response.headers['ETag']
+
+        _variant.reset_mock()
+        response = client.get('/api/stocks/imagen/7?size=grid', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert 'no-cache' in response.headers['Cache-Control']
+        _variant.assert_not_called()
+
+    @patch('routes.stock_routes.ImagenModel.read_image_range', return_value=b'2345')
+    @patch('routes.stock_routes.ImagenModel.get_image_ref', return_value=IMAGE_REF)
+    def test_original_range(self, _ref, read_range, admin_client):
+        """Range sobre la original se resuelve con SUBSTRING en BD y devuelve 206."""
+        response = admin_client['client'].get('/api/stocks/imagen/7', headers={'Range': 'bytes=2-5'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 2-5/10'
+        read_range.assert_called_once_with(7, 2, 4)
+
+        response = admin_client['client'].get('/api/stocks/imagen/7', headers={'Range': 'bytes=20-30'})
+        assert response.status_code == 416
+
+    @patch('routes.stock_routes.ImagenModel.get_primeras_image_refs', return_value={'ART1': IMAGE_REF})
+    def test_batch_returns_urls(self, _refs, admin_client):
+        """POST /api/stocks/thumbnails con format=url devuelve URLs versionadas en lugar de base64."""
+        response = admin_client['client'].post(
+            '/api/stocks/thumbnails',
+            json={'codigos': ['ART1'], 'quality': 'grid', 'format': 'url'},
+            headers={'X-CSRF-Token': admin_client['csrf_token']}
+        )
+        assert response.status_code == 200
+        assert response.get_json() == {'ART1': '/api/stocks/imagen/7?size=grid&v=10-abcd'}
+
+    @patch('routes.stock_routes.ImagenModel.get_thumbnails_batch', return_value={'ART1': 'aGVsbG8='})
+    def test_batch_default_base64(self, batch, admin_client):
+        """Sin format, POST /api/stocks/thumbnails sigue devolviendo base64 (compatibilidad API key)."""
+        response = admin_client['client'].post(
+            '/api/stocks/thumbnails',
+            json={'codigos': ['ART1']},
+            headers={'X-CSRF-Token': admin_client['csrf_token']}
+        )
+        assert response.status_code == 200
+        assert response.get_json() == {'ART1': 'aGVsbG8='}
+        batch.assert_called_once()
+
+
+class TestImagenDerivadas:
+    @patch('routes.stock_routes.ImagenModel.get_image_variant', return_value=b'RIFF....WEBP')
+    @patch('routes.stock_routes.ImagenModel.get_image_ref', return_value=IMAGE_REF)
+    @patch('routes.stock_routes.negotiate_format', return_value='webp')
+    def test_derivative_format_from_accept(self, _fmt, _ref, variant, admin_client):
+        """Las derivadas se sirven en el formato negociado con Vary: Accept."""
+        response = admin_client['client'].get('/api/stocks/imagen/7?size=detail',
+                                              headers={'Accept': 'image/webp,*/*'})
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert 'Accept' in response.headers['Vary']
+        assert response.headers['ETag'] == '"7-10-abcd-detail.webp"'
+        variant.assert_called_once_with(IMAGE_REF, 'detail', 'webp', '1')
+
+    def test_generar_derivadas_requires_admin(self, auth_client):
+        """POST /api/stocks/imagenes/derivadas requiere rol administrador."""
+        response = auth_client['client'].post('/api/stocks/imagenes/derivadas',
+                                              headers={'X-CSRF-Token': auth_client['csrf_token']})
+        assert response.status_code in (401, 403)
+
+
+class TestPreciosCache:
+    def test_small_batch_then_full_list(self):
+        """Cache fría: un lote pequeño consulta solo sus códigos; uno grande carga la lista; luego todo sale de memoria."""
+        from models.precio_model import PrecioModel
+
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [('A1  ', 'EXTRA', 10.5)],
+            [('A1', 'EXTRA', 10.5), ('B2', 'EXTRA', 7), ('C3', 'COM', None)],
+        ]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        PrecioModel.invalidate_cache()
+
+        with patch('models.precio_model.Database.get_connection', return_value=conn), \
+                patch('models.precio_model.PRECIOS_IN_MAX', 1):
+            stocks = [{'codigo': 'A1', 'calidad': 'EXTRA'}]
+            PrecioModel.inyectar_precios('1', stocks, connection=5)
+            assert stocks[0]['precio'] == 10.5
+            sql, params = cursor.execute.call_args.args
+            assert 'IN (?)' in sql and params == ['1', 'A1']
+
+            grid = [{'codigo': c, 'calidad': q} for c, q in (('A1', 'EXTRA'), ('B2', 'EXTRA'), ('C3', 'COM'))]
+            PrecioModel.inyectar_precios('1', grid, connection=5)
+            assert 'IN (' not in cursor.execute.call_args.args[0]
+            assert [s.get('precio') for s in grid] == [10.5, 7.0, None]
+
+            PrecioModel.inyectar_precios('1', [{'codigo': 'Z9', 'calidad': 'EXTRA'}], connection=5)
+            assert cursor.execute.call_count == 2
+
+            PrecioModel.invalidate_cache('1', connection=5)
+            assert PrecioModel.cache_stats()['tenants'] == 0
+
+
+class TestStocksExport:
+    def _rows(self, *codigos):
+        return [('1', c, f'Articulo {c}', 'EXTRA', 'BLANCO', 'T1', '2', '60X60', 'SERIE', 'M2',
+                 'EUR', 'C', 6, 40, 10, None, 20, 800, 'PAV', 6) for c in codigos]
+
+    def test_ndjson_streams_with_fetchmany(self, admin_client):
+        """format=ndjson lee la vista por lotes (fetchmany) y emite un stock por línea, con precio."""
+        import json
+
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [self._rows('A1', 'A2'), self._rows('B1'), []]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        def precios(empresa_id, stocks, connection=None):
+            for stock in stocks:
+                stock['precio'] = 9.5
+
+        with patch('models.stock_model.SNAPSHOT_ENABLED', False), \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model.Database.get_connection', return_value=conn), \
+                patch('controllers.stock_controller._precios_habilitados', return_value=True), \
+                patch('controllers.stock_controller.PrecioModel.inyectar_precios', side_effect=precios) as inyectar:
+            response = admin_client['client'].get('/api/stocks/search?format=ndjson&calidad=extra')
+            lines = response.get_data(as_text=True).splitlines()
+
+        assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line)['codigo'] for line in lines] == ['A1', 'A2', 'B1']
+        assert json.loads(lines[0])['precio'] == 9.5
+        assert inyectar.call_count == 2
+        cursor.fetchall.assert_not_called()
+        conn.close.assert_called_once()
+
+    def test_csv_header_and_bad_format(self, admin_client):
+        """CSV con cabecera sin columnas de precio si no están habilitados; formato desconocido da 400."""
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [self._rows('A1'), []]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+
+        with patch('models.stock_model.SNAPSHOT_ENABLED', False), \
+                patch('models.stock_model.Database.get_empresa_erp', return_value='1'), \
+                patch('models.stock_model.Database.get_connection', return_value=conn), \
+                patch('controllers.stock_controller._precios_habilitados', return_value=False):
+            response = admin_client['client'].get('/api/stocks?format=csv')
+            lines = response.get_data(as_text=True).splitlines()
+            assert admin_client['client'].get('/api/stocks?format=xml').status_code == 400
+
+        assert response.mimetype == 'text/csv'
+        assert lines[0].startswith('empresa,codigo,descripcion') and 'precio' not in lines[0]
+        assert lines[1].startswith('1,A1,Articulo A1,EXTRA')
@@ -0,0 +1,134 @@
+# ============================================================
+# ARCHIVO: utils/audit_writer.py
+# Escritura asíncrona y por lotes de audit_log.
+#
+# AuditModel.log encola la fila y vuelve al momento; un hilo del
+# proceso vacía las colas cada AUDIT_FLUSH_INTERVAL segundos (o en
+# cuanto hay AUDIT_BATCH filas) con un INSERT multi-fila por
+# conexión de tenant. Hay una cola por tenant: si la BD de uno no
+# responde, los demás siguen escribiéndose.
+#
+# - Memoria acotada: las colas guardan como mucho AUDIT_QUEUE_MAX
+#   filas entre todas; si se llenan se descartan las más antiguas
+#   del tenant con más pendientes (se cuentan en
+#   stats()['dropped'] y se avisa en el log).
+# - Un lote que falla vuelve a la cola de su tenant y se reintenta.
+# - Al salir el proceso (parada o reciclado del worker de
+#   gunicorn) atexit vacía lo pendiente antes de terminar.
+# ============================================================
+
+import logging
+import os
+from collections import deque
+
+from utils.background_flusher import BackgroundFlusher
+from utils.env import env_int, env_float
+
+logger = logging.getLogger(__name__)
+
+
+AUDIT_ASYNC = os.environ.get('AUDIT_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+AUDIT_QUEUE_MAX = env_int('AUDIT_QUEUE_MAX', 10000)          # filas en memoria como máximo
+AUDIT_BATCH = env_int('AUDIT_BATCH', 500)                    # filas por INSERT
+AUDIT_FLUSH_INTERVAL = env_float('AUDIT_FLUSH_INTERVAL', 1.0)  # segundos entre vaciados
+
+# Espera tras un lote fallido antes de reintentar
+_RETRY_DELAY = 5.0
+
+
+class AuditWriter(BackgroundFlusher):
+    """
+    Colas de filas por tenant con un hilo que las escribe por lotes.
+
+    Args:
+        write_batch: función (tenant, [filas]) que inserta las filas de un
+            tenant; si lanza excepción el lote se reintenta más tarde
+    """
+
+    def __init__(self, write_batch, max_queue=None, batch_size=None, interval=None):
+        super().__init__(AUDIT_FLUSH_INTERVAL if interval is None else interval, _RETRY_DELAY, 'AuditWriter')
+        self.write_batch = write_batch
+        self.max_queue = AUDIT_QUEUE_MAX if max_queue is None else max_queue
+        self.batch_size = AUDIT_BATCH if batch_size is None else batch_size
+        self._queues = {}   # tenant -> deque de filas en orden de llegada
+        self._size = 0      # filas en todas las colas
+        self._stats = {'queued': 0, 'written': 0, 'dropped': 0, 'errors': 0, 'batches': 0}
+
+    def submit(self, tenant, row):
+        """Encola una fila; no espera a la BD."""
+        with self._cond:
+            if self._size >= self.max_queue:
+                # La más antigua del tenant con más pendientes (normalmente el que no puede escribir)
+                max(self._queues.values(), key=len).popleft()
+                self._size -= 1
+                self._stats['dropped'] += 1
+                if self._stats['dropped'] % 1000 == 1:
+                    logger.warning(f'Audit queue full ({self.max_queue}): dropping oldest entries')
+            self._queues.setdefault(tenant, deque()).append(row)
+            self._size += 1
+            self._stats['queued'] += 1
+            if self._size >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+
+    def _ready(self):
+        return self._size >= self.batch_size
+
+    def _pending(self):
+        return self._size
+
+    def _take(self, tenant):
+        with self._cond:
+            queue = self._queues.get(tenant)
+            if not queue:
+                return []
+            rows = [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+            self._size -= len(rows)
+            if not queue:
+                del self._queues[tenant]
+            return rows
+
+    def _requeue(self, tenant, rows):
+        with self._cond:
+            # Delante de su cola, en su orden; si no caben se pierden las más antiguas
+            room = self.max_queue - self._size
+            keep = rows[-room:] if room > 0 else []
+            self._stats['dropped'] += len(rows) - len(keep)
+            self._queues.setdefault(tenant, deque()).extendleft(reversed(keep))
+            self._size += len(keep)
+
+    def flush(self):
+        """
+        Escribe todo lo pendiente, en lotes por tenant. Un tenant que falla
+        no detiene al resto: sus filas vuelven a su cola y se sigue con los demás.
+
+        Returns:
+            False si algún lote ha fallado (queda en la cola para reintentar)
+        """
+        with self._flush_lock:
+            with self._cond:
+                tenants = list(self._queues)
+            ok = True
+            for tenant in tenants:
+                while True:
+                    rows = self._take(tenant)
+                    if not rows:
+                        break
+                    try:
+                        self.write_batch(tenant, rows)
+                    except Exception as e:
+                        logger.error(f'Audit batch write failed ({len(rows)} rows): {e}')
+                        self._requeue(tenant, rows)
+                        with self._cond:
+                            self._stats['errors'] += 1
+                        ok = False
+                        break
+                    with self._cond:
+                        self._stats['written'] += len(rows)
+                        self._stats['batches'] += 1
+            return ok
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, pending=self._size, max_queue=self.max_queue)
+
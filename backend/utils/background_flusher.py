@@ -0,0 +1,95 @@
+# ============================================================
+# ARCHIVO: utils/background_flusher.py
+# Base de los acumuladores en memoria que un hilo del proceso
+# vuelca a la BD (utils/audit_writer.py, utils/view_counter.py).
+#
+# - El hilo arranca al primer uso y por proceso: con gunicorn
+#   --preload el hilo del master no sobrevive al fork.
+# - Vuelca cada `interval` segundos o en cuanto _ready() lo pide
+#   (la subclase llama a self._cond.notify() al llenarse).
+# - Si flush() devuelve False espera `retry_delay` segundos.
+# - stop() (atexit, ver register_shutdown) para el hilo y vuelca
+#   lo pendiente.
+# ============================================================
+
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundFlusher:
+    """
+    Hilo de volcado periódico. Las subclases implementan flush() y
+    _pending(), y pueden redefinir _ready().
+
+    Args:
+        interval: segundos entre volcados
+        retry_delay: espera tras un volcado fallido
+        name: nombre del hilo (y de los mensajes de log)
+    """
+
+    def __init__(self, interval, retry_delay, name):
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.name = name
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def _ready(self):
+        """Hay bastante pendiente para volcar sin esperar al intervalo (con _cond tomado)."""
+        return False
+
+    def _pending(self):
+        """Entradas pendientes de volcar (con _cond tomado)."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Vuelca lo pendiente; False si algo ha fallado y queda para reintentar."""
+        raise NotImplementedError
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and not self._ready():
+                    self._cond.wait(self.interval)
+                if self._stopping:
+                    return
+            if not self.flush() and not self._stopping:
+                with self._cond:
+                    self._cond.wait(self.retry_delay)
+
+    def stop(self, timeout=5):
+        """Para el hilo y vuelca lo pendiente (se llama al salir del proceso)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        if not self.flush():
+            with self._cond:
+                pending = self._pending()
+            logger.error(f'{self.name} stopped with {pending} unflushed entries')
+
+
+def register_shutdown(flusher):
+    """Volcar lo pendiente al salir el proceso (SIGTERM de gunicorn → sys.exit → atexit)."""
+    atexit.register(flusher.stop)
+    return flusher
@@ -0,0 +1,372 @@
+# ============================================================
+# ARCHIVO: utils/embedding_index.py
+# Índice vectorial para la búsqueda visual (CBIR)
+# Matriz float32 contigua + normas precalculadas + ids paralelos,
+# persistida en disco y abierta con numpy.memmap (compartida
+# entre workers de gunicorn a través de la caché de páginas del SO)
+# ============================================================
+
+import glob
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Directorio de índices en disco (uno por empresa)
+INDEX_DIR = os.environ.get(
+    'IMAGE_INDEX_DIR',
+    str(Path(__file__).resolve().parent.parent / 'cache' / 'image_index')
+)
+
+
+class EmbeddingIndex:
+    """
+    Embeddings de una empresa como una única matriz float32 (n x dims).
+
+    Las filas se ordenan por código al construir el índice, de modo que las
+    imágenes de un mismo artículo quedan contiguas y la deduplicación por
+    código se resuelve con un único `np.maximum.reduceat`.
+
+    Opcionalmente el vector se divide en bloques (grupos de features sin
+    ponderar); en ese caso se guarda la norma² de cada bloque por fila y los
+    pesos por bloque se aplican en la consulta (escalado diagonal por bloques),
+    sin re-extraer ni reescribir la matriz.
+
+    Atributos:
+        matrix: np.ndarray float32 (n, dims)
+        norms: np.ndarray float32 (n,) con la norma L2 de cada fila
+        codigos: np.ndarray object (n,) código de artículo por fila
+        imagen_ids: np.ndarray int64 (n,) id de imagen por fila
+        group_starts: np.ndarray (g,) primera fila de cada código
+        block_offsets: np.ndarray (b+1,) límites de bloque en columnas, o None
+        block_sq: np.ndarray float32 (n, b) norma² de cada bloque por fila, o None
+    """
+
+    def __init__(self, codigos, imagen_ids, matrix, block_offsets=None):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(codigos), -1)
+
+        codigos = np.asarray(codigos, dtype=object)
+        imagen_ids = np.asarray(imagen_ids, dtype=np.int64)
+
+        # Agrupar filas por código (orden estable: conserva el orden de carga dentro del grupo)
+        if len(codigos):
+            _uniq, inverse = np.unique(codigos.astype(str), return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+            inverse = inverse[order]
+            self.group_starts = np.flatnonzero(np.r_[True, inverse[1:] != inverse[:-1]])
+        else:
+            order = np.arange(0)
+            self.group_starts = np.arange(0)
+
+        self.matrix = np.ascontiguousarray(matrix[order])
+        self.codigos = codigos[order]
+        self.imagen_ids = imagen_ids[order]
+        self.norms = np.linalg.norm(self.matrix, axis=1).astype(np.float32)
+        # Índice aproximado IVF-PQ (opcional, ver utils/ann_index.py)
+        self.ann = None
+        self.block_offsets = None
+        self.block_sq = None
+        if block_offsets is not None and len(self):
+            self.set_blocks(block_offsets)
+
+    @classmethod
+    def from_arrays(cls, codigos, imagen_ids, matrix, norms, group_starts, ann=None,
+                    block_offsets=None, block_sq=None):
+        """Reconstruye un índice ya ordenado por código (p.ej. leído de disco) sin reordenar."""
+        index = cls.__new__(cls)
+        index.matrix = matrix
+        index.codigos = codigos
+        index.imagen_ids = imagen_ids
+        index.norms = norms
+        index.group_starts = group_starts
+        index.ann = ann
+        index.block_offsets = block_offsets
+        index.block_sq = block_sq
+        return index
+
+    def set_blocks(self, block_offsets):
+        """Define los bloques de columnas (grupos de features) y precalcula su norma² por fila."""
+        offsets = np.asarray(block_offsets, dtype=np.int64)
+        if offsets[-1] != self.dims:
+            raise ValueError(f'Bloques ({offsets[-1]} columnas) incompatibles con la matriz ({self.dims})')
+        squared = np.square(self.matrix, dtype=np.float32)
+        self.block_sq = np.add.reduceat(squared, offsets[:-1], axis=1).astype(np.float32)
+        self.block_offsets = offsets
+
+    def dim_weights(self, weights):
+        """Expande pesos por bloque (b,) a pesos por columna (dims,)."""
+        return np.repeat(np.asarray(weights, dtype=np.float32), np.diff(self.block_offsets))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Construye el índice desde una lista de tuplas (codigo, imagen_id, vector)."""
+        if not rows:
+            return cls([], [], np.zeros((0, 0), dtype=np.float32))
+        codigos = [r[0] for r in rows]
+        imagen_ids = [r[1] for r in rows]
+        matrix = np.vstack([r[2] for r in rows])
+        return cls(codigos, imagen_ids, matrix)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dims(self):
+        return self.matrix.shape[1] if len(self) else 0
+
+    def similarities(self, query_vector, weights=None):
+        """
+        Similitud coseno del vector de consulta contra todas las filas (un solo producto matriz-vector).
+
+        Con `weights` (un peso por bloque) es el coseno de los vectores
+        escalados por bloque: (W·v)·(W·q) / (|W·v| |W·q|), calculado como
+        v·(W²·q) con las normas de bloque precalculadas.
+        """
+        q = np.asarray(query_vector, dtype=np.float32).ravel()
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+
+        if weights is None or self.block_offsets is None:
+            q_norm = float(np.linalg.norm(q))
+            row_norms = self.norms
+        else:
+            w = np.asarray(weights, dtype=np.float32)
+            w_dim = self.dim_weights(w)
+            q_norm = float(np.linalg.norm(q * w_dim))
+            row_norms = np.sqrt(self.block_sq @ np.square(w))
+            q = q * np.square(w_dim)
+
+        if q_norm == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        dots = self.matrix @ q
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sims = dots / (row_norms * q_norm)
+        # Filas con norma 0 o valores no finitos puntúan 0 (como cosine_similarity)
+        sims[~np.isfinite(sims)] = 0.0
+        return sims
+
+    def top_k(self, query_vector, k, weights=None, use_ann=None, nprobe=None):
+        """
+        Los k artículos más similares, deduplicados por código.
+
+        Si el índice tiene IVF-PQ (`ann`) y al menos ANN_MIN_ROWS filas, se
+        puntúan solo los candidatos aproximados (re-puntuados con coseno
+        exacto); `use_ann` fuerza uno u otro modo. `weights` son los pesos
+        por bloque aplicados en la consulta (ver similarities).
+
+        Returns:
+            lista de (codigo, imagen_id, similarity) ordenada de mayor a menor,
+            con la mejor imagen de cada código.
+        """
+        if not len(self) or k <= 0:
+            return []
+
+        if use_ann is None:
+            from utils.ann_index import ANN_MIN_ROWS
+            use_ann = self.ann is not None and len(self) >= ANN_MIN_ROWS
+        if use_ann and self.ann is not None:
+            return self._top_k_ann(query_vector, k, weights, nprobe)
+
+        sims = self.similarities(query_vector, weights)
+        return self._top_k_groups(sims, k)
+
+    def _top_k_ann(self, query_vector, k, weights=None, nprobe=None):
+        """top_k sobre los candidatos del índice aproximado."""
+        from utils.ann_index import ANN_RERANK
+
+        q = np.asarray(query_vector, dtype=np.float32).ravel()
+        if weights is not None and self.block_offsets is not None:
+            w_dim = self.dim_weights(weights)
+            q_ann = q * np.square(w_dim)
+        else:
+            w_dim = None
+            q_ann = q
+        rows = self.ann.search(q_ann, k * ANN_RERANK, nprobe=nprobe)
+        if not len(rows):
+            return []
+
+        # Coseno exacto (ponderado) solo para los candidatos
+        rows = np.sort(rows)
+        if w_dim is None:
+            q_norm = float(np.linalg.norm(q))
+            row_norms = self.norms[rows]
+        else:
+            q_norm = float(np.linalg.norm(q * w_dim))
+            row_norms = np.sqrt(self.block_sq[rows] @ np.square(np.asarray(weights, dtype=np.float32)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sims = (self.matrix[rows] @ q_ann) / (row_norms * q_norm)
+        sims[~np.isfinite(sims)] = 0.0
+
+        # Dedupe por código: primera aparición de cada grupo en orden de score
+        order = np.argsort(-sims, kind='stable')
+        groups = np.searchsorted(self.group_starts, rows[order], side='right')
+        _uniq, first = np.unique(groups, return_index=True)
+        best = order[np.sort(first)][:k]
+        return [(self.codigos[rows[i]], int(self.imagen_ids[rows[i]]), float(sims[i])) for i in best]
+
+    def _top_k_groups(self, sims, k):
+        """Selecciona los k mejores códigos a partir de las similitudes por fila."""
+        # Mejor score por código (filas contiguas por grupo)
+        group_best = np.maximum.reduceat(sims, self.group_starts)
+        n_groups = len(group_best)
+
+        if k < n_groups:
+            top = np.argpartition(-group_best, k - 1)[:k]
+        else:
+            top = np.arange(n_groups)
+        top = top[np.argsort(-group_best[top], kind='stable')]
+
+        group_ends = np.r_[self.group_starts[1:], len(sims)]
+        results = []
+        for g in top:
+            start, end = self.group_starts[g], group_ends[g]
+            row = start + int(np.argmax(sims[start:end]))
+            results.append((self.codigos[row], int(self.imagen_ids[row]), float(sims[row])))
+        return results
+
+
+# ==================== PERSISTENCIA EN DISCO ====================
+#
+# Por cada clave (conexión + empresa) se guardan:
+#   <clave>.json                      manifiesto con la generación activa
+#   <clave>.v<version>.<gen>.f32      matriz float32 (n x dims) en bruto
+#   <clave>.v<version>.<gen>.ids.npz  codigos, imagen_ids, normas y grupos
+#   <clave>.v<version>.<gen>.ann.npz  índice aproximado IVF-PQ (opcional)
+#
+# Un reindex escribe una generación nueva y sustituye el manifiesto con
+# os.replace (atómico); los workers detectan el cambio en la siguiente
+# búsqueda. Los ficheros antiguos se borran: los workers que aún los tengan
+# mapeados siguen leyéndolos hasta soltarlos.
+
+def _safe_key(key):
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(key))
+
+
+def _manifest_path(key, directory=None):
+    return os.path.join(directory or INDEX_DIR, f'{_safe_key(key)}.json')
+
+
+def read_manifest(key, directory=None):
+    """Lee el manifiesto del índice en disco. Retorna dict o None si no existe."""
+    try:
+        with open(_manifest_path(key, directory), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f'Manifiesto de indice ilegible ({key}): {e}')
+        return None
+
+
+def save_index(index, key, version, directory=None):
+    """
+    Escribe el índice como una generación nueva y la activa de forma atómica.
+
+    Returns:
+        dict manifiesto de la generación escrita
+    """
+    directory = directory or INDEX_DIR
+    os.makedirs(directory, exist_ok=True)
+    base = f'{_safe_key(key)}.v{version}.{time.time_ns()}'
+    matrix_file = f'{base}.f32'
+    ids_file = f'{base}.ids.npz'
+
+    np.ascontiguousarray(index.matrix, dtype=np.float32).tofile(os.path.join(directory, matrix_file))
+    with open(os.path.join(directory, ids_file), 'wb') as f:
+        np.savez(
+            f,
+            codigos=np.asarray(index.codigos, dtype=str),
+            imagen_ids=index.imagen_ids,
+            norms=index.norms,
+            group_starts=index.group_starts,
+            block_offsets=index.block_offsets if index.block_offsets is not None else np.arange(0),
+            block_sq=index.block_sq if index.block_sq is not None else np.zeros((0, 0), dtype=np.float32),
+        )
+
+    ann_file = None
+    if index.ann is not None:
+        ann_file = f'{base}.ann.npz'
+        with open(os.path.join(directory, ann_file), 'wb') as f:
+            np.savez(f, **index.ann.to_arrays())
+
+    manifest = {
+        'version': version,
+        'generation': base,
+        'rows': int(len(index)),
+        'dims': int(index.dims),
+        'matrix': matrix_file,
+        'ids': ids_file,
+        'ann': ann_file,
+    }
+    manifest_path = _manifest_path(key, directory)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    _remove_generations(key, directory, keep=base)
+    return manifest
+
+
+def load_index(manifest, directory=None):
+    """Abre el índice descrito por el manifiesto (matriz con numpy.memmap, solo lectura)."""
+    directory = directory or INDEX_DIR
+    rows, dims = manifest['rows'], manifest['dims']
+    with np.load(os.path.join(directory, manifest['ids'])) as ids:
+        codigos = ids['codigos'].astype(object)
+        imagen_ids = ids['imagen_ids']
+        norms = ids['norms']
+        group_starts = ids['group_starts']
+        block_offsets = ids['block_offsets'] if 'block_offsets' in ids.files else np.arange(0)
+        block_sq = ids['block_sq'] if 'block_sq' in ids.files else None
+    if not len(block_offsets):
+        block_offsets, block_sq = None, None
+    if rows == 0:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    else:
+        matrix = np.memmap(os.path.join(directory, manifest['matrix']),
+                           dtype=np.float32, mode='r', shape=(rows, dims))
+    ann = None
+    if manifest.get('ann'):
+        from utils.ann_index import IVFPQIndex
+        with np.load(os.path.join(directory, manifest['ann'])) as arrays:
+            ann = IVFPQIndex.from_arrays({k: arrays[k] for k in arrays.files})
+    return EmbeddingIndex.from_arrays(codigos, imagen_ids, matrix, norms, group_starts, ann=ann,
+                                      block_offsets=block_offsets, block_sq=block_sq)
+
+
+def remove_index(key, directory=None):
+    """Elimina el índice en disco de una clave (manifiesto y generaciones)."""
+    directory = directory or INDEX_DIR
+    try:
+        os.remove(_manifest_path(key, directory))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f'No se pudo eliminar el manifiesto de {key}: {e}')
+    _remove_generations(key, directory)
+
+
+def _remove_generations(key, directory, keep=None):
+    """Borra generaciones anteriores a `keep` (o todas si keep es None)."""
+    keep_ns = int(keep.rsplit('.', 1)[1]) if keep else None
+    for path in glob.glob(os.path.join(directory, f'{_safe_key(key)}.v*')):
+        try:
+            gen_ns = int(os.path.basename(path).split('.')[2])
+        except (IndexError, ValueError):
+            continue
+        # No tocar la generación activa ni otras más recientes (escritas por otro worker)
+        if keep_ns is not None and gen_ns >= keep_ns:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # En Windows un fichero mapeado no se puede borrar; se reintentará en el próximo reindex
+            pass
@@ -0,0 +1,23 @@
+# ============================================================
+# ARCHIVO: utils/env.py
+# Lectura de variables de entorno numéricas con valor por defecto
+# (un valor mal escrito no impide arrancar: se usa el default).
+# ============================================================
+
+import os
+
+
+def env_int(name, default):
+    """Lee una variable de entorno entera con valor por defecto."""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name, default):
+    """Lee una variable de entorno decimal con valor por defecto."""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,256 @@
+# ============================================================
+# ARCHIVO: utils/fast_features.py
+# Primitivas vectorizadas (NumPy) para la extracción de features
+# de la búsqueda visual. Reproducen a las de skimage/np.histogram
+# usadas en extract_features() sin bucles Python por celda o píxel:
+#
+#   - cell_means / cell_histograms: pooling por celdas con reshape
+#     y un único bincount
+#   - uniform_lbp_histogram: LBP 'uniform' de skimage con
+#     interpolación bilineal sobre desplazamientos de la imagen
+#   - glcm_features: matriz de co-ocurrencia de los 4 ángulos en
+#     un solo bincount + graycoprops
+#
+# Benchmark: python -m utils.fast_features [carpeta_con_imagenes]
+# ============================================================
+
+import os
+
+import numpy as np
+
+
+def cell_means(img, grid):
+    """
+    Media por celda de una imagen (H, W[, C]) dividida en grid x grid.
+
+    Returns:
+        array (grid, grid[, C]) en orden fila-columna
+    """
+    h, w = img.shape[:2]
+    ch, cw = h // grid, w // grid
+    extra = img.shape[2:]
+    # Sumar primero filas completas (contiguas) y después columnas de cada celda
+    rows = img[:ch * grid, :cw * grid].reshape((grid, ch, -1)).sum(axis=1, dtype=np.float64)
+    sums = rows.reshape((grid, grid, cw) + extra).sum(axis=2)
+    return sums / (ch * cw)
+
+
+def bin_index(values, n_bins, lo, hi):
+    """
+    Índice de bin con la misma semántica que np.histogram(range=(lo, hi)):
+    bins cerrados por la izquierda salvo el último. Valores fuera de rango → -1.
+    """
+    edges = np.linspace(lo, hi, n_bins + 1)
+    # Mismo cálculo que np.histogram para bins uniformes: división y corrección
+    # de los valores que caen justo en un borde por redondeo
+    idx = ((values - lo) * (n_bins / (hi - lo))).astype(np.intp)
+    np.clip(idx, 0, n_bins - 1, out=idx)
+    idx[values < edges[idx]] -= 1
+    idx[(values >= edges[idx + 1]) & (idx != n_bins - 1)] += 1
+    idx[(values < lo) | (values > hi)] = -1
+    return idx
+
+
+def cell_histograms(bins, weights, n_bins, grid):
+    """
+    Histogramas ponderados por celda (grid x grid) a partir de un mapa de bins.
+
+    Args:
+        bins: array (H, W) de índices de bin (−1 = se descarta)
+        weights: array (H, W) de pesos
+    Returns:
+        array (grid*grid, n_bins) en orden fila-columna
+    """
+    h, w = bins.shape
+    rows = np.arange(h) * grid // h
+    cols = np.arange(w) * grid // w
+    cell = rows[:, None] * grid + cols[None, :]
+    valid = bins >= 0
+    flat = cell[valid] * n_bins + bins[valid]
+    hist = np.bincount(flat, weights=weights[valid], minlength=grid * grid * n_bins)
+    return hist.reshape(grid * grid, n_bins)
+
+
+def _lbp_sample_coords(P, R):
+    # Mismos puntos de muestreo que skimage (redondeados a 5 decimales)
+    angles = 2 * np.pi * np.arange(P, dtype=np.double) / P
+    return np.round(np.vstack([-R * np.sin(angles), R * np.cos(angles)]).T, 5)
+
+
+def uniform_lbp(gray, P, R):
+    """
+    LBP 'uniform' (invariante a rotación) equivalente a
+    skimage.feature.local_binary_pattern(gray, P, R, method='uniform').
+
+    Cada punto vecino es una combinación bilineal de 4 desplazamientos
+    constantes de la imagen (fuera de la imagen cuenta como 0), así que
+    se calcula con slicing sobre una copia con borde de ceros.
+    """
+    image = np.ascontiguousarray(gray, dtype=np.float64)
+    rows, cols = image.shape
+    pad = int(np.ceil(R)) + 1
+    padded = np.zeros((rows + 2 * pad, cols + 2 * pad))
+    padded[pad:pad + rows, pad:pad + cols] = image
+
+    def shifted(dr, dc):
+        return padded[pad + dr:pad + dr + rows, pad + dc:pad + dc + cols]
+
+    row_idx = np.arange(rows, dtype=np.double)[:, None]
+    col_idx = np.arange(cols, dtype=np.double)[None, :]
+    ones = np.zeros(image.shape, dtype=np.uint8)
+    changes = np.zeros(image.shape, dtype=np.uint8)
+    top = np.empty_like(image)
+    bottom = np.empty_like(image)
+    tmp = np.empty_like(image)
+    bit = np.empty(image.shape, dtype=bool)
+    prev = np.empty(image.shape, dtype=bool)
+    for k, (r, c) in enumerate(_lbp_sample_coords(P, R)):
+        minr, minc = int(np.floor(r)), int(np.floor(c))
+        maxr, maxc = int(np.ceil(r)), int(np.ceil(c))
+        if minr == maxr and minc == maxc:
+            # Punto sobre un píxel: la interpolación devuelve el valor tal cual
+            np.greater_equal(shifted(minr, minc), image, out=bit)
+        else:
+            # Las fracciones se calculan sobre la coordenada absoluta, como skimage,
+            # para que el redondeo (y por tanto los empates con el centro) coincida
+            dr = (row_idx + r) - np.floor(row_idx + r)
+            dc = (col_idx + c) - np.floor(col_idx + c)
+            np.multiply(1 - dc, shifted(minr, minc), out=top)
+            top += np.multiply(dc, shifted(minr, maxc), out=tmp)
+            np.multiply(1 - dc, shifted(maxr, minc), out=bottom)
+            bottom += np.multiply(dc, shifted(maxr, maxc), out=tmp)
+            top *= 1 - dr
+            top += np.multiply(dr, bottom, out=tmp)
+            np.greater_equal(top, image, out=bit)
+        ones += bit
+        if k:
+            changes += prev != bit
+        prev, bit = bit, prev
+    return np.where(changes <= 2, ones, P + 1)
+
+
+def uniform_lbp_histogram(gray, P, R):
+    """Histograma normalizado (P+2 bins) del LBP uniform."""
+    hist = np.bincount(uniform_lbp(gray, P, R).ravel(), minlength=P + 2).astype(np.float64)
+    return hist / (hist.sum() + 1e-7)
+
+
+# Desplazamientos (fila, columna) de graycomatrix para distancia 1 y ángulos 0, π/4, π/2, 3π/4
+GLCM_OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1))
+
+
+def glcm_features(gray_q, levels):
+    """
+    [contrast, homogeneity, correlation, dissimilarity] promediados sobre los
+    4 ángulos, equivalentes a graycomatrix(symmetric=True, normed=True) +
+    graycoprops de skimage.
+
+    Args:
+        gray_q: imagen cuantizada con valores en [0, levels)
+    """
+    img = np.asarray(gray_q, dtype=np.intp)
+    rows, cols = img.shape
+    codes = []
+    for a, (dr, dc) in enumerate(GLCM_OFFSETS):
+        src = img[max(0, -dr):rows - max(0, dr), max(0, -dc):cols - max(0, dc)]
+        dst = img[max(0, dr):rows + min(0, dr), max(0, dc):cols + min(0, dc)]
+        codes.append(((a * levels + src) * levels + dst).ravel())
+    glcm = np.bincount(np.concatenate(codes), minlength=len(GLCM_OFFSETS) * levels * levels)
+    glcm = glcm.reshape(len(GLCM_OFFSETS), levels, levels).astype(np.float64)
+    glcm = glcm + glcm.transpose(0, 2, 1)
+    sums = glcm.sum(axis=(1, 2), keepdims=True)
+    sums[sums == 0] = 1
+    P = glcm / sums
+
+    i = np.arange(levels, dtype=np.float64)
+    diff = i[:, None] - i[None, :]
+    contrast = np.einsum('aij,ij->a', P, diff ** 2)
+    dissimilarity = np.einsum('aij,ij->a', P, np.abs(diff))
+    homogeneity = np.einsum('aij,ij->a', P, 1.0 / (1.0 + diff ** 2))
+
+    mean_i = np.einsum('aij,i->a', P, i)
+    mean_j = np.einsum('aij,j->a', P, i)
+    di = i[None, :] - mean_i[:, None]
+    dj = i[None, :] - mean_j[:, None]
+    std_i = np.sqrt(np.einsum('aij,ai->a', P, di ** 2))
+    std_j = np.sqrt(np.einsum('aij,aj->a', P, dj ** 2))
+    cov = np.einsum('aij,ai,aj->a', P, di, dj)
+    flat = (std_i < 1e-15) | (std_j < 1e-15)
+    correlation = np.where(flat, 1.0, cov / np.where(flat, 1.0, std_i * std_j))
+
+    return np.array([contrast.mean(), homogeneity.mean(), correlation.mean(), dissimilarity.mean()])
+
+
+def color_moments(img):
+    """
+    Media, varianza y asimetría (sesgada, como scipy.stats.skew) por canal
+    de una imagen uint8, calculadas sobre el histograma de 256 valores.
+    """
+    levels = np.arange(256, dtype=np.float64)
+    result = []
+    for ch in range(img.shape[-1]):
+        hist = np.bincount(img[..., ch].ravel(), minlength=256).astype(np.float64)
+        p = hist / hist.sum()
+        mean = p @ levels
+        centered = levels - mean
+        m2 = p @ (centered * centered)
+        m3 = p @ (centered * centered * centered)
+        skew = m3 / m2 ** 1.5 if m2 > 0 else np.nan
+        result.append((mean, m2, skew))
+    return np.array(result)
+
+
+# ---------------------------------------------------------
+# Microbenchmark
+# ---------------------------------------------------------
+
+def _sample_tiles(n, size=600, seed=0):
+    """Azulejos sintéticos (vetas, dibujo geométrico, ruido) codificados en JPEG."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size] / size
+    tiles = []
+    for k in range(n):
+        base = rng.integers(60, 230, 3)
+        veins = np.sin((xx * rng.uniform(2, 12) + yy * rng.uniform(2, 12)) * np.pi
+                       + rng.normal(0, 0.8, (size, size)).cumsum(axis=1) / size * 20)
+        pattern = ((xx * 8).astype(int) + (yy * 8).astype(int)) % 2 * (k % 3 == 0)
+        img = base[None, None, :] + 40 * veins[..., None] - 30 * pattern[..., None] \
+            + rng.normal(0, 8, (size, size, 3))
+        ok, buf = cv2.imencode('.jpg', np.clip(img, 0, 255).astype(np.uint8))
+        tiles.append(buf.tobytes())
+    return tiles
+
+
+def _load_tiles(folder):
+    tiles = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp')):
+            with open(os.path.join(folder, name), 'rb') as f:
+                tiles.append(f.read())
+    return tiles
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from models.image_search_model import extract_features_fast, extract_features_reference
+
+    tiles = _load_tiles(sys.argv[1]) if len(sys.argv) > 1 else _sample_tiles(40)
+    if not tiles:
+        sys.exit('No hay imágenes de muestra')
+
+    results = {}
+    for name, fn in (('reference', extract_features_reference), ('fast', extract_features_fast)):
+        fn(tiles[0])  # calentar imports
+        t = time.perf_counter()
+        results[name] = [fn(b) for b in tiles]
+        elapsed = time.perf_counter() - t
+        print(f'{name:>10}: {len(tiles) / elapsed:7.1f} img/s ({elapsed / len(tiles) * 1000:.1f} ms/img)')
+
+    diffs = [np.abs(a - b).max() for a, b in zip(results['reference'], results['fast'])
+             if a is not None and b is not None]
+    print(f'{len(tiles)} imágenes, diferencia máxima: {max(diffs):.2e}')
@@ -0,0 +1,113 @@
+# ============================================================
+# ARCHIVO: utils/feature_cache.py
+# Cache de vectores de consulta de la búsqueda visual, por
+# contenido de la imagen (SHA-256). Evita re-extraer features
+# cuando un cliente reenvía la misma foto.
+#
+#   L1: LRU acotado en memoria (por proceso)
+#   L2: Redis opcional (compartido entre workers), con TTL
+# ============================================================
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+
+QUERY_CACHE_SIZE = env_int('IMAGE_QUERY_CACHE_SIZE', 256)      # vectores por proceso (0 = sin cache)
+QUERY_CACHE_TTL = env_int('IMAGE_QUERY_CACHE_TTL', 86400)      # segundos en Redis
+
+
+class QueryFeatureCache:
+    """
+    LRU de vectores float32 indexado por hash de contenido.
+
+    Si se indica `redis_url` (redis:// o rediss://) los vectores también se
+    guardan en Redis con TTL; un fallo de Redis nunca rompe la búsqueda,
+    solo se pierde el nivel compartido.
+    """
+
+    def __init__(self, max_entries=None, redis_url=None, ttl=None, prefix='imgq'):
+        self.max_entries = QUERY_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = QUERY_CACHE_TTL if ttl is None else ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'redis_hits': 0, 'misses': 0}
+        self._redis = None
+        if redis_url and redis_url.startswith(('redis://', 'rediss://')):
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(
+                    redis_url, socket_timeout=0.2, socket_connect_timeout=0.2
+                )
+            except Exception as e:
+                logger.warning(f'Query feature cache: Redis not available ({e})')
+
+    @staticmethod
+    def make_key(image_bytes, version):
+        """Clave = versión de embeddings + SHA-256 de los bytes decodificados."""
+        return f'v{version}:{hashlib.sha256(image_bytes).hexdigest()}'
+
+    def get(self, key):
+        """Devuelve el vector cacheado o None."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return vec
+
+        raw = None
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(f'{self.prefix}:{key}')
+            except Exception as e:
+                logger.debug(f'Query feature cache: Redis get failed ({e})')
+        if raw is None:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        vec = np.frombuffer(raw, dtype=np.float32)
+        with self._lock:
+            self._stats['redis_hits'] += 1
+        self._store_local(key, vec)
+        return vec
+
+    def put(self, key, vec):
+        """Guarda un vector (se almacena como copia de solo lectura)."""
+        if self.max_entries <= 0 or vec is None:
+            return
+        vec = np.array(vec, dtype=np.float32)
+        vec.flags.writeable = False
+        self._store_local(key, vec)
+        if self._redis is not None:
+            try:
+                self._redis.set(f'{self.prefix}:{key}', vec.tobytes(), ex=self.ttl or None)
+            except Exception as e:
+                logger.debug(f'Query feature cache: Redis set failed ({e})')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), max_entries=self.max_entries,
+                        redis=self._redis is not None)
+
+    def _store_local(self, key, vec):
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,149 @@
+# ============================================================
+# ARCHIVO: utils/feature_pipeline.py
+# Extracción de features en paralelo (multiproceso) para indexar
+# imágenes de la búsqueda visual sin competir por el GIL con las
+# peticiones web.
+#
+#   lector (thread, fetchone) → cola acotada → pool de procesos
+#   → resultados al hilo que consume (escritura por lotes en BD)
+# ============================================================
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+
+# Procesos de extracción (0/1 = secuencial en el mismo hilo)
+INDEX_WORKERS = env_int('IMAGE_INDEX_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+
+_END = object()
+
+
+def _init_worker():
+    """Inicializador de cada proceso: baja prioridad y OpenCV monohilo."""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+
+
+def _extract_task(extract_fn, imagen_id, codigo, image_data):
+    """Tarea ejecutada en el proceso hijo. Nunca lanza: devuelve el error como texto."""
+    try:
+        return imagen_id, codigo, extract_fn(image_data), None
+    except Exception as e:
+        return imagen_id, codigo, None, str(e)
+
+
+def iter_cursor_rows(cursor):
+    """Recorre un cursor fila a fila con fetchone() (sin fetchall de cientos de MB)."""
+    row = cursor.fetchone()
+    while row is not None:
+        yield row
+        row = cursor.fetchone()
+
+
+def extract_parallel(rows, extract_fn, workers=None, queue_size=None):
+    """
+    Extrae features de un flujo de imágenes usando un pool de procesos.
+
+    Args:
+        rows: iterable de (imagen_id, codigo, image_data). Se consume en un
+              thread lector; las filas sin imagen se descartan.
+        extract_fn: función de extracción a nivel de módulo (picklable),
+                    recibe bytes y devuelve vector numpy o None
+        workers: nº de procesos (por defecto IMAGE_INDEX_WORKERS)
+        queue_size: tamaño de la cola lector→pool y máximo de tareas en vuelo
+
+    Yields:
+        (imagen_id, codigo, vector_o_None, error_o_None) en orden de finalización
+    """
+    workers = INDEX_WORKERS if workers is None else workers
+    if workers <= 1:
+        yield from _extract_serial(rows, extract_fn)
+        return
+
+    max_pending = queue_size or workers * 4
+    pending_rows = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    reader_error = []
+
+    def _reader():
+        try:
+            for imagen_id, codigo, image_data in rows:
+                if stop.is_set():
+                    return
+                if image_data:
+                    pending_rows.put((imagen_id, codigo, bytes(image_data)))
+        except Exception as e:
+            reader_error.append(e)
+        finally:
+            pending_rows.put(_END)
+
+    reader = threading.Thread(target=_reader, daemon=True, name='FeatureReader')
+
+    # spawn: no heredar conexiones ODBC ni locks de los threads del worker web
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker)
+    except Exception as e:
+        logger.warning(f'Process pool not available ({e}), extracting serially')
+        yield from _extract_serial(rows, extract_fn)
+        return
+
+    reader.start()
+    in_flight = set()
+    reader_done = False
+    try:
+        while in_flight or not reader_done:
+            # Rellenar hasta max_pending tareas en vuelo
+            while not reader_done and len(in_flight) < max_pending:
+                try:
+                    item = pending_rows.get(block=not in_flight)
+                except queue.Empty:
+                    break
+                if item is _END:
+                    reader_done = True
+                    break
+                in_flight.add(executor.submit(_extract_task, extract_fn, *item))
+
+            if not in_flight:
+                continue
+
+            done, in_flight = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # Proceso hijo caído (BrokenProcessPool, etc.)
+                    yield None, None, None, str(e)
+
+        if reader_error:
+            raise reader_error[0]
+    finally:
+        stop.set()
+        # Desbloquear al lector si está esperando hueco en la cola
+        while reader.is_alive():
+            try:
+                pending_rows.get_nowait()
+            except queue.Empty:
+                reader.join(timeout=0.1)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _extract_serial(rows, extract_fn):
+    for imagen_id, codigo, image_data in rows:
+        if image_data:
+            yield _extract_task(extract_fn, imagen_id, codigo, bytes(image_data))
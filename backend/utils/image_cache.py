@@ -0,0 +1,166 @@
+# ============================================================
+# ARCHIVO: utils/image_cache.py
+# Cache en disco de imágenes derivadas (redimensionadas) de
+# view_articulo_imagen, compartida entre workers.
+#
+#   {IMAGE_CACHE_DIR}/{tenant}/{imagen_id}/{variante}.{version}
+#
+# - tenant: conexión + empresa (misma clave que el índice visual)
+# - variante: tamaño/formato derivado, p.ej. 'w400.jpg'
+# - version: huella de la imagen origen (tamaño + hash de cabecera);
+#   si la imagen cambia cambia la versión y las derivadas antiguas
+#   de esa variante se borran al guardar la nueva
+#
+# Eviction LRU por tamaño total (IMAGE_CACHE_MAX_MB) usando la
+# fecha de modificación, que se actualiza en cada acierto.
+# ============================================================
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    'IMAGE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'images')
+)
+
+CACHE_MAX_BYTES = env_int('IMAGE_CACHE_MAX_MB', 512) * 1024 * 1024
+
+# No tocar la fecha de un fichero en cada acierto si se tocó hace poco
+_TOUCH_INTERVAL = 60
+
+
+def _safe(part):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(part))
+
+
+class DerivedImageCache:
+    """
+    Almacén de imágenes derivadas direccionado por contenido.
+
+    Seguro entre procesos: las escrituras van a un temporal + os.replace y
+    la eviction tolera ficheros borrados por otro worker.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._size = None          # bytes en disco (estimado, se recalcula al evictar)
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+
+    def _dir(self, tenant, imagen_id):
+        return os.path.join(self.directory, _safe(tenant), _safe(imagen_id))
+
+    def path(self, tenant, imagen_id, variant, version):
+        return os.path.join(self._dir(tenant, imagen_id), f'{_safe(variant)}.{_safe(version)}')
+
+    def get(self, tenant, imagen_id, variant, version):
+        """Devuelve los bytes de la derivada o None si no está (o es de otra versión)."""
+        path = self.path(tenant, imagen_id, variant, version)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        try:
+            if time.time() - os.path.getmtime(path) > _TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self._stats['hits'] += 1
+        return data
+
+    def exists(self, tenant, imagen_id, variant, version):
+        return os.path.exists(self.path(tenant, imagen_id, variant, version))
+
+    def put(self, tenant, imagen_id, variant, version, data):
+        """Guarda una derivada y borra las versiones anteriores de la misma variante."""
+        if not data or self.max_bytes <= 0:
+            return
+        directory = self._dir(tenant, imagen_id)
+        path = self.path(tenant, imagen_id, variant, version)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f'Derived image cache: write failed ({e})')
+            return
+
+        prefix = f'{_safe(variant)}.'
+        keep = os.path.basename(path)
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name != keep and not name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._stats['writes'] += 1
+            if self._size is not None:
+                self._size += len(data)
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def invalidate(self, tenant, imagen_id=None):
+        """Borra las derivadas de una imagen (o de todo el tenant)."""
+        target = self._dir(tenant, imagen_id) if imagen_id is not None \
+            else os.path.join(self.directory, _safe(tenant))
+        shutil.rmtree(target, ignore_errors=True)
+        with self._lock:
+            self._size = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size_bytes=self._size, max_bytes=self.max_bytes)
+
+    def _evict(self):
+        """Recorre el directorio y borra lo menos usado hasta quedar al 90% del máximo."""
+        files = []
+        total = 0
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        evicted = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            files.sort()
+            for _mtime, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._size = total
+            self._stats['evicted'] += evicted
+
+
+derived_images = DerivedImageCache()
@@ -0,0 +1,148 @@
+# ============================================================
+# ARCHIVO: utils/image_derivatives.py
+# Derivadas de las imágenes de artículos: varios tamaños y
+# formatos (WebP, AVIF si Pillow lo soporta, JPEG) guardados en la
+# cache de disco (image_cache). En segundo plano solo se precalculan
+# los tamaños de IMAGE_DERIVATIVE_PRECOMPUTE (por defecto 'grid', el
+# que pide el catálogo); thumb/detail se generan al pedirlos, así la
+# precarga no llena la cache y expulsa sus propias derivadas.
+#
+#   variante = '{tamaño}.{formato}'   p.ej. 'grid.webp'
+#
+# La entrega elige el formato según la cabecera Accept.
+# ============================================================
+
+import io
+import os
+import warnings
+
+from PIL import Image, features
+
+# Ancho máximo (px) de cada tamaño derivado
+DERIVATIVE_SIZES = {
+    'thumb': 160,    # tablas, líneas de pedido, favoritos
+    'grid': 400,     # tarjetas del catálogo
+    'detail': 1200,  # ficha / galería
+}
+
+FORMAT_MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg',
+}
+
+_QUALITY = {'avif': 60, 'webp': 80, 'jpg': 85}
+
+
+def _supported(fmt):
+    if fmt == 'jpg':
+        return True
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Pillow avisa si no conoce la feature
+        try:
+            return bool(features.check(fmt))
+        except Exception:
+            return False
+
+
+def _configured_formats():
+    wanted = os.environ.get('IMAGE_DERIVATIVE_FORMATS', 'avif,webp,jpg')
+    formats = [f.strip() for f in wanted.split(',') if f.strip() in FORMAT_MIMETYPES]
+    formats = [f for f in formats if _supported(f)]
+    if 'jpg' not in formats:
+        formats.append('jpg')  # siempre hay una variante que entiende cualquier cliente
+    return formats
+
+
+# Formatos generados, por orden de preferencia al negociar
+DERIVATIVE_FORMATS = _configured_formats()
+
+# Tamaños que se precalculan en segundo plano; el resto se genera al pedirlo
+PRECOMPUTE_SIZES = [s.strip() for s in os.environ.get('IMAGE_DERIVATIVE_PRECOMPUTE', 'grid').split(',')
+                    if s.strip() in DERIVATIVE_SIZES] or ['grid']
+
+
+def variant_name(size, fmt):
+    return f'{size}.{fmt}'
+
+
+def negotiate_format(accept_mimetypes, formats=None):
+    """
+    Elige el mejor formato aceptado por el cliente.
+
+    Solo se sirve AVIF/WebP si el cliente los nombra explícitamente en Accept
+    (un 'image/*' no garantiza que sepa decodificarlos); si no, JPEG.
+    """
+    formats = formats or DERIVATIVE_FORMATS
+    listed = {mime for mime, quality in accept_mimetypes if quality > 0}
+    for fmt in formats:
+        if fmt == 'jpg' or FORMAT_MIMETYPES[fmt] in listed:
+            return fmt
+    return 'jpg'
+
+
+def _encode(img, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpg':
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(buffer, format='JPEG', quality=_QUALITY['jpg'], optimize=True, progressive=True)
+    elif fmt == 'webp':
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        img.save(buffer, format='WEBP', quality=_QUALITY['webp'], method=4)
+    else:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        img.save(buffer, format='AVIF', quality=_QUALITY['avif'])
+    return buffer.getvalue()
+
+
+def _open(image_bytes, max_width):
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEG: decodificar directamente a escala reducida (1/2, 1/4, 1/8) si sobra resolución
+    if img.format == 'JPEG' and img.width > max_width * 2:
+        img.draft('RGB', (max_width, max(1, img.height * max_width // img.width)))
+    img.load()
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    return img
+
+
+def _resized(img, width):
+    if img.width <= width:
+        return img
+    return img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+
+
+def render(image_bytes, size, fmt):
+    """Genera una variante (tamaño de DERIVATIVE_SIZES, formato de FORMAT_MIMETYPES)."""
+    width = DERIVATIVE_SIZES[size]
+    return _encode(_resized(_open(image_bytes, width), width), fmt)
+
+
+def render_all(image_bytes, sizes=None, formats=None):
+    """
+    Genera todas las variantes de una imagen decodificándola una sola vez.
+    Función de módulo (picklable) para el pool de procesos.
+
+    Returns:
+        dict {variante: bytes}
+    """
+    sizes = sizes or list(DERIVATIVE_SIZES)
+    formats = formats or DERIVATIVE_FORMATS
+    widths = sorted(((DERIVATIVE_SIZES[s], s) for s in sizes), reverse=True)
+
+    img = _open(image_bytes, widths[0][0])
+    variants = {}
+    for width, size in widths:
+        # Cada tamaño se reduce desde el anterior (más grande): menos trabajo que desde la original
+        img = _resized(img, width)
+        for fmt in formats:
+            variants[variant_name(size, fmt)] = _encode(img, fmt)
+    return variants
+
+
+def render_precomputed(image_bytes):
+    """render_all de los tamaños de PRECOMPUTE_SIZES (picklable, para el pool de procesos)."""
+    return render_all(image_bytes, sizes=PRECOMPUTE_SIZES)
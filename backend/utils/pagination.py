@@ -0,0 +1,266 @@
+# ============================================================
+# ARCHIVO: utils/pagination.py
+# Paginación por cursor (keyset / seek) para listados grandes.
+#
+# En lugar de numerar todo el conjunto con ROW_NUMBER() en cada
+# página, el cliente devuelve un cursor opaco con la clave de
+# ordenación de la última fila recibida y la siguiente página
+# se lee con  WHERE (col, codigo) > (?, ?)  +  TOP (n).
+#
+# - El cursor es JSON en base64url; lleva la ordenación para la
+#   que se emitió y se rechaza si se usa con otra.
+# - Las claves no tienen por qué ser únicas (la vista de stock
+#   repite código por lote): se lee con TOP ... WITH TIES y la
+#   página incluye todos los empates de su última fila, así no se
+#   pierde ninguna fila entre páginas.
+# - El total es opcional y se cachea un rato por tenant + filtros.
+#
+# Totales (listing_total): el COUNT(*) de un listado se cachea
+# COUNT_CACHE_TTL segundos por tenant + consulta normalizada, así
+# las páginas siguientes del mismo filtro no vuelven a contar. Con
+# exact=False se devuelve una estimación barata: el último total
+# exacto aunque haya caducado (hasta COUNT_STALE_TTL) o un conteo
+# acotado a COUNT_ESTIMATE_CAP filas ("más de N").
+# ============================================================
+
+import base64
+import datetime
+import decimal
+import json
+import threading
+import time
+
+from utils.env import env_int
+
+
+COUNT_CACHE_TTL = env_int('COUNT_CACHE_TTL', 60)          # segundos que un total se da por exacto
+COUNT_STALE_TTL = env_int('COUNT_STALE_TTL', 900)         # segundos que sirve como estimación
+COUNT_ESTIMATE_CAP = env_int('COUNT_ESTIMATE_CAP', 1000)  # filas contadas como máximo al estimar
+
+
+# ---------------------------------------------------------
+# Cursor
+# ---------------------------------------------------------
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'d': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return datetime.date.fromisoformat(value['d'])
+        if 'n' in value:
+            return decimal.Decimal(value['n'])
+        raise ValueError('Cursor no válido')
+    return value
+
+
+def encode_cursor(order, values):
+    """
+    Cursor opaco con la clave de la última fila.
+
+    Args:
+        order: identificador de la ordenación (p.ej. 'existencias:DESC')
+        values: valores de las columnas de la clave, en orden
+    """
+    raw = json.dumps({'o': order, 'k': [_encode_value(v) for v in values]},
+                     separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, order):
+    """
+    Valores de la clave de un cursor, o None si `token` está vacío (primera página).
+
+    Raises:
+        ValueError: cursor mal formado o emitido para otra ordenación
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        values = [_decode_value(v) for v in data['k']]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError('Cursor no válido') from e
+    if data.get('o') != order:
+        raise ValueError('El cursor pertenece a otra ordenación')
+    return values
+
+
+# ---------------------------------------------------------
+# SQL
+# ---------------------------------------------------------
+
+def _after(columns, values, op):
+    if len(columns) == 1:
+        return f"{columns[0]} {op} ?", [values[0]]
+    sub, sub_params = _after(columns[1:], values[1:], op)
+    return f"({columns[0]} {op} ? OR ({columns[0]} = ? AND {sub}))", [values[0], values[0]] + sub_params
+
+
+def keyset_condition(columns, values, descending=False, nullable_first=False):
+    """
+    Condición SQL "fila posterior a `values`" para ORDER BY columns (todas
+    en la misma dirección). SQL Server no admite (a, b) > (?, ?), así que se
+    expande a comparaciones encadenadas.
+
+    Si la primera columna admite NULL se respeta el orden de SQL Server:
+    NULL primero en ASC y último en DESC. El resto de columnas no admiten NULL.
+
+    Returns:
+        (sql, params)
+    """
+    op = '<' if descending else '>'
+    first = columns[0]
+    if not nullable_first:
+        return _after(columns, values, op)
+
+    if values[0] is None:
+        if len(columns) == 1:
+            return ("1=0", []) if descending else (f"{first} IS NOT NULL", [])
+        rest, rest_params = _after(columns[1:], values[1:], op)
+        if descending:
+            return f"({first} IS NULL AND {rest})", rest_params
+        return f"(({first} IS NULL AND {rest}) OR {first} IS NOT NULL)", rest_params
+
+    sql, params = _after(columns, values, op)
+    if descending:
+        return f"({sql} OR {first} IS NULL)", params
+    return sql, params
+
+
+def split_page(rows, limit, key):
+    """
+    Corta el resultado de un TOP (limit + 1) WITH TIES en la página a devolver.
+
+    La página incluye los empates de su última fila (el cursor siguiente es
+    estrictamente mayor, así que no pueden quedarse fuera).
+
+    Returns:
+        (filas de la página, hay_mas)
+    """
+    page_end = min(limit, len(rows))
+    if page_end == 0:
+        return [], False
+    last = key(rows[page_end - 1])
+    while page_end < len(rows) and key(rows[page_end]) == last:
+        page_end += 1
+    # Si la página ha absorbido empates no se sabe si hay filas detrás: se asume que sí
+    return rows[:page_end], page_end < len(rows) or page_end > limit
+
+
+# ---------------------------------------------------------
+# Total cacheado
+# ---------------------------------------------------------
+
+class CountCache:
+    """
+    Totales de listados por (tenant, consulta, parámetros) con TTL. Sirve
+    igual para cualquier otro resultado calculado por clave (p.ej. facetas).
+    """
+
+    def __init__(self, ttl=None, max_entries=1024, stale_ttl=None):
+        self.ttl = COUNT_CACHE_TTL if ttl is None else ttl
+        self.stale_ttl = max(self.ttl, COUNT_STALE_TTL if stale_ttl is None else stale_ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def peek(self, key, max_age=None):
+        """Total cacheado con antigüedad <= max_age (default: ttl), o None."""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            hit = self._entries.get(key)
+        if hit is not None and time.monotonic() - hit[0] < max_age:
+            return hit[1]
+        return None
+
+    def put(self, key, total):
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                expired = [k for k, (t, _) in self._entries.items() if now - t >= self.stale_ttl]
+                for k in expired or list(self._entries)[:self.max_entries // 4]:
+                    self._entries.pop(k, None)
+            self._entries[key] = (now, total)
+
+    def get_or_count(self, key, count):
+        """Total cacheado de `key` o el resultado de llamar a `count()`."""
+        total = self.peek(key)
+        with self._lock:
+            self._stats['hits' if total is not None else 'misses'] += 1
+        if total is None:
+            total = count()
+            self.put(key, total)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), ttl=self.ttl)
+
+
+count_cache = CountCache()
+
+
+def _tenant():
+    from flask import session, has_request_context
+    return session.get('connection') if has_request_context() else None
+
+
+def _normalize(params):
+    # Las collations del ERP no distinguen mayúsculas: 'ABC' y 'abc' cuentan lo mismo
+    return tuple(p.casefold() if isinstance(p, str) else p for p in params)
+
+
+def listing_total(cursor, from_sql, where, params, exact=True, cache=None):
+    """
+    Total de `SELECT COUNT(*) FROM {from_sql} WHERE {where}`, cacheado por
+    tenant (conexión de sesión) + consulta + parámetros normalizados.
+
+    Args:
+        exact: False = estimación: total exacto anterior (aunque haya
+            caducado) o conteo acotado a COUNT_ESTIMATE_CAP filas
+
+    Returns:
+        (total, es_exacto). Si no es exacto, hay al menos `total` filas.
+    """
+    cache = cache or count_cache
+    key = (_tenant(), from_sql, where, _normalize(params))
+
+    def count():
+        cursor.execute(f"SELECT COUNT(*) FROM {from_sql} WHERE {where}", params)
+        return cursor.fetchone()[0]
+
+    if exact:
+        return cache.get_or_count(key, count), True
+
+    total = cache.peek(key)
+    if total is not None:
+        return total, True
+    total = cache.peek(key, cache.stale_ttl)
+    if total is not None:
+        return total, False
+
+    # Conteo acotado: el motor deja de leer al llegar al tope
+    cursor.execute(f"SELECT COUNT(*) FROM (SELECT TOP (?) 1 AS x FROM {from_sql} WHERE {where}) t",
+                   [COUNT_ESTIMATE_CAP + 1] + list(params))
+    total = cursor.fetchone()[0]
+    if total <= COUNT_ESTIMATE_CAP:
+        cache.put(key, total)
+        return total, True
+    return COUNT_ESTIMATE_CAP, False
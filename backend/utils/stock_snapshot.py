@@ -0,0 +1,620 @@
+# ============================================================
+# ARCHIVO: utils/stock_snapshot.py
+# Snapshot en memoria de view_externos_stock por tenant
+# (conexión + empresa ERP), guardado por columnas (arrays NumPy)
+# e indexado por código. Resuelve filtros, ordenación,
+# paginación, valores únicos y resumen sin consultar la vista,
+# que es un join lento del ERP.
+#
+# Refresco incremental:
+#   - cada STOCK_SNAPSHOT_REFRESH segundos se consulta la firma
+#     (CHECKSUM_AGG + COUNT) de cada código y solo se releen las
+#     filas de los códigos nuevos o cambiados
+#   - cada STOCK_SNAPSHOT_MAX_AGE segundos, recarga completa
+#     (cubre posibles colisiones de checksum)
+#
+# Solo la primera carga se hace en la petición. Los refrescos
+# (firmas, filas cambiadas, snapshot e índice de texto nuevos) se
+# hacen en un hilo de fondo y el snapshot nuevo sustituye al
+# anterior al terminar; mientras, se sigue sirviendo el anterior.
+#
+# La búsqueda de texto (operador 'text') usa un índice invertido
+# (utils/text_index.py) que se construye con el snapshot, así que
+# se rehace cada vez que el stock cambia.
+# ============================================================
+
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from utils.text_index import TextIndex
+from utils.env import env_int
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_ENABLED = os.environ.get('STOCK_SNAPSHOT', 'true').lower() in ('1', 'true', 'yes')
+SNAPSHOT_REFRESH = env_int('STOCK_SNAPSHOT_REFRESH', 10)      # segundos entre comprobaciones
+SNAPSHOT_MAX_AGE = env_int('STOCK_SNAPSHOT_MAX_AGE', 600)     # segundos hasta recarga completa
+
+
+class SnapshotUnsupported(Exception):
+    """El filtro no se puede resolver en memoria con la misma semántica que SQL."""
+
+
+def _fold(value):
+    """Forma comparable bajo la collation CI de SQL Server (sin espacios finales)."""
+    return value.rstrip().casefold() if isinstance(value, str) else ''
+
+
+def _collation_key(value):
+    """Clave de ordenación aproximada a Latin1_General_CI_AS: letra base y después acento."""
+    folded = _fold(value)
+    base = ''.join(c for c in unicodedata.normalize('NFD', folded) if not unicodedata.combining(c))
+    return f'{base}\x00{folded}'
+
+
+def _like_matcher(pattern):
+    """
+    Función (texto normalizado -> bool) equivalente a `LIKE pattern`
+    con collation CI. Soporta los comodines % y _ (no las clases [..]).
+    """
+    if '[' in pattern:
+        raise SnapshotUnsupported('LIKE con clases [..]')
+    p = pattern.casefold()
+    core = p.strip('%')
+    if '%' not in core and '_' not in core:
+        if p.startswith('%') and p.endswith('%') and len(p) > 1:
+            return lambda s: core in s
+        if p.endswith('%'):
+            return lambda s: s.startswith(core)
+        if p.startswith('%'):
+            return lambda s: s.endswith(core)
+        return lambda s: s == core
+    regex = re.compile(''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in p), re.S)
+    return lambda s: regex.fullmatch(s) is not None
+
+
+def _between_bounds(valor):
+    """Mismo reparto 'desde,hasta' que StockModel._build_filter_condition."""
+    partes = valor.split(',') if ',' in valor else [valor, valor]
+    desde = partes[0] if partes[0] else None
+    hasta = partes[1] if len(partes) > 1 and partes[1] else None
+    return desde, hasta
+
+
+class StockSnapshot:
+    """
+    Filas de la vista de una empresa, por columnas. Inmutable: un refresco
+    construye un snapshot nuevo a partir de las filas crudas.
+
+    Args:
+        rows: filas crudas (tuplas en el orden de `fields`)
+        fields: nombres de columna de cada fila
+        to_record: fila cruda -> dict de salida (mismo formato que el SQL)
+        signatures: {codigo crudo: firma} de la consulta de cambios
+        numeric: columnas numéricas (el resto se tratan como texto)
+    """
+
+    def __init__(self, rows, fields, to_record, signatures=None, numeric=(), key='codigo'):
+        self.rows = list(rows)
+        self.fields = tuple(fields)
+        self.to_record = to_record
+        self.signatures = dict(signatures or {})
+        self.numeric = frozenset(numeric)
+        self.key = key
+        self.created = time.time()
+
+        records = [to_record(row) for row in self.rows]
+        self.record_fields = tuple(records[0]) if records else ()
+        self.columns = {}
+        for name in self.record_fields:
+            values = [rec[name] for rec in records]
+            self.columns[name] = np.array(values, dtype=np.float64 if name in self.numeric else object)
+
+        # NULL real de la vista (el dict de salida convierte los NULL numéricos en 0)
+        self.nulls = {}
+        self.numbers = {}
+        for pos, name in enumerate(self.fields):
+            null = np.fromiter((row[pos] is None for row in self.rows), dtype=bool, count=len(self.rows))
+            self.nulls[name] = null
+            if name in self.numeric and name in self.columns:
+                self.numbers[name] = np.where(null, np.nan, self.columns[name])
+
+        key_pos = self.fields.index(key)
+        self.index = {}
+        for i, row in enumerate(self.rows):
+            self.index.setdefault(_fold(row[key_pos]), []).append(i)
+
+        self._lock = threading.Lock()
+        self._folded = {}
+        self._sort_keys = {}
+        self._orders = {}
+        self._factors = {}
+        self._text_indexes = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    # ---------- acceso ----------
+
+    def records(self, positions=None):
+        """Dicts nuevos (el llamante puede modificarlos, p.ej. al inyectar precios)."""
+        if positions is None:
+            positions = np.arange(len(self.rows))
+        columns = [self.columns[name][positions].tolist() for name in self.record_fields]
+        return [dict(zip(self.record_fields, values)) for values in zip(*columns)]
+
+    def get(self, codigo):
+        """Primera fila del código (mismas reglas de igualdad que `codigo = ?`)."""
+        positions = self.index.get(_fold(codigo))
+        return self.records(positions[:1])[0] if positions else None
+
+    # ---------- índices derivados (perezosos, cacheados) ----------
+
+    def _folded_column(self, name):
+        with self._lock:
+            folded = self._folded.get(name)
+        if folded is None:
+            folded = [_fold(v) for v in self.columns[name]]
+            with self._lock:
+                self._folded[name] = folded
+        return folded
+
+    def _sort_key_column(self, name):
+        with self._lock:
+            keys = self._sort_keys.get(name)
+        if keys is None:
+            keys = [_collation_key(v) for v in self.columns[name]]
+            with self._lock:
+                self._sort_keys[name] = keys
+        return keys
+
+    def order(self, name):
+        """
+        Posiciones en orden ascendente de la columna (NULL primero, como SQL
+        Server); los empates se deshacen por código, igual que la paginación
+        por cursor (ORDER BY columna, codigo).
+        """
+        with self._lock:
+            order = self._orders.get(name)
+        if order is not None:
+            return order
+        null = self.nulls[name]
+        codes = self._sort_key_column(self.key)
+        if name == self.key:
+            order = np.array(sorted(range(len(codes)), key=lambda i: (not null[i], codes[i])), dtype=np.intp)
+        elif name in self.numeric:
+            code_rank = np.empty(len(codes), dtype=np.intp)
+            code_rank[self.order(self.key)] = np.arange(len(codes))
+            values = np.where(null, 0.0, self.columns[name])
+            order = np.lexsort((code_rank, values, ~null))
+        else:
+            keys = self._sort_key_column(name)
+            order = np.array(sorted(range(len(keys)), key=lambda i: (not null[i], keys[i], codes[i])),
+                             dtype=np.intp)
+        with self._lock:
+            self._orders[name] = order
+        return order
+
+    def codigos(self, keys):
+        """Códigos tal como vienen en los dicts de salida, de claves de self.index."""
+        codes = self.columns[self.key]
+        return [codes[self.index[k][0]] for k in keys]
+
+    def text_index(self, fields):
+        """
+        Índice de texto sobre `fields` (se construye la primera vez). Las
+        claves son las de self.index (código normalizado).
+        """
+        return self._text_index(fields)[0]
+
+    def _text_index(self, fields):
+        fields = tuple(fields)
+        with self._lock:
+            cached = self._text_indexes.get(fields)
+        if cached is None:
+            columns = [self.columns[name] for name in fields]
+            key_pos = self.fields.index(self.key)
+            keys = [_fold(row[key_pos]) for row in self.rows]
+            index = TextIndex((key, [column[i] for column in columns]) for i, key in enumerate(keys))
+            # Documento de cada fila, para pasar de documentos a máscara de filas con NumPy
+            row_doc = np.fromiter((index.doc_ids[key] for key in keys), dtype=np.intp, count=len(keys))
+            cached = (index, row_doc)
+            with self._lock:
+                self._text_indexes[fields] = cached
+        return cached
+
+    def _seek_key(self, name, value, codigo):
+        """Clave (no nulo, valor, código) comparable con el orden de order()."""
+        if value is None:
+            column_key = 0.0 if name in self.numeric else ''
+        else:
+            column_key = float(value) if name in self.numeric else _collation_key(value)
+        return (value is not None, column_key, _collation_key(codigo))
+
+    # ---------- filtros ----------
+
+    def match(self, columna, operador, valor):
+        """Máscara de filas que cumplen la condición. NULL nunca cumple (lógica SQL)."""
+        if columna in self.numeric:
+            mask = self._match_number(columna, operador, valor)
+        else:
+            mask = self._match_text(columna, operador, valor)
+        return mask & ~self.nulls[columna]
+
+    def _match_number(self, columna, operador, valor):
+        values = self.numbers[columna]
+        if operador in ('between', 'not_between'):
+            desde, hasta = _between_bounds(str(valor))
+            desde = float(desde) if desde else None
+            hasta = float(hasta) if hasta else None
+            if desde is None and hasta is None:
+                return np.ones(len(values), dtype=bool)
+            lo = values >= desde if desde is not None else np.ones(len(values), dtype=bool)
+            hi = values <= hasta if hasta is not None else np.ones(len(values), dtype=bool)
+            if operador == 'between':
+                return lo & hi
+            if desde is not None and hasta is not None:
+                return (values < desde) | (values > hasta)
+            return ~lo if desde is not None else ~hi
+        compare = {
+            'eq': np.equal, 'neq': np.not_equal,
+            'gt': np.greater, 'gte': np.greater_equal,
+            'lt': np.less, 'lte': np.less_equal,
+        }.get(operador)
+        if compare is None:
+            raise SnapshotUnsupported(f'{operador} sobre columna numérica')
+        return compare(values, float(valor))
+
+    def _match_text(self, columna, operador, valor):
+        valor = str(valor)
+        like = {
+            'contains': f'%{valor}%', 'not_contains': f'%{valor}%',
+            'starts': f'{valor}%', 'not_starts': f'{valor}%',
+            'ends': f'%{valor}', 'not_ends': f'%{valor}',
+        }
+        if operador in like:
+            matcher = _like_matcher(like[operador])
+            mask = np.fromiter((matcher(s) for s in self._folded_column(columna)), dtype=bool,
+                               count=len(self.rows))
+            return ~mask if operador.startswith('not_') else mask
+
+        if operador in ('eq', 'neq'):
+            target = _fold(valor)
+            mask = np.fromiter((s == target for s in self._folded_column(columna)), dtype=bool,
+                               count=len(self.rows))
+            return ~mask if operador == 'neq' else mask
+
+        keys = self._sort_key_column(columna)
+
+        def compare(op, bound):
+            bound = _collation_key(bound)
+            return np.fromiter((op(k, bound) for k in keys), dtype=bool, count=len(keys))
+
+        if operador in ('between', 'not_between'):
+            desde, hasta = _between_bounds(valor)
+            if desde and hasta:
+                if operador == 'between':
+                    return compare(str.__ge__, desde) & compare(str.__le__, hasta)
+                return compare(str.__lt__, desde) | compare(str.__gt__, hasta)
+            if desde:
+                return compare(str.__ge__ if operador == 'between' else str.__lt__, desde)
+            if hasta:
+                return compare(str.__le__ if operador == 'between' else str.__gt__, hasta)
+            return np.ones(len(self.rows), dtype=bool)
+
+        ops = {'gt': str.__gt__, 'gte': str.__ge__, 'lt': str.__lt__, 'lte': str.__le__}
+        if operador not in ops:
+            raise SnapshotUnsupported(operador)
+        return compare(ops[operador], valor)
+
+    def _match_text_index(self, columnas, valor):
+        index, row_doc = self._text_index(columnas)
+        docs = np.zeros(len(index), dtype=bool)
+        docs[list(index.match(str(valor)))] = True
+        return docs[row_doc]
+
+    def filter(self, condiciones):
+        """
+        Máscara de las filas que cumplen todas las condiciones.
+
+        Args:
+            condiciones: lista de (columnas, operador, valor); con varias
+                columnas basta con que cumpla una (OR). El operador 'text'
+                busca todas las palabras de `valor` en el índice de texto
+        """
+        mask = np.ones(len(self.rows), dtype=bool)
+        for columnas, operador, valor in condiciones:
+            if operador == 'text':
+                mask &= self._match_text_index(columnas, valor)
+                continue
+            any_col = np.zeros(len(self.rows), dtype=bool)
+            for columna in columnas:
+                any_col |= self.match(columna, operador, valor)
+            mask &= any_col
+        return mask
+
+    # ---------- consultas ----------
+
+    def select(self, condiciones, order_by, descending=False):
+        """Posiciones de las filas que cumplen los filtros, ya ordenadas."""
+        mask = self.filter(condiciones)
+        order = self.order(order_by)
+        if descending:
+            order = order[::-1]
+        return order[mask[order]]
+
+    def search(self, condiciones, order_by, descending=False, offset=0, limit=None):
+        """
+        Returns:
+            (lista de dicts de la página, total de filas que cumplen los filtros)
+        """
+        selected = self.select(condiciones, order_by, descending)
+        page = selected[offset:offset + limit] if limit is not None else selected
+        return self.records(page), len(selected)
+
+    def seek(self, condiciones, order_by, descending=False, after=None, limit=50):
+        """
+        Página por cursor: filas posteriores a `after` = (valor, codigo) de la
+        última fila recibida, con los empates de la última fila incluidos.
+
+        Returns:
+            (lista de dicts, total que cumple los filtros, hay_mas,
+             clave (valor, codigo) de la última fila o None)
+        """
+        mask = self.filter(condiciones)
+        order = self.order(order_by)
+        selected = order[mask[order]]
+        values = self.columns[order_by]
+        nulls = self.nulls[order_by]
+        codes = self.columns[self.key]
+
+        def row_key(i):
+            return self._seek_key(order_by, None if nulls[i] else values[i], codes[i])
+
+        if descending:
+            end = len(selected) if after is None else \
+                bisect.bisect_left(selected, self._seek_key(order_by, *after), key=row_key)
+            candidates = selected[:end][::-1]
+        else:
+            start = 0 if after is None else \
+                bisect.bisect_right(selected, self._seek_key(order_by, *after), key=row_key)
+            candidates = selected[start:]
+
+        end = min(limit, len(candidates))
+        if end:
+            last = row_key(candidates[end - 1])
+            while end < len(candidates) and row_key(candidates[end]) == last:
+                end += 1
+        last_key = None
+        if end:
+            # Clave con el valor real (NULL incluido), no el del dict de salida
+            i = candidates[end - 1]
+            last_key = (None if nulls[i] else values[[i]].tolist()[0], codes[i])
+        return self.records(candidates[:end]), len(selected), end < len(candidates), last_key
+
+    def distinct(self, columna, limite):
+        """Valores distintos ordenados, sin NULL ni vacíos (como DISTINCT + `<> ''`)."""
+        values = self.columns[columna]
+        null = self.nulls[columna]
+        seen = set()
+        result = []
+        for i in self.order(columna):
+            if len(result) >= limite:
+                break
+            if null[i]:
+                continue
+            value = values[i]
+            if columna in self.numeric:
+                value = float(value)
+                marker = value
+                if value == 0:  # '' se convierte a 0 al comparar con una columna numérica
+                    continue
+            else:
+                marker = _fold(value)
+                if not marker:
+                    continue
+            if marker not in seen:
+                seen.add(marker)
+                result.append(value)
+        return result
+
+    def _factor(self, columna):
+        """
+        Código entero de cada fila para su valor (mismo código para valores
+        iguales bajo la collation), en orden ascendente, y el valor de cada
+        código. NULL y vacíos (0 en numéricas) llevan -1, como en distinct().
+        """
+        with self._lock:
+            cached = self._factors.get(columna)
+        if cached is not None:
+            return cached
+        codes = np.full(len(self.rows), -1, dtype=np.intp)
+        labels = []
+        values = self.columns[columna]
+        null = self.nulls[columna]
+        previous = None
+        for i in self.order(columna):
+            if null[i]:
+                continue
+            if columna in self.numeric:
+                value = float(values[i])
+                marker = value
+                if value == 0:
+                    continue
+            else:
+                value = values[i]
+                marker = _fold(value)
+                if not marker:
+                    continue
+            if marker != previous:
+                labels.append(value)
+                previous = marker
+            codes[i] = len(labels) - 1
+        cached = (codes, labels)
+        with self._lock:
+            self._factors[columna] = cached
+        return cached
+
+    def facets(self, condiciones, columnas, limite):
+        """
+        Valores distintos con su número de filas, por columna, sobre las filas
+        que cumplen las condiciones (se filtra una sola vez para todas).
+
+        Returns:
+            (filas que cumplen, {columna: [(valor, filas), ...]} en orden ascendente)
+        """
+        mask = self.filter(condiciones)
+        result = {}
+        for columna in columnas:
+            codes, labels = self._factor(columna)
+            counts = np.bincount(codes[mask & (codes >= 0)], minlength=len(labels))
+            result[columna] = [(labels[c], int(counts[c])) for c in np.flatnonzero(counts)[:limite]]
+        return int(mask.sum()), result
+
+    def aggregate(self, columna):
+        """COUNT(*), SUM, AVG, MIN y MAX de una columna numérica (ignorando NULL)."""
+        values = self.numbers[columna][~self.nulls[columna]]
+        if not len(values):
+            return len(self.rows), None, None, None, None
+        return len(self.rows), float(values.sum()), float(values.mean()), \
+            float(values.min()), float(values.max())
+
+
+class SnapshotStore:
+    """
+    Snapshots por tenant con refresco incremental.
+
+    El origen de datos (`source`) lo pone el modelo y debe ofrecer:
+        signatures() -> {codigo crudo: firma}
+        load(codigos=None) -> filas crudas (de esos códigos o todas)
+        build(rows, signatures) -> StockSnapshot
+    """
+
+    def __init__(self, refresh=None, max_age=None):
+        self.refresh = SNAPSHOT_REFRESH if refresh is None else refresh
+        self.max_age = SNAPSHOT_MAX_AGE if max_age is None else max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {'hits': 0, 'checks': 0, 'incremental': 0, 'full': 0, 'errors': 0}
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    'lock': threading.Lock(), 'snapshot': None, 'checked': 0.0, 'loaded': 0.0,
+                    'thread': None,
+                }
+            return entry
+
+    def get(self, key, source):
+        """Snapshot vigente del tenant, refrescándolo si toca."""
+        entry = self._entry(key)
+        snapshot = entry['snapshot']
+        if snapshot is not None and time.monotonic() - entry['checked'] < self.refresh:
+            with self._lock:
+                self._stats['hits'] += 1
+            return snapshot
+
+        # Si ya hay snapshot no se espera: se refresca en segundo plano (o ya lo hace otro hilo)
+        if not entry['lock'].acquire(blocking=snapshot is None):
+            return snapshot
+        if snapshot is not None:
+            entry['thread'] = threading.Thread(target=self._refresh, args=(key, entry, source),
+                                               daemon=True, name='StockSnapshotRefresh')
+            entry['thread'].start()
+            return snapshot
+        try:
+            snapshot = entry['snapshot']
+            if snapshot is not None:
+                return snapshot
+            try:
+                snapshot = self._full(source)
+            except Exception:
+                with self._lock:
+                    self._stats['errors'] += 1
+                raise
+            entry['snapshot'] = snapshot
+            entry['checked'] = entry['loaded'] = time.monotonic()
+            return snapshot
+        finally:
+            entry['lock'].release()
+
+    def _refresh(self, key, entry, source):
+        """Refresco en segundo plano (con entry['lock'] ya tomado): sustituye el snapshot al terminar."""
+        try:
+            now = time.monotonic()
+            if now - entry['checked'] < self.refresh:
+                return
+            try:
+                if now - entry['loaded'] >= self.max_age:
+                    snapshot = self._full(source)
+                    entry['loaded'] = now
+                else:
+                    snapshot = self._incremental(entry['snapshot'], source)
+                entry['snapshot'] = snapshot
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.warning(f'Stock snapshot {key}: refresh failed, serving previous ({e})')
+            entry['checked'] = now
+        finally:
+            entry['lock'].release()
+
+    def wait(self, key, timeout=None):
+        """Espera a que termine el refresco en curso de un tenant (tests y scripts)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        thread = entry.get('thread') if entry else None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _full(self, source):
+        # Firmas antes que filas: un cambio entre ambas se detecta en la siguiente comprobación
+        signatures = source.signatures()
+        snapshot = source.build(source.load(), signatures)
+        with self._lock:
+            self._stats['full'] += 1
+        return snapshot
+
+    def _incremental(self, snapshot, source):
+        signatures = source.signatures()
+        with self._lock:
+            self._stats['checks'] += 1
+        previous = snapshot.signatures
+        changed = [c for c, sig in signatures.items() if previous.get(c) != sig]
+        removed = previous.keys() - signatures.keys()
+        if not changed and not removed:
+            return snapshot
+        if len(changed) > len(signatures) // 2:
+            return self._full(source)
+
+        key_pos = snapshot.fields.index(snapshot.key)
+        stale = set(changed) | removed
+        rows = [row for row in snapshot.rows if row[key_pos] not in stale]
+        rows.extend(source.load(changed) if changed else [])
+        with self._lock:
+            self._stats['incremental'] += 1
+        logger.debug(f'Stock snapshot: {len(changed)} changed, {len(removed)} removed codes')
+        return source.build(rows, signatures)
+
+    def invalidate(self, key=None):
+        """Descarta el snapshot de un tenant (o todos); se recarga en la siguiente consulta."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            sizes = {k: len(e['snapshot']) for k, e in self._entries.items() if e['snapshot'] is not None}
+            return dict(self._stats, tenants=sizes, refresh=self.refresh, max_age=self.max_age)
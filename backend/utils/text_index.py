@@ -0,0 +1,147 @@
+# ============================================================
+# ARCHIVO: utils/text_index.py
+# Índice invertido en memoria para la búsqueda "inteligente" de
+# artículos (cuadro de búsqueda / type-ahead).
+#
+# Cada documento es un código de artículo con el texto de sus
+# columnas (código, descripción, formato, serie, color). El texto
+# se normaliza sin acentos ni mayúsculas y se parte en tokens.
+#
+# Cada palabra buscada encuentra tokens por:
+#   - prefijo o subcadena (vocabulario ordenado + trigramas),
+#     como el LIKE '%palabra%' anterior
+#   - si no hay ninguno, por parecido de trigramas (erratas:
+#     'porcelanco' -> 'porcelanico')
+# Un documento cumple si cumple todas las palabras.
+#
+# El índice es inmutable: se construye junto al snapshot de
+# stock del tenant y se rehace cuando el stock cambia.
+# ============================================================
+
+import bisect
+import re
+import unicodedata
+
+# Parecido mínimo (Jaccard de trigramas) para aceptar un token por errata
+FUZZY_MIN_SIMILARITY = 0.45
+# Palabras más cortas no se buscan por errata (demasiado ambiguas)
+FUZZY_MIN_LENGTH = 4
+# Tokens por errata como máximo para una palabra (los más parecidos)
+FUZZY_MAX_TOKENS = 20
+
+_TOKEN = re.compile(r'\w+')
+
+
+def fold_text(value):
+    """Texto sin acentos y en minúsculas ('Porcelánico' -> 'porcelanico')."""
+    if not isinstance(value, str):
+        return ''
+    decomposed = unicodedata.normalize('NFD', value.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(value):
+    return _TOKEN.findall(fold_text(value))
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class TextIndex:
+    """
+    Índice de documentos (clave -> textos).
+
+    Args:
+        documents: iterable de (clave, [textos]); claves repetidas
+            acumulan sus textos en el mismo documento
+    """
+
+    def __init__(self, documents):
+        self.keys = []
+        self.doc_ids = {}       # clave -> id de documento
+        postings = {}
+        for key, texts in documents:
+            doc = self.doc_ids.get(key)
+            if doc is None:
+                doc = self.doc_ids[key] = len(self.keys)
+                self.keys.append(key)
+            for text in texts:
+                for token in tokenize(text):
+                    postings.setdefault(token, set()).add(doc)
+
+        self.vocabulary = sorted(postings)
+        self.postings = [frozenset(postings[token]) for token in self.vocabulary]
+        self.trigrams = {}
+        for token_id, token in enumerate(self.vocabulary):
+            for trigram in _trigrams(token):
+                self.trigrams.setdefault(trigram, []).append(token_id)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _containing(self, word):
+        """Ids de los tokens que contienen `word` (prefijo incluido)."""
+        if len(word) < 3:
+            # Pocas letras: prefijos por bisección y el resto recorriendo el vocabulario
+            start = bisect.bisect_left(self.vocabulary, word)
+            end = bisect.bisect_left(self.vocabulary, word + '\U0010ffff')
+            prefixed = set(range(start, end))
+            return prefixed | {i for i, token in enumerate(self.vocabulary)
+                               if i not in prefixed and word in token}
+
+        candidates = None
+        for trigram in _trigrams(word):
+            ids = self.trigrams.get(trigram)
+            if not ids:
+                return set()
+            candidates = set(ids) if candidates is None else candidates.intersection(ids)
+            if not candidates:
+                return set()
+        return {i for i in candidates if word in self.vocabulary[i]}
+
+    def _similar(self, word):
+        """Ids de los tokens más parecidos a `word` (búsqueda con erratas)."""
+        if len(word) < FUZZY_MIN_LENGTH:
+            return set()
+        grams = _trigrams(word)
+        shared = {}
+        for trigram in grams:
+            for token_id in self.trigrams.get(trigram, ()):
+                shared[token_id] = shared.get(token_id, 0) + 1
+
+        scored = []
+        for token_id, common in shared.items():
+            token_grams = len(self.vocabulary[token_id]) - 2
+            similarity = common / (len(grams) + token_grams - common)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((similarity, token_id))
+        scored.sort(reverse=True)
+        return {token_id for _, token_id in scored[:FUZZY_MAX_TOKENS]}
+
+    def terms(self, word):
+        """Tokens del vocabulario con los que casa una palabra ya normalizada."""
+        return [self.vocabulary[i] for i in sorted(self._containing(word) or self._similar(word))]
+
+    def match(self, query):
+        """Ids de los documentos que casan con todas las palabras de `query`."""
+        docs = None
+        # Palabras largas primero: suelen ser las más selectivas
+        for word in sorted(set(tokenize(query)), key=len, reverse=True):
+            ids = self._containing(word) or self._similar(word)
+            matched = set()
+            for token_id in ids:
+                matched.update(self.postings[token_id])
+            docs = matched if docs is None else docs & matched
+            if not docs:
+                return set()
+        return docs or set()
+
+    def search(self, query):
+        """
+        Claves de los documentos que casan con todas las palabras de `query`.
+
+        Returns:
+            set de claves (vacío si la consulta no tiene palabras)
+        """
+        return {self.keys[doc] for doc in self.match(query)}
@@ -1211,7 +1211,7 @@ async function cargarThumbnailsBatch(codigos) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ codigos: codigos, quality: gridConImagenes ? 'grid' : 'thumb' })
+            body: JSON.stringify({ codigos: codigos, quality: gridConImagenes ? 'grid' : 'thumb', format: 'url' })
         });
 
         if (response.ok) {
@@ -1222,7 +1222,7 @@ async function cargarThumbnailsBatch(codigos) {
                 const codigoImg = imgElement.dataset.codigo.trim();
                 const imagen = thumbnails[codigoImg];
                 if (imagen && !imgElement.classList.contains('loaded')) {
-                    imgElement.src = `data:image/jpeg;base64,${imagen}`;
+                    imgElement.src = `${API_URL}${imagen}`;
                     imgElement.classList.add('loaded');
                 }
             });